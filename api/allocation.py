@@ -0,0 +1,102 @@
+class MaxRunTree:
+    """
+    Segment tree over the rows of a rank holding the longest run of contiguous empty seats of each row
+
+    Finding the first row with a run of at least N empty seats and updating a row after a reservation
+        are both O(log rows)
+    """
+
+    def __init__(self, values: list):
+        self.size = 1
+
+        while self.size < len(values):
+            self.size *= 2
+
+        self.tree = [0] * (2 * self.size)
+        self.tree[self.size:self.size + len(values)] = values
+
+        for node in range(self.size - 1, 0, -1):
+            self.tree[node] = max(self.tree[2 * node], self.tree[2 * node + 1])
+
+    def update(self, position: int, value: int) -> None:
+        """
+        Sets the value of the row in position and of every node above it
+        """
+        node = self.size + position
+        self.tree[node] = value
+        node //= 2
+
+        while node:
+            self.tree[node] = max(self.tree[2 * node], self.tree[2 * node + 1])
+            node //= 2
+
+    def find_first(self, minimum: int, start: int = 0) -> int:
+        """
+        The first position from start on with a value of at least minimum, or None if there is none
+        """
+        return self._find_first(1, 0, self.size, minimum, start)
+
+    def _find_first(self, node: int, low: int, high: int, minimum: int, start: int) -> int:
+        if high <= start or self.tree[node] < minimum:
+            return None
+
+        if high - low == 1:
+            return low
+
+        middle = (low + high) // 2
+        position = self._find_first(2 * node, low, middle, minimum, start)
+
+        if position is None:
+            position = self._find_first(2 * node + 1, middle, high, minimum, start)
+
+        return position
+
+
+class RankAllocator:
+    """
+    Seats groups of people in the rows of a rank
+
+    A group is seated together in the first row with a run of at least as many empty seats as people
+        (see Row.make_reservation for the run picked inside the row). Only when no row of the rank can
+        seat the group together it is split, going through the rows with empty seats in order
+    """
+
+    def __init__(self, rows: list):
+        self.rows = rows
+        self.tree = MaxRunTree([row.max_run for row in rows])
+
+    def refresh(self, position: int) -> None:
+        """
+        Updates the allocator after seats of the row in position were taken or freed
+        """
+        self.tree.update(position, self.rows[position].max_run)
+
+    def make_reservation(self, num_people: int, **kwargs) -> tuple:
+        """
+        Seats a group of num_people and returns the number of people left without a seat along with
+            the positions of the rows where people were seated
+
+        Any other argument is passed on to Row.make_reservation
+        """
+        to_seat = num_people
+        changed_rows = []
+
+        if to_seat == 0:
+            return to_seat, changed_rows
+
+        position = self.tree.find_first(num_people)
+
+        if position is None:  # no row can seat the group together, let's split it
+            position = self.tree.find_first(1)
+
+        while position is not None and to_seat > 0:
+            seated = self.rows[position].make_reservation(num_people, to_seat, **kwargs)
+
+            if seated:
+                to_seat -= seated
+                changed_rows.append(position)
+                self.refresh(position)
+
+            position = self.tree.find_first(1, position + 1)
+
+        return to_seat, changed_rows
@@ -1,5 +1,12 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class ApiConfig(AppConfig):
     name = 'api'
+
+    def ready(self):
+        if settings.EVENT_ENGINE:
+            from api import engine
+
+            engine.check_partitions()
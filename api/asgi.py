@@ -0,0 +1,563 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import json
+from json.decoder import JSONDecodeError
+import logging
+import os
+import re
+import time
+from urllib.parse import parse_qs
+
+from bson import ObjectId
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+from api import engine, stats
+from api.cache import cache_key, caching_chunks, response_cache
+from api.exceptions import ConflictException, NotFoundException, UnavailableException
+from api.holds import sweeper
+from api.models import Event
+from api.serializers import event_json, iter_chunks
+from api.streams import KEEP_ALIVE, AsyncSubscriber, ChangeStream, broadcaster
+
+logger = logging.getLogger(__name__)
+
+EVENT_PATH = r'^/api/1\.0/venue/(?P<venue_id>[a-zA-Z0-9]+)/event/(?P<event_id>[a-zA-Z0-9]+)'
+
+
+class AsyncCollection:
+    """
+    Runs the calls of a pymongo collection in a thread pool, standing in for motor when it isn't installed
+    """
+
+    def __init__(self, collection, executor):
+        self.collection = collection
+        self.executor = executor
+
+    async def find_one(self, *args, **kwargs):
+        return await asyncio.get_event_loop().run_in_executor(
+            self.executor, partial(self.collection.find_one, *args, **kwargs)
+        )
+
+    async def update_one(self, *args, **kwargs):
+        return await asyncio.get_event_loop().run_in_executor(
+            self.executor, partial(self.collection.update_one, *args, **kwargs)
+        )
+
+
+async def run_sync(func, *args):
+    """
+    Runs a blocking call in the default executor of the event loop
+    """
+    return await asyncio.get_event_loop().run_in_executor(None, partial(func, *args))
+
+
+def get_collection():
+    """
+    The event collection for asyncio, through motor when it is installed
+    """
+    try:
+        from motor.motor_asyncio import AsyncIOMotorClient
+    except ImportError:
+        return AsyncCollection(Event._get_collection(), ThreadPoolExecutor(settings.ASYNC_DB_THREADS))
+
+    database = settings.MONGODB_DATABASES[os.environ.get('ENV', 'default')]
+    client = AsyncIOMotorClient(database.get('host'), database.get('port'))
+
+    return client[database['db']][Event._get_collection_name()]
+
+
+def event_query(venue_id: str, event_id: str) -> dict:
+    if not ObjectId.is_valid(venue_id) or not ObjectId.is_valid(event_id):
+        raise NotFoundException
+
+    return {'_id': ObjectId(event_id), 'venue_id': ObjectId(venue_id)}
+
+
+async def load_event(collection, venue_id: str, event_id: str, sections: list = None) -> Event:
+    """
+    Get an event occurring in a venue as Event.get does
+    """
+    if sections is None:
+        projection = {'changes': 0}
+    else:
+        projection = dict.fromkeys(['venue_id', 'compact', 'version', 'seat_counts'] + [
+            f'{field}.{section_type}' for section_type in sections for field in ('sections', 'seat_states')
+        ], 1)
+
+    document = await collection.find_one(event_query(venue_id, event_id), projection)
+
+    if document is None:
+        raise NotFoundException
+
+    # Built in a thread as a verbose event holds a document per seat
+    event = await run_sync(Event._from_son, document)
+    event._loaded_sections = None if sections is None else set(sections)
+
+    return event
+
+
+def set_result(future: asyncio.Future, result) -> None:
+    # Futures of clients which went away are cancelled already
+    if not future.done():
+        future.set_result(result)
+
+
+def set_exception(future: asyncio.Future, error: Exception) -> None:
+    if not future.done():
+        future.set_exception(error)
+
+
+class Coalescer:
+    """
+    Runs the operations (make_reservation, block, ...) of an event submitted at about the same time as a batch
+
+    Operations are gathered for ASYNC_COALESCE_WINDOW seconds, then the event is loaded once with the sections
+        they work on, they are run one after the other (in a thread, off the event loop) and the seats they take
+        are written with a single compare-and-swap (see Event.seat_write). The whole batch is run again on fresh
+        data when the event was changed meanwhile, up to EVENT_UPDATE_RETRIES times, before failing with
+        a ConflictException
+    """
+
+    def __init__(self, collection, venue_id: str, event_id: str, done=None):
+        self.collection = collection
+        self.venue_id = venue_id
+        self.event_id = event_id
+        self._done = done
+        self._queue = []
+        self._task = None
+
+    async def submit(self, method: str, *args):
+        """
+        Queues an operation of the event, waiting for its result
+        """
+        future = asyncio.get_event_loop().create_future()
+        self._queue.append((method, args, future))
+
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+        return await future
+
+    async def _run(self) -> None:
+        try:
+            while self._queue:
+                await asyncio.sleep(settings.ASYNC_COALESCE_WINDOW)
+                batch, self._queue = self._queue, []
+
+                try:
+                    await self._run_batch(batch)
+                except Exception as error:
+                    for _, _, future in batch:
+                        set_exception(future, error)
+        finally:
+            self._task = None
+
+            if self._done is not None:
+                self._done(self)
+
+    async def _run_batch(self, batch: list) -> None:
+        stats.observe('coalesced_operations', len(batch), stats.SEAT_BUCKETS)
+        attempt = 0
+
+        while batch:
+            # Operations of clients which went away are dropped
+            batch = [operation for operation in batch if not operation[2].done()]
+
+            if not batch:
+                return
+
+            operations = [Event.operation_sections(method, *args) for method, args, _ in batch]
+            sections = None if None in operations else sorted({section for each in operations for section in each})
+
+            try:
+                event = await load_event(self.collection, self.venue_id, self.event_id, sections)
+            except NotFoundException as error:
+                for _, _, future in batch:
+                    set_exception(future, error)
+                return
+
+            results, failed = await run_sync(self._run_operations, event, batch)
+
+            if failed:
+                # The seats the other operations took are dropped with the event, which is loaded again without
+                # the failed operations
+                for _, _, future, error in failed:
+                    set_exception(future, error)
+
+                batch = [operation for operation in batch if operation[2] not in {each[2] for each in failed}]
+                continue
+
+            write = await run_sync(event.seat_write)
+
+            if write is not None and not (await self.collection.update_one(*write)).matched_count:
+                stats.incr('coalesced.conflicts')
+
+                if attempt == settings.EVENT_UPDATE_RETRIES:
+                    stats.incr('coalesced.gave_up')
+
+                    for _, _, future in batch:
+                        set_exception(future, ConflictException())
+                    return
+
+                attempt += 1
+                continue
+
+            # The seats are written, so everyone is answered before anything else can go wrong
+            stats.incr('coalesced.writes')
+
+            for future, result in results:
+                set_result(future, result)
+
+            if write is not None:
+                try:
+                    await run_sync(event.seats_saved)
+                except Exception:
+                    stats.incr('coalesced.saved_errors')
+                    logger.exception('Failed to update event %s after writing it', self.event_id)
+
+            return
+
+    def _run_operations(self, event: Event, batch: list) -> tuple:
+        """
+        Runs the operations of a batch on the event, returning the (future, result) of the ones which went
+            through and the (method, args, future, error) of the ones which failed
+        """
+        results = []
+        failed = []
+
+        for method, args, future in batch:
+            try:
+                results.append((future, getattr(event, method)(*args)))
+            except Exception as error:
+                failed.append((method, args, future, error))
+
+        return results, failed
+
+
+def json_body(value, status: int = 200) -> tuple:
+    return status, [(b'content-type', b'application/json')], json.dumps(value, cls=DjangoJSONEncoder).encode()
+
+
+class AsyncApi:
+    """
+    ASGI application serving the event reads, reservations and blocks with asyncio, so the number of requests
+        in flight is bound by the open connections instead of the workers
+
+    Reservations and blocks of the same event are coalesced (see Coalescer), or run on its engine when EVENT_ENGINE
+        is on (see api.engine), and streams of seat changes only hold
+        a subscription while waiting for changes. Any other request is passed on to fallback, e.g. the Django
+        application, or answered 404 without one
+    """
+
+    def __init__(self, fallback=None):
+        self.fallback = fallback
+        self.collection = None
+        self.coalescers = {}
+        self.routes = [
+            (re.compile(EVENT_PATH + r'/?$'), 'GET', self.get_event),
+            (re.compile(EVENT_PATH + r'/reserve/?$'), 'POST', self.reserve),
+            (re.compile(EVENT_PATH + r'/reserve/batch/?$'), 'POST', self.reserve_batch),
+            (re.compile(EVENT_PATH + r'/block/?$'), 'POST', self.block),
+            (re.compile(EVENT_PATH + r'/stream/?$'), 'GET', self.stream),
+        ]
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            return await self.lifespan(receive, send)
+
+        for pattern, method, handler in self.routes if scope['type'] == 'http' else []:
+            match = pattern.match(scope['path'])
+
+            if match and scope['method'] == method:
+                return await self.timed(handler, scope, receive, send, **match.groupdict())
+
+        if self.fallback is not None:
+            return await self.fallback(scope, receive, send)
+
+        await self.respond(send, *json_body({'error': 'Not found'}, 404))
+
+    async def timed(self, handler, scope, receive, send, **kwargs) -> None:
+        """
+        Runs a handler recording the seconds taken until its response starts in the request_seconds histogram,
+            as api.middleware.MetricsMiddleware does for the Django views
+        """
+        if not settings.METRICS_ENABLED:
+            return await handler(scope, receive, send, **kwargs)
+
+        start = time.perf_counter()
+
+        async def timed_send(message):
+            if message['type'] == 'http.response.start':
+                stats.observe(
+                    'request_seconds', time.perf_counter() - start, view=f'AsyncApi.{handler.__name__}',
+                    method=scope['method'], status=message['status']
+                )
+
+            await send(message)
+
+        await handler(scope, receive, timed_send, **kwargs)
+
+    async def lifespan(self, receive, send) -> None:
+        while True:
+            message = await receive()
+
+            if message['type'] == 'lifespan.startup':
+                if settings.HOLD_SWEEPER:
+                    # Releases the holds left expired by a restart or by other processes too
+                    sweeper.start()
+
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.drain()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def respond(self, send, status: int, headers: list, body: bytes = b'') -> None:
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def read_json(self, receive):
+        body = []
+
+        while True:
+            message = await receive()
+            body.append(message.get('body', b''))
+
+            if not message.get('more_body'):
+                return json.loads(b''.join(body))
+
+    async def update_event(self, venue_id: str, event_id: str, method: str, *args):
+        # The engine must stay the only writer of its events (see api.services.update_event)
+        if settings.EVENT_ENGINE:
+            return await self.engine_update(venue_id, event_id, method, *args)
+
+        if self.collection is None:
+            self.collection = get_collection()
+
+        key = (venue_id, event_id)
+
+        if key not in self.coalescers:
+            self.coalescers[key] = Coalescer(self.collection, venue_id, event_id, done=self.drop_coalescer)
+
+        return await self.coalescers[key].submit(method, *args)
+
+    async def engine_update(self, venue_id: str, event_id: str, method: str, *args):
+        """
+        Runs an operation on the engine of the event, as api.engine.update_event does without holding a thread
+        """
+        future = await run_sync(engine.submit, venue_id, event_id, method, *args)
+
+        try:
+            return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), settings.EVENT_ENGINE_TIMEOUT)
+        except asyncio.TimeoutError:
+            stats.incr('engine.timeouts')
+
+        if not future.cancel():
+            # Already running, so answered as soon as it is journaled
+            try:
+                return await asyncio.wait_for(asyncio.wrap_future(future), settings.EVENT_ENGINE_TIMEOUT)
+            except asyncio.TimeoutError:
+                pass
+
+        raise ConflictException
+
+    async def drain(self) -> None:
+        """
+        Waits for the coalescers to finish, clients being answered before the event is brought in line with
+            the write (see Event.seats_saved)
+        """
+        while self.coalescers:
+            tasks = [coalescer._task for coalescer in self.coalescers.values() if coalescer._task is not None]
+
+            if not tasks:
+                return
+
+            await asyncio.wait(tasks)
+
+    def drop_coalescer(self, coalescer: Coalescer) -> None:
+        key = (coalescer.venue_id, coalescer.event_id)
+
+        if self.coalescers.get(key) is coalescer:
+            del self.coalescers[key]
+
+    async def run_update(self, send, event_id: str, update, answer) -> None:
+        try:
+            result = await update
+        except NotFoundException:
+            return await self.respond(send, *json_body({'error': f'Event with id {event_id} not found'}, 404))
+        except ConflictException:
+            return await self.respond(
+                send, *json_body({'error': 'The event is too busy right now, please try again'}, 409)
+            )
+        except UnavailableException as error:
+            return await self.respond(send, *json_body({'error': str(error)}, 503))
+
+        await self.respond(send, *answer(result))
+
+    async def get_event(self, scope, receive, send, venue_id: str, event_id: str) -> None:
+        if self.collection is None:
+            self.collection = get_collection()
+
+        compact = parse_qs(scope.get('query_string', b'').decode()).get('format') == ['compact']
+
+        try:
+            document = await self.collection.find_one(event_query(venue_id, event_id), {'version': 1})
+        except NotFoundException:
+            document = None
+
+        if document is None:
+            return await self.respond(send, *json_body({'error': f'Event with id {event_id} not found'}, 404))
+
+        # The same key and ETag as the Django view (see api.services.event_key), events stored before versioning
+        # have no version field
+        key = cache_key('event', event_id, document.get('version', 0), compact)
+
+        etag = f'"{key}"'.encode()
+        headers = [(b'content-type', b'application/json'), (b'etag', etag)]
+
+        if etag in dict(scope.get('headers', [])).get(b'if-none-match', b'').split(b', '):
+            return await self.respond(send, 304, [(b'etag', etag)])
+
+        content = await run_sync(response_cache.get, key)
+
+        if content is not None:
+            return await self.respond(send, 200, headers, content)
+
+        try:
+            event = await load_event(self.collection, venue_id, event_id)
+        except NotFoundException:
+            return await self.respond(send, *json_body({'error': f'Event with id {event_id} not found'}, 404))
+
+        await send({'type': 'http.response.start', 'status': 200, 'headers': headers})
+
+        # The sections and every chunk are built in a thread, so a big event doesn't hold the event loop
+        chunks = await run_sync(lambda: caching_chunks(key, iter_chunks({'event': event_json(event, compact=compact)})))
+        chunk = await run_sync(next, chunks, None)
+
+        while chunk is not None:
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            chunk = await run_sync(next, chunks, None)
+
+        await send({'type': 'http.response.body', 'body': b''})
+
+    async def reserve(self, scope, receive, send, venue_id: str, event_id: str) -> None:
+        try:
+            data = await self.read_json(receive)
+            group = [int(element) for element in list(data['group'])]
+            section = data['section']
+        except (JSONDecodeError, KeyError, TypeError, ValueError):
+            return await self.respond(send, *json_body({'error': 'Malformed JSON'}, 400))
+
+        def answer(result):
+            if all([num_people == 0 for num_people in result]):
+                return json_body({})
+
+            return json_body({'error': f'Couldn\'t seat all people. Missing space for {result}'}, 403)
+
+        await self.run_update(
+            send, event_id, self.update_event(venue_id, event_id, 'make_reservation', section, group), answer
+        )
+
+    async def reserve_batch(self, scope, receive, send, venue_id: str, event_id: str) -> None:
+        try:
+            data = await self.read_json(receive)
+            reservations = [
+                (reservation['section'], [int(element) for element in list(reservation['group'])])
+                for reservation in data['reservations']
+            ]
+        except (JSONDecodeError, KeyError, TypeError, ValueError):
+            return await self.respond(send, *json_body({'error': 'Malformed JSON'}, 400))
+
+        await self.run_update(
+            send, event_id, self.update_event(venue_id, event_id, 'make_reservations', reservations),
+            lambda results: json_body({'results': [
+                {'seated': all([num_people == 0 for num_people in result]), 'missing': result} for result in results
+            ]})
+        )
+
+    async def block(self, scope, receive, send, venue_id: str, event_id: str) -> None:
+        try:
+            data = await self.read_json(receive)
+            section = data['section']
+            row_id = data['row_id']
+            seat_id = data['seat_id']
+        except (JSONDecodeError, KeyError, TypeError, ValueError):
+            return await self.respond(send, *json_body({'error': 'Malformed JSON'}, 400))
+
+        await self.run_update(
+            send, event_id, self.update_event(venue_id, event_id, 'block', section, row_id, seat_id),
+            lambda result: json_body({}) if result
+            else json_body({'error': 'Couldn\'t block the seat because it is not free.'}, 403)
+        )
+
+    async def wait_disconnect(self, receive) -> None:
+        while (await receive())['type'] != 'http.disconnect':
+            pass
+
+    async def stream(self, scope, receive, send, venue_id: str, event_id: str) -> None:
+        """
+        Streams the seat changes of an event as server-sent events (see api.streams.ChangeStream)
+
+        The stream ends after SEAT_STREAM_TIMEOUT seconds and clients reconnect from the last version they got
+        """
+        query = parse_qs(scope.get('query_string', b'').decode())
+
+        try:
+            # Browsers reconnecting send the last version they got, which is newer than the one in the URL
+            since = int(dict(scope.get('headers', [])).get(b'last-event-id', b'').decode() or query['since'][0])
+        except (KeyError, ValueError):
+            return await self.respond(send, *json_body({'error': 'A version is expected in since'}, 400))
+
+        # Subscribing first so no change is missed between reading the changes since and streaming the new ones
+        # (off the event loop, subscribing the worker to the channel of the event can wait on Redis)
+        subscriber = await run_sync(broadcaster.subscribe, event_id, AsyncSubscriber(settings.SEAT_STREAM_QUEUE_SIZE))
+        disconnected = asyncio.ensure_future(self.wait_disconnect(receive))
+
+        try:
+            try:
+                initial = await run_sync(Event.get_changes, venue_id, event_id, since)
+            except NotFoundException:
+                return await self.respond(send, *json_body({'error': f'Event with id {event_id} not found'}, 404))
+
+            await send({'type': 'http.response.start', 'status': 200, 'headers': [
+                (b'content-type', b'text/event-stream'), (b'cache-control', b'no-cache'), (b'x-accel-buffering', b'no')
+            ]})
+
+            deadline = time.monotonic() + settings.SEAT_STREAM_TIMEOUT
+            changes = ChangeStream(initial)
+            message = changes.start()
+
+            while not disconnected.done():
+                if message is not None:
+                    await send({'type': 'http.response.body', 'body': message.encode(), 'more_body': True})
+
+                if time.monotonic() >= deadline:
+                    break
+
+                if changes.overdue():
+                    message = changes.catch_up(await run_sync(Event.get_changes, venue_id, event_id, changes.since))
+                    continue
+
+                try:
+                    change = await subscriber.get(
+                        changes.timeout(min(settings.SEAT_STREAM_HEARTBEAT, deadline - time.monotonic()))
+                    )
+                except asyncio.TimeoutError:
+                    message = KEEP_ALIVE
+                    continue
+
+                if change is None:
+                    event = await run_sync(Event.get, venue_id, event_id)
+                    message = changes.snapshot({'version': event.version, 'event': await run_sync(event.to_dict)})
+                else:
+                    message = changes.change(change)
+
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            disconnected.cancel()
+            await run_sync(broadcaster.unsubscribe, event_id, subscriber)
+
+
+application = AsyncApi()
@@ -0,0 +1,168 @@
+from contextlib import contextmanager
+from datetime import datetime
+import json
+import math
+import random
+import time
+import uuid
+
+from django.test import Client
+
+from api.models import Event, Venue
+
+ORDERS = ['sequential', 'non-sequential']
+
+
+def generate_venue(num_seats: int, seats_per_row: int = 40, num_sections: int = 2, num_ranks: int = 3) -> dict:
+    """
+    Generates the JSON of a venue (as consumed by Venue.create_venue) with at least num_seats seats
+
+    The rows are spread evenly through the sections and ranks, alternating sequential and non-sequential
+        ordered rows. Raises a ValueError when there isn't at least a seat and a seat per row
+    """
+    if num_seats < 1 or seats_per_row < 1:
+        raise ValueError('A venue needs at least one seat and one seat per row')
+
+    seats_per_row = min(seats_per_row, num_seats)
+    num_rows = math.ceil(num_seats / seats_per_row)
+    row_types = num_sections * num_ranks
+    sections = []
+
+    for section_index in range(num_sections):
+        rows = []
+
+        for rank_index in range(num_ranks):
+            type_index = section_index * num_ranks + rank_index
+            rows_of_type = num_rows // row_types + (1 if type_index < num_rows % row_types else 0)
+
+            if rows_of_type:
+                rows.append({
+                    'row_rank': f'Rank {rank_index + 1}',
+                    'num_seats': seats_per_row,
+                    'num_rows': rows_of_type,
+                    'order': ORDERS[type_index % len(ORDERS)]
+                })
+
+        if rows:
+            sections.append({'section_type': f'section-{section_index + 1}', 'rows': rows})
+
+    return {'venue_name': f'Benchmark {num_seats} {uuid.uuid4().hex}', 'sections': sections}
+
+
+class Timings:
+    """
+    The durations of the runs of an operation
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.durations = []
+
+    @contextmanager
+    def measure(self):
+        start = time.perf_counter()
+        yield
+        self.durations.append(time.perf_counter() - start)
+
+    def percentile(self, percent: float) -> float:
+        """
+        The duration (in seconds) percent of the runs didn't go over
+        """
+        durations = sorted(self.durations)
+
+        return durations[min(len(durations) - 1, math.ceil(percent / 100 * len(durations)) - 1)]
+
+    def summary(self) -> dict:
+        total = sum(self.durations)
+
+        return {
+            'name': self.name,
+            'runs': len(self.durations),
+            'throughput': len(self.durations) / total if total else 0,
+            'p50': self.percentile(50) * 1000,
+            'p99': self.percentile(99) * 1000
+        }
+
+
+def random_groups(venue_json: dict, generator: random.Random) -> tuple:
+    """
+    A random reservation of 1 to 6 people in one of the ranks of one of the sections of the venue
+    """
+    section = generator.choice(venue_json['sections'])
+    num_ranks = len({row['row_rank'] for row in section['rows']})
+    group = [0] * num_ranks
+    group[generator.randrange(num_ranks)] = generator.randint(1, 6)
+
+    return section['section_type'], group
+
+
+def run(num_seats: int, iterations: int = 100, seed: int = 0) -> list:
+    """
+    Benchmarks the reservation, block and read paths on a generated venue of num_seats seats
+
+    Returns the summary of the timings of every operation, with throughput in operations per second
+        and p50/p99 latencies in milliseconds
+    """
+    generator = random.Random(seed)
+    client = Client()
+    venue_json = generate_venue(num_seats)
+    timings = {
+        name: Timings(name) for name in (
+            'create_venue', 'create_event', 'Section.make_reservation', 'Event.update_event', 'Venue.block',
+            'Event.to_dict', 'GET event', 'POST reserve'
+        )
+    }
+
+    venue = Venue(venue_name=venue_json['venue_name'], input_json=venue_json)
+
+    with timings['create_venue'].measure():
+        venue.create_venue(venue_json['sections'])
+
+    try:
+        for _ in range(iterations):
+            with timings['create_event'].measure():
+                event = venue.create_event(date=datetime.now(), event_name='Benchmark')
+
+        event_id = str(event.id)
+        seats = [
+            (section_type, row.row_id, seat.seat_id)
+            for section_type, section in venue.base_layout.items()
+            for rows in section.rows.values()
+            for row in rows
+            for seat in row.seats
+        ]
+        loaded_event = Event.get(venue.id, event_id)
+
+        for _ in range(iterations):
+            section_type, group = random_groups(venue_json, generator)
+            section = loaded_event.get_section(section_type)
+
+            with timings['Section.make_reservation'].measure():
+                section.make_reservation(group)
+
+            with timings['Event.update_event'].measure():
+                Event.update_event(venue.id, event_id, 'make_reservation', *random_groups(venue_json, generator))
+
+            with timings['Venue.block'].measure():
+                venue.block(event_id, *generator.choice(seats))
+
+            with timings['Event.to_dict'].measure():
+                Event.get(venue.id, event_id).to_dict()
+
+            with timings['GET event'].measure():
+                response = client.get(f'/api/1.0/venue/{venue.id}/event/{event_id}/')
+                # Streamed responses are only serialized as they are read
+                b''.join(response.streaming_content) if response.streaming else response.content
+
+            section_type, group = random_groups(venue_json, generator)
+
+            with timings['POST reserve'].measure():
+                client.post(
+                    f'/api/1.0/venue/{venue.id}/event/{event_id}/reserve/',
+                    json.dumps({'section': section_type, 'group': group}), content_type='application/json'
+                )
+    finally:
+        Event.objects(venue_id=venue.id).delete()
+        venue.delete()
+
+    return [timing.summary() for timing in timings.values()]
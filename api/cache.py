@@ -0,0 +1,134 @@
+from collections import OrderedDict
+import hashlib
+from threading import Lock
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+
+from api import stats
+from api.serializers import iter_chunks
+
+
+class ResponseCache:
+    """
+    LRU cache of the serialized responses of a worker
+
+    It can be backed by one of the Django caches (see settings.CACHES) to share the responses between
+        the workers of a node
+    """
+
+    def __init__(self, max_size: int, shared_cache: str = None):
+        self.max_size = max_size
+        self.shared_cache = shared_cache
+        self._responses = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key: str) -> bytes:
+        with self._lock:
+            if key in self._responses:
+                self._responses.move_to_end(key)
+                return self._responses[key]
+
+        if self.shared_cache is None:
+            return None
+
+        content = caches[self.shared_cache].get(key)
+
+        if content is not None:
+            self._store(key, content)
+
+        return content
+
+    def set(self, key: str, content: bytes) -> None:
+        self._store(key, content)
+
+        if self.shared_cache is not None:
+            caches[self.shared_cache].set(key, content)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._responses.clear()
+
+    def _store(self, key: str, content: bytes) -> None:
+        with self._lock:
+            self._responses[key] = content
+            self._responses.move_to_end(key)
+
+            while len(self._responses) > self.max_size:
+                self._responses.popitem(last=False)
+
+
+response_cache = ResponseCache(settings.RESPONSE_CACHE_SIZE, settings.RESPONSE_CACHE_SHARED)
+
+
+def cache_key(*parts) -> str:
+    """
+    A key made of the parts identifying a version of a response
+    """
+    return hashlib.md5(':'.join(str(part) for part in parts).encode()).hexdigest()
+
+
+def cached_response(request, key: str, build) -> HttpResponse:
+    """
+    A JSON response for the version of the data identified by key, using it as ETag
+
+    Answers 304 when the client already has that version (If-None-Match) and only calls build to get
+        the value to serialize when the response isn't cached yet. It is then streamed (see api.serializers)
+        and kept for the next requests unless it is bigger than RESPONSE_CACHE_MAX_BYTES
+    """
+    etag = f'"{key}"'
+
+    if etag in request.META.get('HTTP_IF_NONE_MATCH', '').split(', '):
+        response = HttpResponseNotModified()
+        response['ETag'] = etag
+        return response
+
+    content = response_cache.get(key)
+
+    if content is None:
+        response = StreamingHttpResponse(caching_chunks(key, iter_chunks(build())), content_type='application/json')
+    else:
+        response = HttpResponse(content, content_type='application/json')
+
+    response['ETag'] = etag
+
+    return response
+
+
+def caching_chunks(key: str, chunks):
+    """
+    Passes the chunks of a response on, caching the whole response once they are all through
+        if it is not bigger than RESPONSE_CACHE_MAX_BYTES
+
+    The time spent serializing (not sending) the response and its size are recorded in stats
+    """
+    content = []
+    size = 0
+    serializing = 0
+    chunks = iter(chunks)
+
+    while True:
+        start = time.perf_counter()
+        chunk = next(chunks, None)
+        serializing += time.perf_counter() - start
+
+        if chunk is None:
+            break
+
+        size += len(chunk)
+
+        if content is not None:
+            if size <= settings.RESPONSE_CACHE_MAX_BYTES:
+                content.append(chunk)
+            else:
+                content = None
+
+        yield chunk
+
+    stats.observe('stage_seconds', serializing, stage='serialize')
+    stats.observe('response_bytes', size, stats.SIZE_BUCKETS)
+
+    if content is not None:
+        response_cache.set(key, b''.join(content))
@@ -0,0 +1,488 @@
+import atexit
+from concurrent.futures import Future, TimeoutError
+import json
+import logging
+import os
+from queue import Empty, Queue
+from threading import Lock, Thread
+import time
+import zlib
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from api import stats
+from api.exceptions import ConflictException, NotFoundException, UnavailableException
+from api.models import Event
+
+logger = logging.getLogger(__name__)
+
+
+class Journal:
+    """
+    Append only file of the operations run on an event since it was last written to the database
+
+    The first line holds the version of the event the operations were run on (version, once read or reset),
+        every other line an operation as {"method": ..., "args": [...], "result": ...}
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.version = None
+        self._file = None
+
+    def read(self) -> tuple:
+        """
+        The version the journal starts from and its operations, (None, []) if there is no journal
+        """
+        if not os.path.exists(self.path):
+            return None, []
+
+        with open(self.path) as journal:
+            lines = [json.loads(line) for line in journal if line.endswith('\n')]
+
+        if not lines:
+            return None, []
+
+        self.version = lines[0]['version']
+
+        return self.version, lines[1:]
+
+    def open(self) -> None:
+        """
+        Opens the journal to append operations to it
+        """
+        self.close()
+        self._file = open(self.path, 'a')
+
+    def reset(self, version: int) -> None:
+        """
+        Empties the journal, starting it over from version
+        """
+        self.close()
+
+        with open(self.path, 'w') as journal:
+            journal.write(json.dumps({'version': version}) + '\n')
+            journal.flush()
+            os.fsync(journal.fileno())
+
+        self.version = version
+
+        self.open()
+
+    def append(self, records: list) -> None:
+        """
+        Writes operations to the journal, returning once they are on disk
+        """
+        self._file.write(''.join([json.dumps(record) + '\n' for record in records]))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class EventEngine:
+    """
+    Owns the seats of an event in memory, running its operations (make_reservation, block, ...) one at a time
+        in a single thread, in the order they are submitted
+
+    Operations are journaled (see Journal) before they are answered and the seats they take are written to
+        the database in batches, every EVENT_ENGINE_FLUSH_INTERVAL seconds, with a single Event.seat_write.
+        Once a batch is written the journal starts over. An engine starting with a journal on the version
+        of the event in the database (a batch that didn't make it) runs its operations again first
+
+    Engines stop once they were idle for EVENT_ENGINE_IDLE_TIMEOUT seconds (see retire), and are started again
+        on the next operation of the event
+    """
+
+    def __init__(self, venue_id: str, event_id: str):
+        self.venue_id = venue_id
+        self.event_id = event_id
+        os.makedirs(settings.EVENT_ENGINE_JOURNAL_DIR, exist_ok=True)
+        self.journal = Journal(os.path.join(settings.EVENT_ENGINE_JOURNAL_DIR, f'{event_id}.journal'))
+        self.event = None
+        self._queue = Queue()
+        self._pending = []
+        self._stale = False
+        self._unsure = False
+        self._failed = None
+        self._last_flush = time.monotonic()
+        self._last_used = time.monotonic()
+        self._thread = Thread(target=self._run, name=f'event-engine-{event_id}', daemon=True)
+
+    def start(self) -> 'EventEngine':
+        self.recover()
+        self._thread.start()
+        return self
+
+    def submit(self, method: str, *args) -> Future:
+        """
+        Queues an operation of the event, returning the future of its result
+        """
+        future = Future()
+        self._queue.put((method, args, future))
+        return future
+
+    def stop(self) -> None:
+        """
+        Writes the pending operations and stops the engine
+        """
+        if self._thread.ident is None:
+            # Never started (see start_engine)
+            return
+
+        self._queue.put(None)
+        self._thread.join()
+
+    def fail(self, error: Exception) -> None:
+        """
+        Answers the operations queued on an engine which couldn't start with error
+        """
+        while not self._queue.empty():
+            command = self._queue.get()
+
+            if command is not None and command[2].set_running_or_notify_cancel():
+                command[2].set_exception(error)
+
+    def recover(self) -> None:
+        """
+        Loads the event, running again the journaled operations which weren't written to the database
+        """
+        self.event = Event.get(self.venue_id, self.event_id)
+        version, records = self.journal.read()
+
+        if not records or version != self.event.version:
+            self.journal.reset(self.event.version)
+            return
+
+        stats.incr('engine.replayed', len(records))
+        self.journal.open()
+        self._pending = records
+        self._stale = True
+        self.flush()
+
+    def flush(self) -> None:
+        """
+        Writes the seats taken by the pending operations to the database and starts the journal over
+
+        The engine is meant to be the only writer of the event. When the event was changed by someone else it is
+            loaded again and the pending operations are run again on it. When the write failed without telling
+            whether it went through it is loaded again on the next flush (see _refresh)
+        """
+        self._last_flush = time.monotonic()
+
+        if not self._pending:
+            return
+
+        for _ in range(settings.EVENT_UPDATE_RETRIES + 1):
+            try:
+                self._refresh()
+            except Exception:
+                stats.incr('engine.flush_errors')
+                return
+
+            if not self._pending:
+                return
+
+            try:
+                with stats.timer('engine.flush'):
+                    write = self.event.seat_write()
+                    saved = write is None or Event.objects(__raw__=write[0]).update_one(__raw__=write[1])
+            except Exception:
+                # Tried again on the next flush, the operations are safe in the journal meanwhile
+                stats.incr('engine.flush_errors')
+                self._stale = True
+                self._unsure = True
+                return
+
+            if not saved:
+                stats.incr('engine.conflicts')
+                self._stale = True
+                continue
+
+            stats.observe('engine_batch_operations', len(self._pending), stats.SEAT_BUCKETS)
+            self._pending = []
+
+            if write is not None:
+                self._saved()
+
+            self.journal.reset(self.event.version)
+            return
+
+    def _saved(self) -> None:
+        """
+        Brings the event in line with the write that went through (see Event.seats_saved)
+
+        The write is done whatever happens here, so the event is only loaded again on failure
+        """
+        version = self.event.version + 1
+
+        try:
+            self.event.seats_saved()
+        except Exception:
+            stats.incr('engine.saved_errors')
+            self._stale = True
+            self.event.version = version
+
+    def _refresh(self) -> None:
+        """
+        Loads the event again when it no longer matches the database and the pending operations,
+            running the pending operations on it
+
+        After a write which failed without telling whether it went through, a version other than the one
+            the journal starts from means it did, and the pending operations are dropped instead of being
+            run a second time
+
+        Pending operations giving other results than the ones answered mean someone else wrote the event.
+            The engine fails for good then (see UnavailableException), keeping its journal to reconcile
+            the seats answered by hand
+        """
+        if self._failed is not None:
+            raise self._failed
+
+        if not self._stale:
+            return
+
+        self.event = Event.get(self.venue_id, self.event_id)
+
+        if self._unsure and self.event.version != self.journal.version:
+            stats.incr('engine.flushed_unsure', len(self._pending))
+            self._pending = []
+            self.journal.reset(self.event.version)
+
+        for record in self._pending:
+            if getattr(self.event, record['method'])(*record['args']) != record['result']:
+                stats.incr('engine.replay_mismatches')
+                logger.critical(
+                    'Event %s was changed by another writer, its journal %s no longer matches it',
+                    self.event_id, self.journal.path
+                )
+                self._failed = UnavailableException(f'Event {self.event_id} is unavailable')
+                raise self._failed
+
+        self._stale = False
+        self._unsure = False
+
+    def _run(self) -> None:
+        while True:
+            try:
+                timeout = max(self._last_flush + settings.EVENT_ENGINE_FLUSH_INTERVAL - time.monotonic(), 0)
+                commands = [self._queue.get(timeout=timeout)]
+            except Empty:
+                self.flush()
+
+                if self._idle() and retire(self):
+                    self.journal.close()
+                    return
+
+                continue
+
+            self._last_used = time.monotonic()
+
+            # Everything queued meanwhile goes in the same journal write
+            while not self._queue.empty():
+                commands.append(self._queue.get())
+
+            stop = None in commands
+            self._run_commands([command for command in commands if command is not None])
+
+            if stop or time.monotonic() >= self._last_flush + settings.EVENT_ENGINE_FLUSH_INTERVAL:
+                self.flush()
+
+            if stop:
+                self.journal.close()
+                return
+
+    def _idle(self) -> bool:
+        """
+        Check if everything was written and no operation came for EVENT_ENGINE_IDLE_TIMEOUT seconds
+        """
+        return not self._pending and time.monotonic() - self._last_used >= settings.EVENT_ENGINE_IDLE_TIMEOUT
+
+    def _run_commands(self, commands: list) -> None:
+        # Operations their caller gave up on (see update_event) are never run
+        commands = [command for command in commands if command[2].set_running_or_notify_cancel()]
+        records = []
+        answers = []
+
+        try:
+            self._refresh()
+
+            for method, args, future in commands:
+                try:
+                    result = getattr(self.event, method)(*args)
+                except Exception as error:
+                    answers.append((future.set_exception, error))
+                    continue
+
+                records.append({'method': method, 'args': list(args), 'result': result})
+                answers.append((future.set_result, result))
+
+            if records:
+                self.journal.append(records)
+                self._pending += records
+        except Exception as error:
+            # Nothing is answered unless it is in the journal, the seats taken in memory are dropped loading
+            # the event again
+            stats.incr('engine.errors')
+            self._stale = True
+            answers = [(future.set_exception, error) for _, _, future in commands]
+
+        for answer, value in answers:
+            answer(value)
+
+
+_engines = {}
+_lock = Lock()
+
+
+def partition(event_id: str) -> int:
+    """
+    The partition an event belongs to (see EVENT_ENGINE_PARTITIONS)
+    """
+    return zlib.crc32(str(event_id).encode()) % settings.EVENT_ENGINE_PARTITIONS
+
+
+def owns(event_id: str) -> bool:
+    """
+    Check if the event belongs to the partition of this process (see EVENT_ENGINE_PARTITIONS)
+    """
+    return partition(event_id) == settings.EVENT_ENGINE_PARTITION
+
+
+def check_partitions() -> None:
+    """
+    Raises ImproperlyConfigured unless this process can be the only writer of the events of its partition:
+        a valid EVENT_ENGINE_PARTITION and a single worker (WEB_CONCURRENCY), as every worker of a process
+        gets the same partition
+    """
+    if not 0 <= settings.EVENT_ENGINE_PARTITION < settings.EVENT_ENGINE_PARTITIONS:
+        raise ImproperlyConfigured(
+            f'EVENT_ENGINE_PARTITION must be from 0 to {settings.EVENT_ENGINE_PARTITIONS - 1} (EVENT_ENGINE_PARTITIONS)'
+        )
+
+    if int(os.environ.get('WEB_CONCURRENCY', 1)) != 1:
+        raise ImproperlyConfigured(
+            'EVENT_ENGINE needs a single worker per process (WEB_CONCURRENCY=1), and a process per partition'
+        )
+
+
+def _add_engine(venue_id: str, event_id: str) -> tuple:
+    """
+    The (engine, created) of an event, adding an engine yet to be started (see start_engine) when there is none.
+        Called with the lock held
+    """
+    if event_id in _engines:
+        return _engines[event_id], False
+
+    _engines[event_id] = EventEngine(str(venue_id), event_id)
+
+    return _engines[event_id], True
+
+
+def start_engine(engine: EventEngine) -> None:
+    """
+    Starts an engine added by _add_engine, without holding the lock as the event is loaded
+
+    Operations queued meanwhile wait for it. When it can't start it is dropped and they get the error
+    """
+    try:
+        engine.start()
+    except Exception as error:
+        with _lock:
+            if _engines.get(engine.event_id) is engine:
+                del _engines[engine.event_id]
+
+            engine.fail(error)
+
+
+def get_engine(venue_id: str, event_id: str) -> EventEngine:
+    """
+    The engine of an event, started on first use
+    """
+    with _lock:
+        engine, created = _add_engine(venue_id, str(event_id))
+
+    if created:
+        start_engine(engine)
+
+    return engine
+
+
+def retire(engine: EventEngine) -> bool:
+    """
+    Drops an idle engine, unless an operation was queued on it meanwhile
+    """
+    with _lock:
+        if not engine._queue.empty():
+            return False
+
+        if _engines.get(engine.event_id) is engine:
+            del _engines[engine.event_id]
+
+        return True
+
+
+def stop_engines() -> None:
+    """
+    Writes the pending operations of all the engines and stops them
+    """
+    with _lock:
+        engines = list(_engines.values())
+        _engines.clear()
+
+    for engine in engines:
+        engine.stop()
+
+
+def submit(venue_id: str, event_id: str, method: str, *args) -> Future:
+    """
+    Queues an operation of an event owned by this process on its engine, returning the future of its result
+    """
+    if not owns(event_id):
+        raise UnavailableException(f'Event {event_id} belongs to partition {partition(event_id)}')
+
+    # Queued with the lock held so the engine can't be retired in between
+    with _lock:
+        engine, created = _add_engine(venue_id, str(event_id))
+
+        if engine.venue_id != str(venue_id) and not created:
+            raise NotFoundException
+
+        future = engine.submit(method, *args)
+
+    if created:
+        start_engine(engine)
+
+    return future
+
+
+def update_event(venue_id: str, event_id: str, method: str, *args):
+    """
+    Runs an operation of an event owned by this process on its engine, waiting for the result
+
+    Raises an UnavailableException for the events of other partitions, and a ConflictException when it isn't
+        answered within EVENT_ENGINE_TIMEOUT seconds, in which case the operation is dropped unless the engine
+        already started running it
+    """
+    future = submit(venue_id, event_id, method, *args)
+
+    try:
+        return future.result(timeout=settings.EVENT_ENGINE_TIMEOUT)
+    except TimeoutError:
+        stats.incr('engine.timeouts')
+
+    if not future.cancel():
+        # Already running, so answered as soon as it is journaled
+        try:
+            return future.result(timeout=settings.EVENT_ENGINE_TIMEOUT)
+        except TimeoutError:
+            pass
+
+    raise ConflictException
+
+
+atexit.register(stop_engines)
@@ -1,2 +1,22 @@
 class NotFoundException(Exception):
     pass
+
+
+class ConflictException(Exception):
+    pass
+
+
+class UnavailableException(Exception):
+    """
+    The event can't be changed by this process, the message telling why
+    """
+
+
+class ImportFailedException(Exception):
+    """
+    A batch of venues couldn't be written, line_number being the first line of the batch
+    """
+
+    def __init__(self, message: str, line_number: int):
+        super().__init__(message)
+        self.line_number = line_number
@@ -0,0 +1,102 @@
+from heapq import heappop, heappush
+from threading import Condition, Lock, Thread
+import time
+
+from django.conf import settings
+
+from api import services, stats
+from api.exceptions import ConflictException, NotFoundException, UnavailableException
+from api.models import Event
+
+
+class HoldSweeper:
+    """
+    Releases the seats of holds once they expire (see Event.expire_holds)
+
+    The expiry of every hold made by the process is kept in a heap, so the next one to expire is always at hand
+        and none of the seat maps is walked to find it. Holds made by other processes, or before a restart,
+        are picked up every HOLD_SWEEP_INTERVAL seconds through the earliest expiry each event keeps
+        (Event.holds_expire_at). The expired holds of an event are released together, in a single write
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._condition = Condition()
+        self._lock = Lock()
+        self._thread = None
+
+    def start(self) -> None:
+        """
+        Starts the thread releasing the expired holds, unless it is already running
+        """
+        with self._lock:
+            if self._thread is None:
+                self._thread = Thread(target=self._run, name='hold-sweeper', daemon=True)
+                self._thread.start()
+
+    def schedule(self, venue_id: str, event_id: str, expires_at: float) -> None:
+        """
+        Sweeps the holds of an event at expires_at (a timestamp)
+        """
+        with self._condition:
+            heappush(self._heap, (expires_at, str(venue_id), str(event_id)))
+            self._condition.notify()
+
+    def poll(self, now: float = None) -> None:
+        """
+        Schedules the events with holds expired by now made by any process
+        """
+        now = time.time() if now is None else now
+
+        for event in Event.objects(holds_expire_at__lte=now).only('venue_id', 'holds_expire_at'):
+            self.schedule(event.venue_id, event.id, event.holds_expire_at)
+
+    def sweep(self, now: float = None) -> int:
+        """
+        Releases the holds expired by now of the events scheduled up to now, returning how many events were swept
+        """
+        now = time.time() if now is None else now
+        events = set()
+
+        with self._condition:
+            while self._heap and self._heap[0][0] <= now:
+                events.add(heappop(self._heap)[1:])
+
+        for venue_id, event_id in events:
+            try:
+                expired = services.update_event(venue_id, event_id, 'expire_holds', now)
+            except (NotFoundException, UnavailableException):
+                # Holds of events of other partitions are released by the process owning them
+                continue
+            except ConflictException:
+                # The event is busy, it is tried again a bit later
+                stats.incr('holds.sweep_conflicts')
+                self.schedule(venue_id, event_id, now + settings.HOLD_SWEEP_INTERVAL)
+                continue
+
+            stats.incr('holds.expired', len(expired))
+
+        return len(events)
+
+    def _run(self) -> None:
+        next_poll = 0
+
+        while True:
+            now = time.time()
+
+            try:
+                if now >= next_poll:
+                    self.poll(now)
+                    next_poll = now + settings.HOLD_SWEEP_INTERVAL
+
+                self.sweep(now)
+            except Exception:
+                # Tried again on the next round, holds are only released later than they should
+                stats.incr('holds.sweep_errors')
+
+            with self._condition:
+                next_expiry = self._heap[0][0] if self._heap else next_poll
+                self._condition.wait(max(min(next_expiry, next_poll) - time.time(), 0))
+
+
+sweeper = HoldSweeper()
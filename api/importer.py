@@ -0,0 +1,142 @@
+from concurrent.futures import ProcessPoolExecutor
+import json
+import os
+import time
+
+from pymongo.errors import BulkWriteError
+
+from api.exceptions import ImportFailedException
+from api.models import Venue
+
+
+def read_batches(lines, batch_size: int, skip: int = 0):
+    """
+    Splits the lines of a NDJSON stream in batches of batch_size (line number, line) pairs, leaving out
+        the first skip lines and the blank ones
+    """
+    batch = []
+
+    for line_number, line in enumerate(lines, 1):
+        if line_number <= skip or not line.strip():
+            continue
+
+        batch.append((line_number, line))
+
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+
+    if batch:
+        yield batch
+
+
+def build_venue(line: str) -> tuple:
+    """
+    The venue document defined by a line of NDJSON (as posted to VenueView) along with its number of seats,
+        or None and the reason the line is not valid
+
+    Runs in the processes of the pool of import_venues, so it must not touch the database
+    """
+    try:
+        data = json.loads(line)
+        venue = Venue(venue_name=data['venue_name'], input_json=data)
+        venue.build_layout(data['sections'])
+    except (ValueError, KeyError, TypeError) as error:
+        return None, f'{type(error).__name__}: {error}'
+
+    num_seats = sum(
+        row.number_seats for section in venue.base_layout.values() for rows in section.rows.values() for row in rows
+    )
+
+    return venue.to_mongo().to_dict(), num_seats
+
+
+def read_checkpoint(path: str) -> int:
+    """
+    The number of lines already imported according to the checkpoint at path, 0 if there is none
+    """
+    if path is None or not os.path.exists(path):
+        return 0
+
+    with open(path) as checkpoint:
+        return int(checkpoint.read().strip() or 0)
+
+
+def write_checkpoint(path: str, line_number: int) -> None:
+    if path is None:
+        return
+
+    # Written aside and moved over, so the checkpoint is never left half written
+    with open(f'{path}.tmp', 'w') as checkpoint:
+        checkpoint.write(str(line_number))
+
+    os.replace(f'{path}.tmp', path)
+
+
+def import_venues(lines, batch_size: int = 500, workers: int = None, checkpoint: str = None):
+    """
+    Creates the venues defined by a NDJSON stream, one venue per line, a batch of batch_size at a time
+
+    The layouts of a batch are built in a pool of workers processes (in this process when workers is 0),
+        the names of its venues are checked against the existing ones with a single query and the new venues
+        are written with a single bulk insert. Lines which aren't valid venues and venues whose name already
+        exists (or shows up earlier in the stream) are skipped
+
+    After every batch the number of lines done is written to checkpoint, and an import started again with
+        the same checkpoint goes on from there. A batch failing halfway raises an ImportFailedException, and
+        starting again skips the venues of the batch which made it as they already exist
+
+    Yields a summary of every batch as it is done
+    """
+    done = read_checkpoint(checkpoint)
+    pool = ProcessPoolExecutor(workers) if workers != 0 else None
+
+    try:
+        for batch in read_batches(lines, batch_size, skip=done):
+            start = time.perf_counter()
+            built = pool.map(build_venue, [line for _, line in batch], chunksize=16) if pool is not None \
+                else map(build_venue, [line for _, line in batch])
+            venues = []
+            invalid = []
+
+            for (line_number, _), (document, result) in zip(batch, built):
+                if document is None:
+                    invalid.append((line_number, result))
+                else:
+                    venues.append((document, result))
+
+            names = [document['venue_name'] for document, _ in venues]
+            existing = set(Venue.objects(venue_name__in=names).scalar('venue_name'))
+            new_venues = []
+
+            for document, num_seats in venues:
+                if document['venue_name'] not in existing:
+                    existing.add(document['venue_name'])
+                    new_venues.append((document, num_seats))
+
+            if new_venues:
+                try:
+                    Venue._get_collection().insert_many([document for document, _ in new_venues], ordered=False)
+                except BulkWriteError as error:
+                    errors = error.details.get('writeErrors') or [{}]
+
+                    raise ImportFailedException(
+                        f'Writing the batch starting at line {batch[0][0]} failed: {errors[0].get("errmsg")}',
+                        batch[0][0]
+                    )
+
+            done = batch[-1][0]
+            write_checkpoint(checkpoint, done)
+            seconds = time.perf_counter() - start
+
+            yield {
+                'line_number': done,
+                'imported': len(new_venues),
+                'seats': sum(num_seats for _, num_seats in new_venues),
+                'existing': len(venues) - len(new_venues),
+                'invalid': invalid,
+                'seconds': seconds
+            }
+    finally:
+        if pool is not None:
+            pool.shutdown()
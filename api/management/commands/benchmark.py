@@ -0,0 +1,43 @@
+import mongoengine
+from django.core.management.base import BaseCommand, CommandError
+
+from api import benchmarks
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks the reservation, block and read paths on generated venues'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seats', type=int, nargs='+', default=[500, 10000, 100000],
+                            help='Number of seats of each venue to benchmark')
+        parser.add_argument('--iterations', type=int, default=100, help='Runs of each operation per venue')
+        parser.add_argument('--seed', type=int, default=0, help='Seed of the random reservations and blocks')
+        parser.add_argument('--in-memory', action='store_true',
+                            help='Run against an in-memory MongoDB stand-in (needs mongomock) instead of the database')
+
+    def handle(self, *args, **options):
+        if min(options['seats']) < 1:
+            raise CommandError('--seats must be at least 1')
+
+        if options['iterations'] < 1:
+            raise CommandError('--iterations must be at least 1')
+
+        if options['in_memory']:
+            try:
+                import mongomock
+            except ImportError:
+                raise CommandError('--in-memory needs mongomock (pip install mongomock)')
+
+            mongoengine.disconnect()
+            mongoengine.connect('benchmark', mongo_client_class=mongomock.MongoClient)
+
+        self.stdout.write(f'{"operation":<28}{"runs":>8}{"ops/s":>12}{"p50 ms":>12}{"p99 ms":>12}')
+
+        for num_seats in options['seats']:
+            self.stdout.write(f'\n{num_seats} seats')
+
+            for summary in benchmarks.run(num_seats, iterations=options['iterations'], seed=options['seed']):
+                self.stdout.write(
+                    f'{summary["name"]:<28}{summary["runs"]:>8}{summary["throughput"]:>12.1f}'
+                    f'{summary["p50"]:>12.2f}{summary["p99"]:>12.2f}'
+                )
@@ -0,0 +1,52 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api import importer
+from api.exceptions import ImportFailedException
+
+
+class Command(BaseCommand):
+    help = 'Creates the venues defined by a NDJSON file, one venue per line'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='NDJSON file with a venue per line, - to read from the standard input')
+        parser.add_argument('--batch-size', type=int, default=500, help='Venues checked and written at once')
+        parser.add_argument('--workers', type=int, default=None,
+                            help='Processes building the layouts (as many as CPUs by default, 0 for none)')
+        parser.add_argument('--checkpoint', default=None,
+                            help='File keeping the lines done to resume from (<path>.checkpoint by default)')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        checkpoint = options['checkpoint'] or (None if path == '-' else f'{path}.checkpoint')
+        totals = {'imported': 0, 'seats': 0, 'existing': 0, 'invalid': 0}
+        start = time.perf_counter()
+
+        with (sys.stdin if path == '-' else open(path)) as lines:
+            try:
+                for summary in importer.import_venues(
+                    lines, batch_size=options['batch_size'], workers=options['workers'], checkpoint=checkpoint
+                ):
+                    for line_number, reason in summary['invalid']:
+                        self.stderr.write(f'Line {line_number} skipped, {reason}')
+
+                    for key in ('imported', 'seats', 'existing'):
+                        totals[key] += summary[key]
+
+                    totals['invalid'] += len(summary['invalid'])
+                    self.stdout.write(
+                        f'Up to line {summary["line_number"]}: {summary["imported"]} venues imported '
+                        f'({summary["imported"] / summary["seconds"]:.1f} venues/s, '
+                        f'{summary["seats"] / summary["seconds"]:.0f} seats/s)'
+                    )
+            except ImportFailedException as error:
+                raise CommandError(f'{error}. Run the command again to resume from line {error.line_number}')
+
+        seconds = time.perf_counter() - start
+        self.stdout.write(
+            f'Imported {totals["imported"]} venues ({totals["seats"]} seats) in {seconds:.1f}s, '
+            f'{totals["imported"] / seconds:.1f} venues/s. Skipped {totals["existing"]} existing and '
+            f'{totals["invalid"]} invalid'
+        )
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from api.models import Event, Venue
+
+
+class Command(BaseCommand):
+    help = 'Moves the events embedded in venue documents to the event collection'
+
+    def handle(self, *args, **options):
+        venues = Venue._get_collection().find({'events': {'$exists': True}}, {'events': 1})
+        num_venues = 0
+        num_events = 0
+
+        for venue in venues:
+            for event in venue['events']:
+                event = dict(event)
+                event_id = event.pop('id')
+                event['venue_id'] = venue['_id']
+
+                # $setOnInsert keeps the command safe to run again if it stops halfway through a venue
+                Event.objects(id=event_id).update_one(upsert=True, __raw__={'$setOnInsert': event})
+                num_events += 1
+
+            Venue.objects(id=venue['_id']).update_one(__raw__={'$unset': {'events': True}})
+            num_venues += 1
+
+        self.stdout.write(f'Moved {num_events} events out of {num_venues} venues')
@@ -0,0 +1,32 @@
+import time
+
+from django.conf import settings
+
+from api import stats
+
+
+class MetricsMiddleware:
+    """
+    Records the seconds taken by every request in the request_seconds histogram, labelled by view, method and status
+
+    Streamed responses are timed until they start streaming (see caching_chunks for their serialization)
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.METRICS_ENABLED:
+            return self.get_response(request)
+
+        start = time.perf_counter()
+        response = self.get_response(request)
+        view = request.resolver_match.func if request.resolver_match else None
+
+        stats.observe(
+            'request_seconds', time.perf_counter() - start,
+            view=getattr(view, 'view_class', view).__name__ if view else 'none',
+            method=request.method, status=response.status_code
+        )
+
+        return response
@@ -1,49 +1,55 @@
-from bson.objectid import ObjectId
-from collections import defaultdict
-from copy import deepcopy
+from bisect import bisect_left
+from collections import Counter, OrderedDict, defaultdict
 from datetime import datetime
+import logging
+import random
+import re
+from threading import Lock
+import time
 
+from django.conf import settings
 from mongoengine import (
+    BinaryField,
     BooleanField,
     DateTimeField,
     DictField,
     Document,
     EmbeddedDocument,
     EmbeddedDocumentField,
+    FloatField,
+    IntField,
     ListField,
     MapField,
     ObjectIdField,
-    StringField
+    StringField,
+    ValidationError
 )
 
-from api.exceptions import NotFoundException
+from api import stats, streams
+from api.allocation import RankAllocator
+from api.exceptions import ConflictException, NotFoundException
 
+logger = logging.getLogger(__name__)
 
-class Seat(EmbeddedDocument):
-    seat_id = StringField(required=True)
-    is_free = BooleanField(default=True)
-    is_blocked = BooleanField(default=False)
+# States of the seats of compact rows, which keep one byte per seat instead of a Seat document
+FREE = 0
+RESERVED = 1
+BLOCKED = 2
+HELD = 3
 
-    def reserve(self) -> bool:
-        """
-        Reserves a seat if it is available
-        """
-        if self.is_free and not self.is_blocked:
-            self.is_free = False
-            return True
+FREE_RUN = re.compile(bytes([FREE]) + b'+')
 
-        return False
+# Names the taken seats are counted by in Event.seat_counts
+COUNTED_STATES = {RESERVED: 'reserved', BLOCKED: 'blocked', HELD: 'held'}
+# Names of every state in the log of changes (see Event.get_changes)
+STATE_NAMES = {FREE: 'free', **COUNTED_STATES}
 
-    def block(self) -> bool:
-        """
-        Blocks a seat due a technical purpose
-        """
-        if not self.is_blocked and self.is_free:
-            self.is_blocked = True
-            self.is_free = False
-            return True
 
-        return False
+class Seat(EmbeddedDocument):
+    seat_id = StringField(required=True)
+    is_free = BooleanField(default=True)
+    is_blocked = BooleanField(default=False)
+    is_held = BooleanField(default=False)
 
     def to_dict(self) -> dict:
         """
@@ -60,33 +66,133 @@ class Row(EmbeddedDocument):
     row_id = StringField(required=True)
     rank = StringField(required=True)
     seats = ListField(EmbeddedDocumentField(Seat))
+    runs = ListField(ListField(IntField()), default=None)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._changed_seats = []
+        self._previous_states = {}
+        self._taken = []
+        self._seat_positions = None
+        self._state = None
+        self._layout = None
+
+    @classmethod
+    def from_layout(cls, layout: 'Row', state: bytes = None) -> 'Row':
+        """
+        A compact row holding the state of each seat as a byte (FREE, RESERVED, BLOCKED or HELD) while sharing
+            the seat ids with the row of the venue layout
+
+        A compact row is never saved as a document: its state is persisted by the event (see Event.seat_states)
+        """
+        row = cls(row_id=layout.row_id, rank=layout.rank)
+        row._state = bytearray(state if state is not None else layout.number_seats)
+        row._layout = layout
+
+        return row
+
+    @property
+    def compact(self) -> bool:
+        """
+        Check if the seats are held as a state per seat instead of Seat documents
+        """
+        return self._state is not None
 
     @property
-    def free_seats(self) -> bool:
+    def state(self) -> bytes:
+        """
+        The state of every seat of the row, one byte per seat
+        """
+        if self.compact:
+            return bytes(self._state)
+
+        return bytes([self.seat_state(index) for index in range(self.number_seats)])
+
+    @property
+    def seat_ids(self) -> list:
+        """
+        The id of every seat of the row, in order
+        """
+        return [seat.seat_id for seat in (self._layout.seats if self.compact else self.seats)]
+
+    @property
+    def free_runs(self) -> list:
+        """
+        The availability index of the row: the runs of contiguous empty seats as [start, length] pairs
+            ordered by the position of their first seat
+
+        Rows stored before the index existed get it built on first access
+        """
+        if self.runs is None:
+            self.runs = self.build_runs()
+
+        return self.runs
+
+    @property
+    def free_seats(self) -> int:
         """
         The number of free seats in the row
         """
-        return sum([1 for seat in self.seats if seat.is_free])
+        return sum([length for _, length in self.free_runs])
 
     @property
     def is_full(self) -> bool:
         """
         Check if the row is full
         """
-        return self.free_seats == 0
+        return len(self.free_runs) == 0
+
+    @property
+    def max_run(self) -> int:
+        """
+        The biggest number of contiguous empty seats in the row
+        """
+        return max([length for _, length in self.free_runs], default=0)
 
     @property
     def number_seats(self) -> int:
         """
         The number of seats in the row
         """
-        return len(self.seats)
+        return len(self._state) if self.compact else len(self.seats)
+
+    @property
+    def availability(self) -> dict:
+        """
+        The free runs bucketed by number of contiguous empty seats, holding the position of the first seat
+            of each run. Buckets are ordered by the first time a run of that size shows up in the row
+        {
+            1: [0, 5],
+            2: [2]
+        }
+        """
+        available_seats = defaultdict(list)
+
+        for start, length in self.free_runs:
+            available_seats[length].append(start)
+
+        return available_seats
 
     def add_seat(self, seat: Seat):
         """
         Add a seat to the row
         """
         self.seats.append(seat)
+        self._seat_positions = None
+
+    def seat_position(self, seat_id: int) -> int:
+        """
+        The position of a seat in the row, or None if there is no such seat
+
+        The seat id -> position index is built on the first lookup
+        """
+        if self.compact:
+            return self._layout.seat_position(seat_id)
+
+        if self._seat_positions is None:
+            self._seat_positions = {seat.seat_id: index for index, seat in enumerate(self.seats)}
+
+        return self._seat_positions.get(str(seat_id))
 
     @classmethod
     def create_row(cls, row_json: dict, row_number: str) -> 'Row':
@@ -102,80 +208,259 @@ class Row(EmbeddedDocument):
         A row is a group of seats which can be sequentially ordered (passing "sequential" in order) or
             ordered by outside in (passing "non-sequential in order)
         """
-        row = cls(row_id=row_number, rank=row_json['row_rank'])
-        is_even = row_json['num_seats'] % 2 == 0
-        current_id = 0
-
-        for _ in range(1, row_json['num_seats'] + 1):
-            if row_json['order'] == 'sequential':
-                current_id += 1
-
-            elif row_json['order'] == 'non-sequential':
-                # Arrange seats like 1 3 5 4 2 in the case the number of seats is odd (5)
-                # or 1 3 5 6 4 2 in the case the number of seats is even (6)
-                if current_id == 0:
-                    current_id += 1
-                elif is_even and current_id + 1 == row_json['num_seats']:
-                    current_id += 1
-                elif not is_even and current_id == row_json['num_seats']:
-                    current_id -= 1
-                elif current_id % 2 == 1:
-                    current_id += 2
-                else:
-                    current_id -= 2
-
-            row.add_seat(Seat(seat_id=str(current_id)))
+        num_seats = row_json['num_seats']
+
+        if row_json['order'] == 'sequential':
+            seat_ids = range(1, num_seats + 1)
+        elif row_json['order'] == 'non-sequential':
+            # Arrange seats like 1 3 5 4 2 in the case the number of seats is odd (5)
+            # or 1 3 5 6 4 2 in the case the number of seats is even (6)
+            seat_ids = list(range(1, num_seats + 1, 2)) + list(range(num_seats - num_seats % 2, 0, -2))
+        else:
+            seat_ids = [0] * num_seats
+
+        # All the seats are free, so the row is a single run
+        return cls(
+            row_id=row_number, rank=row_json['row_rank'], seats=[Seat(seat_id=str(seat_id)) for seat_id in seat_ids],
+            runs=[[0, num_seats]] if num_seats else []
+        )
+
+    def build_runs(self) -> list:
+        """
+        Walks the row to build the availability index from scratch
+        """
+        if self.compact:
+            return [[run.start(), run.end() - run.start()] for run in FREE_RUN.finditer(self._state)]
 
-        return row
+        runs = []
+        start = None
+
+        for index, seat in enumerate(self.seats):
+            if seat.is_free and not seat.is_blocked:
+                if start is None:
+                    start = index
+                continue
 
-    def number_contiguous_seats(self) -> dict:
+            if start is not None:
+                runs.append([start, index - start])
+                start = None
+
+        if start is not None:
+            runs.append([start, len(self.seats) - start])
+
+        return runs
+
+    def take_seat(self, index: int) -> None:
         """
-        Gives the number of contagious empty seats and bucket them by number of contagious empty seats
-        {
-            "1": [1, 6],
-            "2": [3, 4]
-        }
+        Removes the seat in position index from the availability index, splitting the run it belongs to
+        """
+        runs = self.free_runs
+        position = bisect_left(runs, [index + 1]) - 1
 
-        There is 2 empty isolated seats (1 and 6) and there is one 2-contagious empty seats (3, 4)
+        if position < 0:
+            return
+
+        start, length = runs[position]
+
+        if index >= start + length:
+            return
+
+        remaining = [
+            run for run in ([start, index - start], [index + 1, start + length - index - 1]) if run[1] > 0
+        ]
+        runs[position:position + 1] = remaining
+
+    def free_seat(self, index: int) -> None:
         """
-        available_seats = defaultdict(list)
+        Adds the seat in position index back to the availability index, merging it with the runs next to it
+        """
+        runs = self.free_runs
+        position = bisect_left(runs, [index])
+        start, length, end = index, 1, position
 
-        if self.is_full:
-            return available_seats
+        if position < len(runs) and runs[position][0] == index + 1:
+            length += runs[position][1]
+            end += 1
 
-        current_sequence = []
+        if position > 0 and sum(runs[position - 1]) == index:
+            position -= 1
+            start = runs[position][0]
+            length += runs[position][1]
 
-        for index, seat in enumerate(self.seats):
-            if seat.is_free and not seat.is_blocked:
-                current_sequence.append(seat)
-                continue
+        runs[position:end] = [[start, length]]
+
+    def set_state(self, index: int, state: int) -> None:
+        """
+        Moves the seat in position index to state, keeping the state it had when the row was loaded
+        """
+        if index not in self._previous_states:
+            self._previous_states[index] = self.seat_state(index)
+            self._changed_seats.append(index)
 
-            available_seats[len(current_sequence)].extend(current_sequence)
-            current_sequence = []
+        if self.compact:
+            self._state[index] = state
+            return
 
-        if len(current_sequence):
-            available_seats[len(current_sequence)].extend(current_sequence)
+        seat = self.seats[index]
+        seat.is_free = state == FREE
+        seat.is_blocked = state == BLOCKED
+        seat.is_held = state == HELD
 
-        return available_seats
+    def pop_changed_seats(self) -> list:
+        """
+        The (position, previous state) of the seats changed since the row was loaded or since the last call
+        """
+        changed_seats = [(index, self._previous_states[index]) for index in self._changed_seats]
+        self._changed_seats = []
+        self._previous_states = {}
+
+        return changed_seats
+
+    def seat_state(self, index: int) -> int:
+        """
+        The state (FREE, RESERVED, BLOCKED or HELD) of the seat in position index
+        """
+        if self.compact:
+            return self._state[index]
+
+        seat = self.seats[index]
+
+        return BLOCKED if seat.is_blocked else HELD if seat.is_held else FREE if seat.is_free else RESERVED
+
+    def count_seats(self) -> dict:
+        """
+        The number of reserved, blocked and held seats of the row
+        """
+        if self.compact:
+            return {name: self._state.count(state) for state, name in COUNTED_STATES.items()}
+
+        states = Counter(self.seat_state(index) for index in range(self.number_seats))
+
+        return {name: states[state] for state, name in COUNTED_STATES.items()}
+
+    def get_seat(self, index: int) -> Seat:
+        """
+        The seat in position index. Compact rows give a detached copy of the seat
+        """
+        if not self.compact:
+            return self.seats[index]
+
+        return Seat(
+            seat_id=self._layout.seats[index].seat_id,
+            is_free=self._state[index] == FREE,
+            is_blocked=self._state[index] == BLOCKED
+        )
+
+    def take(self, index: int, state: int) -> bool:
+        """
+        Moves a free seat in position index to state (RESERVED, BLOCKED or HELD)
+        """
+        if self.seat_state(index) != FREE:
+            return False
+
+        # The run index must be built from the state before the seat is taken
+        self.free_runs
+        self.set_state(index, state)
+        self.take_seat(index)
+
+        return True
+
+    def end_hold(self, index: int, state: int) -> bool:
+        """
+        Moves a held seat in position index to state, RESERVED when the hold is confirmed or FREE when it is
+            released
+        """
+        if self.seat_state(index) != HELD:
+            return False
+
+        # The run index must be built from the state before the seat is freed, or it would be in it twice
+        self.free_runs
+        self.set_state(index, state)
+
+        if state == FREE:
+            self.free_seat(index)
+
+        return True
+
+    @property
+    def last_taken(self) -> list:
+        """
+        The positions of the seats taken by the last make_reservation of the row
+        """
+        return self._taken
+
+    def reserve(self, index: int) -> bool:
+        """
+        Reserves the seat in position index
+        """
+        return self.take(index, RESERVED)
+
+    def make_reservation(self, num_people: int, to_seat: int = None, state: int = RESERVED) -> int:
+        """
+        Seats up to to_seat people (defaults to num_people) of a group of num_people in the row and
+            returns how many were seated. Their seats are moved to state (RESERVED, or HELD for a hold)
+
+        The group is seated in the first run with exactly num_people contiguous empty seats or, failing that,
+            in the first bigger run. If there is no way to seat the group together it is split across the
+            first run of each smaller size, starting by the size that showed up last in the row
+        """
+        to_seat = num_people if to_seat is None else to_seat
+        self._taken = []
+
+        if to_seat == 0 or self.is_full:
+            return 0
+
+        available_seats = self.availability
+        bigger_runs = [num_available for num_available in available_seats if num_available > num_people]
+
+        if num_people in available_seats:  # We found exactly num_people contiguous seats
+            chunks = [(available_seats[num_people][0], to_seat)]
+        elif bigger_runs:
+            chunks = [(available_seats[bigger_runs[0]][0], to_seat)]
+        else:  # let's split the group
+            chunks = []
+
+            for num_available in reversed(list(available_seats.keys())):
+                chunks.append((available_seats[num_available][0], min(num_available, to_seat)))
+                to_seat -= chunks[-1][1]
+
+                if to_seat == 0:
+                    break
+
+        for start, length in chunks:
+            for index in range(start, start + length):
+                if self.take(index, state):
+                    self._taken.append(index)
+
+        return len(self._taken)
 
     def block(self, seat_id: int) -> bool:
         """
         Marks a seat as blocked
         """
-        for seat in self.seats:
-            if seat.seat_id == str(seat_id):
-                return seat.block()
+        index = self.seat_position(seat_id)
+
+        if index is None:
+            return False
 
-        return False
+        return self.take(index, BLOCKED)
 
     def to_dict(self) -> dict:
         """
         A Row's dict representation
         """
+        if self.compact:
+            seats = [
+                {'seat_id': seat.seat_id, 'is_free': state == FREE, 'is_blocked': state == BLOCKED}
+                for seat, state in zip(self._layout.seats, self._state)
+            ]
+        else:
+            seats = [seat.to_dict() for seat in self.seats]
+
         return {
             'row_id': self.row_id,
             'rank': self.rank,
-            'seats': [seat.to_dict() for seat in self.seats]
+            'seats': seats
         }
 
 
@@ -183,6 +468,12 @@ class Section(EmbeddedDocument):
     type = StringField(required=True)
     rows = MapField(ListField(EmbeddedDocumentField(Row)))
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._changed_rows = []
+        self._row_positions = None
+        self._allocators = {}
+
     def add_row(self, row: Row) -> None:
         """
         Add a row to the section
@@ -191,107 +482,157 @@ class Section(EmbeddedDocument):
             self.rows[row.rank] = []
 
         self.rows[row.rank].append(row)
+        self._row_positions = None
+        self._allocators.pop(row.rank, None)
 
-    def get_rows_with_seats(self) -> list:
+    def row_position(self, row_id: int) -> tuple:
         """
-        Get all the rows with free seats
+        The (rank, position) of a row in the section, or None if there is no such row
+
+        The row id -> (rank, position) index is built on the first lookup
         """
-        return [row for row in self.rows if row.free_seats > 0]
+        if self._row_positions is None:
+            self._row_positions = {
+                row.row_id: (rank, position)
+                for rank, rows in self.rows.items()
+                for position, row in enumerate(rows)
+            }
+
+        return self._row_positions.get(str(row_id))
 
-    def make_reservation(self, group: list) -> list:
+    def make_reservation(self, group: list, state: int = RESERVED) -> list:
         """
-        Makes the reservation for groups of people
+        Makes the reservation for groups of people, moving their seats to state (RESERVED, or HELD for a hold)
 
         The number of people to be seated is the elements in the array and the array index represents
             the row rank. [2, 4] means 2 people to be seated in 1st rank, 4 people to be seated in 2nd rank
 
-        The availability structure is built as follow
+        Each row keeps its availability index (see Row.free_runs) stored along with the event and updated
+            every time a seat is taken, so only the rows where people end up seated are touched
             {
                 "1st Rank": {
                     "1" : {
-                        "1": [Seat 3],
-                        "2": [Seat 1, Seat 2, Seat 4, Seat 5]
+                        1: [2],
+                        2: [0, 3]
                     }
                 }
             }
 
         meaning
-            Row 1 in 1st Rank has 1 isolated seats (Seat 3)
-            Row 1 in 1st Rank has 2 2-contiguous seats (Seat 1, Seat 2 and Seat 4, Seat 5)
+            Row 1 in 1st Rank has 1 isolated seat (starting in position 2)
+            Row 1 in 1st Rank has 2 2-contiguous seats (starting in positions 0 and 3)
 
-        A huge improvement would be keeping this structure cached so we do not need to
-        generate it for every group of reservations
+        The rows to seat people in are picked by the allocator of each rank (see RankAllocator)
         """
 
         if len(group) > len(self.rows.keys()):
             return group
 
-        availability = {}
+        to_seat = group[:]
 
-        for rank, rows in self.rows.items():
-            availability[rank] = defaultdict(dict)
+        for rank_index, rank in enumerate(self.rows):
+            if rank_index == len(group):
+                break
 
-            for row in rows:
-                availability[rank][row.row_id] = row.number_contiguous_seats()
+            to_seat[rank_index], positions = self.get_allocator(rank).make_reservation(group[rank_index], state=state)
+            self._changed_rows.extend((rank, position) for position in positions)
 
-        to_seat = group[:]
+        return to_seat
 
-        for rank_index, num_people in enumerate(group):
-            for i, rank in enumerate(self.rows):
-                if i == rank_index:
-                    rank_availability = availability[rank]
+    def hold(self, group: list) -> tuple:
+        """
+        Seats groups of people as make_reservation does, holding their seats instead of reserving them
 
-            for available_seats in rank_availability.values():
-                if len(available_seats.get(num_people, [])):  # We found exactly num_people contiguous seats
-                    for i in range(num_people):
-                        available_seats[num_people][i].reserve()
-                        to_seat[rank_index] -= 1
-                    break
-                else:  # let's try rows with more available contiguous seats OR let's split the group
-                    for num_available in available_seats.keys():
-                        if num_available <= num_people:
-                            continue
+        Returns the number of people left without a seat for each rank and the (row id, seat id) of the seats held
+        """
+        changed = len(self._changed_rows)
+        to_seat = self.make_reservation(group, state=HELD)
+        seats = []
 
-                        for i in range(num_people):
-                            available_seats[num_available][i].reserve()
-                            to_seat[rank_index] -= 1
+        # Every row is seated at most once per reservation, so the seats it took last are the ones of this hold
+        for rank, position in self._changed_rows[changed:]:
+            row = self.rows[rank][position]
+            seats.extend((row.row_id, row.get_seat(index).seat_id) for index in row.last_taken)
 
-                        if to_seat[rank_index] == 0:
-                            break
+        return to_seat, seats
 
-                    if to_seat[rank_index] > 0:
-                        for num_available in reversed(list(available_seats.keys())):
-                            if num_available >= num_people:
-                                continue
+    def end_hold(self, row_id: str, seat_id: str, state: int) -> bool:
+        """
+        Interface to move a held seat in a row to state (see Row.end_hold)
+        """
+        row_position = self.row_position(row_id)
 
-                            for i in range(min(num_available, to_seat[rank_index])):
-                                available_seats[num_available][i].reserve()
-                                to_seat[rank_index] -= 1
+        if row_position is None:
+            return False
 
-                            if to_seat[rank_index] == 0:
-                                break
+        rank, position = row_position
+        row = self.rows[rank][position]
+        index = row.seat_position(seat_id)
 
-                    if to_seat[rank_index] == 0:
-                        break
+        if index is None or not row.end_hold(index, state):
+            return False
 
-                if to_seat[rank_index] == 0:
-                    break
+        if rank in self._allocators:
+            self._allocators[rank].refresh(position)
 
-        return to_seat
+        self._changed_rows.append(row_position)
+
+        return True
+
+    def get_allocator(self, rank: str) -> RankAllocator:
+        """
+        The allocator of the rows of a rank, built on first use
+        """
+        if rank not in self._allocators:
+            self._allocators[rank] = RankAllocator(self.rows[rank])
+
+        return self._allocators[rank]
 
     def block(self, row_id: int, *args, **kwargs) -> bool:
         """
         Interface to mark a seat in a row as blocked
         """
-        for _, rows in self.rows.items():
+        row_position = self.row_position(row_id)
+
+        if row_position is None:
+            return False
+
+        rank, position = row_position
+
+        if not self.rows[rank][position].block(*args, **kwargs):
+            return False
+
+        if rank in self._allocators:
+            self._allocators[rank].refresh(position)
+
+        self._changed_rows.append(row_position)
+
+        return True
+
+    def pop_changed_rows(self) -> list:
+        """
+        The (rank, position) of the rows with seats changed since the section was loaded or since the last call
+        """
+        changed_rows, self._changed_rows = self._changed_rows, []
+
+        return changed_rows
+
+    @classmethod
+    def from_layout(cls, layout: 'Section', states: dict) -> 'Section':
+        """
+        A section of compact rows (see Row.from_layout) built from a section of the venue layout
+            and the state of its rows by row id
+        """
+        section = cls(type=layout.type)
+
+        for rows in layout.rows.values():
             for row in rows:
-                if row.row_id == str(row_id):
-                    return row.block(*args, **kwargs)
+                section.add_row(Row.from_layout(row, states.get(row.row_id)))
 
-        return False
+        return section
 
     @classmethod
-    def create_section(cls, section_json: dict) -> 'Section':
+    def create_section(cls, section_json: dict, row_ids: 'RowIdAllocator' = None) -> 'Section':
         """
         Parse the section part of the JSON in form of
         "sections": [
@@ -301,13 +642,15 @@ class Section(EmbeddedDocument):
             }
         ]
 
-        A section is a group of rows
+        A section is a group of rows. Rows get their ids from row_ids, the allocator of the venue being built,
+            or are numbered from 1 when the section is built on its own
         """
         section = cls(type=section_json['section_type'])
+        row_ids = row_ids or RowIdAllocator()
 
         for row_type in section_json['rows']:
             for _ in range(row_type['num_rows']):
-                section.add_row(Row.create_row(row_type, next(id_generator)))
+                section.add_row(Row.create_row(row_type, row_ids.next_id()))
 
         return section
 
@@ -324,12 +667,114 @@ class Section(EmbeddedDocument):
         }
 
 
-class Event(EmbeddedDocument):
-    id = ObjectIdField(required=True, default=lambda: ObjectId())
+class Event(Document):
+    venue_id = ObjectIdField(required=True)
     event_name = StringField()
     created_at = DateTimeField()
     date = DateTimeField()
     sections = MapField(EmbeddedDocumentField(Section))
+    compact = BooleanField(default=False)
+    seat_states = MapField(MapField(BinaryField()))
+    seat_counts = MapField(MapField(MapField(IntField())), default=None)
+    holds = MapField(DictField())
+    holds_expire_at = FloatField(default=None)
+    changes = ListField(DictField())
+    version = IntField(default=0)
+
+    meta = {
+        'collection': 'event',
+        'indexes': [('venue_id', 'date'), {'fields': ['holds_expire_at'], 'sparse': True}]
+    }
+
+    @classmethod
+    def get(cls, venue_id: str, event_id: str, sections: list = None) -> 'Event':
+        """
+        Get an event occurring in a venue, without its log of changes
+
+        Only the seats of the given sections are loaded when sections is given, the event can't be used
+            for any other section (see get_section)
+        """
+        events = cls.objects(id=event_id, venue_id=venue_id).exclude('changes')
+
+        if sections is not None:
+            events = events.only('venue_id', 'compact', 'version', 'seat_counts', *[
+                f'{field}.{section_type}' for section_type in sections for field in ('sections', 'seat_states')
+            ])
+
+        try:
+            event = events[0]
+        except (IndexError, ValidationError):
+            raise NotFoundException
+
+        event._loaded_sections = None if sections is None else set(sections)
+
+        return event
+
+    @classmethod
+    def get_version(cls, venue_id: str, event_id: str) -> int:
+        """
+        The version of an event occurring in a venue, without loading its seats
+        """
+        try:
+            return cls.objects(id=event_id, venue_id=venue_id).only('version')[0].version
+        except (IndexError, ValidationError):
+            raise NotFoundException
+
+    @classmethod
+    def get_versions(cls, venue_id: str) -> list:
+        """
+        The (id, version) of all the events occurring in a venue, without loading their seats
+        """
+        return [(str(event.id), event.version) for event in cls.objects(venue_id=venue_id).only('version')]
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._seat_map = {}
+        self._loaded_sections = None
+        self._written = None
+        self._new_holds = set()
+        self._ended_holds = set()
+
+    @property
+    def layout(self) -> dict:
+        """
+        The layout of the venue the event is happening in
+        """
+        return get_layout(str(self.venue_id))
+
+    def get_section(self, section_type: str) -> Section:
+        """
+        A section of the event with the state of every seat
+
+        Compact events don't copy the venue layout, they only store the rows which are no longer all free
+            in seat_states (section type -> row id -> one byte per seat). The section is built from the layout
+            and those rows on first access
+        """
+        if self._loaded_sections is not None and section_type not in self._loaded_sections:
+            raise ValueError(f'Section {section_type} was not loaded')
+
+        if not self.compact:
+            return self.sections[section_type]
+
+        if section_type not in self._seat_map:
+            self._seat_map[section_type] = Section.from_layout(
+                self.layout[section_type], self.seat_states.get(section_type, {})
+            )
+
+        return self._seat_map[section_type]
+
+    @property
+    def seat_map(self) -> dict:
+        """
+        All the sections of the event with the state of every seat
+        """
+        if not self.compact:
+            return self.sections
+
+        return {
+            section_type: self.get_section(section_type) for section_type in self.layout
+            if self._loaded_sections is None or section_type in self._loaded_sections
+        }
 
     def make_reservation(self, section_type: int, *args, **kwargs) -> bool:
         """
@@ -338,10 +783,391 @@ class Event(EmbeddedDocument):
         A list zero'ed will be returned if all people found a seat
             otherwise the number of people without a seat will be returned in the list
         """
-        return self.sections[section_type].make_reservation(*args, **kwargs)
+        return self.get_section(section_type).make_reservation(*args, **kwargs)
+
+    def make_reservations(self, reservations: list) -> list:
+        """
+        Makes the reservations for a list of (section type, group) in order
+
+        Returns the number of people left without a seat for each reservation, as make_reservation does.
+            Nobody is seated for reservations in sections the event doesn't have
+        """
+        sections = self.layout if self.compact else self.sections
+
+        return [
+            self.make_reservation(section_type, group) if section_type in sections else group[:]
+            for section_type, group in reservations
+        ]
 
     def block(self, section_type, *args, **kwargs):
-        return self.sections[section_type].block(*args, **kwargs)
+        return self.get_section(section_type).block(*args, **kwargs)
+
+    def hold(self, section_type: str, group: list, hold_id: str, expires_at: float) -> dict:
+        """
+        Holds seats for a group of people in a section, picked as make_reservation would, until expires_at
+            (a timestamp) unless the hold is confirmed (see confirm) or released (see release) before
+
+        Returns the seats held and the number of people left without a seat, as make_reservation does.
+            No hold is kept when no seat was held
+        """
+        to_seat, seats = self.get_section(section_type).hold(group)
+        seats = [[section_type, row_id, seat_id] for row_id, seat_id in seats]
+
+        if seats:
+            self.holds[hold_id] = {'expires_at': expires_at, 'seats': seats}
+            self._new_holds.add(hold_id)
+
+        return {
+            'missing': to_seat,
+            'seats': [{'section': section, 'row_id': row_id, 'seat_id': seat_id} for section, row_id, seat_id in seats]
+        }
+
+    def end_hold(self, hold_id: str, state: int) -> bool:
+        """
+        Moves the seats of a hold to state, RESERVED or FREE, and drops the hold. False if there is no such hold
+
+        Holds are only loaded with the whole event (see get)
+        """
+        hold = self.holds.pop(hold_id, None)
+
+        if hold is None:
+            return False
+
+        for section_type, row_id, seat_id in hold['seats']:
+            self.get_section(section_type).end_hold(row_id, seat_id, state)
+
+        if hold_id in self._new_holds:
+            self._new_holds.discard(hold_id)
+        else:
+            self._ended_holds.add(hold_id)
+
+        return True
+
+    def confirm(self, hold_id: str, now: float) -> bool:
+        """
+        Reserves the seats of a hold which didn't expire by now (a timestamp)
+        """
+        if hold_id not in self.holds or self.holds[hold_id]['expires_at'] <= now:
+            return False
+
+        return self.end_hold(hold_id, RESERVED)
+
+    def release(self, hold_id: str) -> bool:
+        """
+        Frees the seats of a hold
+        """
+        return self.end_hold(hold_id, FREE)
+
+    def expire_holds(self, now: float) -> list:
+        """
+        Frees the seats of the holds expired by now (a timestamp), returning their ids
+
+        Only the seats of the expired holds are touched
+        """
+        expired = [hold_id for hold_id, hold in self.holds.items() if hold['expires_at'] <= now]
+
+        for hold_id in expired:
+            self.release(hold_id)
+
+        return expired
+
+    def seat_updates(self) -> tuple:
+        """
+        Builds the MongoDB update for the seats changed since the event was loaded
+
+        Returns the fields to $set, the guard fields the query must match, so the update only goes through
+            if all the changed seats are still in the state they were loaded with in the database, and the
+            (section type, rank, row id, seat id, previous state, state) of the seats changed. Compact rows are
+            written whole, as they are just one byte per seat, and rely on the event version alone
+        """
+        updates = {}
+        guards = {}
+        changes = []
+        sections = self._seat_map if self.compact else self.sections
+
+        for section_type, section in sections.items():
+            for rank, position in section.pop_changed_rows():
+                row = section.rows[rank][position]
+                changed_seats = row.pop_changed_seats()
+
+                for index, previous_state in changed_seats:
+                    changes.append((
+                        section_type, rank, row.row_id, row.get_seat(index).seat_id, previous_state,
+                        row.seat_state(index)
+                    ))
+
+                if row.compact:
+                    updates[f'seat_states.{section_type}.{row.row_id}'] = row.state
+                    continue
+
+                row_path = f'sections.{section_type}.rows.{rank}.{position}'
+                updates[f'{row_path}.runs'] = row.runs
+
+                for index, previous_state in changed_seats:
+                    seat = row.seats[index]
+                    # Seats are only changed from free (taken) or held (confirmed or released)
+                    guards[f'{row_path}.seats.{index}.{"is_held" if previous_state == HELD else "is_free"}'] = True
+                    updates[f'{row_path}.seats.{index}.is_free'] = seat.is_free
+                    updates[f'{row_path}.seats.{index}.is_blocked'] = seat.is_blocked
+                    updates[f'{row_path}.seats.{index}.is_held'] = seat.is_held
+
+        return updates, guards, changes
+
+    def version_guard(self):
+        """
+        The query on the version field matching the version the event was loaded with
+        """
+        # Events stored before versioning have no version field
+        return self.version if self.version else {'$in': [0, None]}
+
+    def seat_write(self) -> tuple:
+        """
+        The (query, update) persisting the seats changed in the event and its holds, or None when no seat
+            was changed
+
+        The update is a compare-and-swap on the event version, which is bumped on every write, and the query
+            doesn't match when the event was changed meanwhile by someone else. Call seats_saved once it
+            went through
+
+        The counters of reserved, blocked and held seats (see get_summary) and the log of changes
+            (see get_changes) are updated in the same write
+        """
+        updates, guards, changes = self.seat_updates()
+
+        if not updates:
+            return None
+
+        query = {'_id': self.id, 'version': self.version_guard()}
+        query.update(guards)
+        counts = Counter()
+
+        for section_type, rank, _, _, previous_state, state in changes:
+            if previous_state in COUNTED_STATES:
+                counts[(section_type, rank, COUNTED_STATES[previous_state])] -= 1
+
+            if state in COUNTED_STATES:
+                counts[(section_type, rank, COUNTED_STATES[state])] += 1
+
+        counts = {key: count for key, count in counts.items() if count}
+        increments = {'version': 1}
+        change = {
+            'version': self.version + 1,
+            'seats': [
+                {'section': section_type, 'row_id': row_id, 'seat_id': seat_id, 'state': STATE_NAMES[state]}
+                for section_type, _, row_id, seat_id, _, state in changes
+            ]
+        }
+        update = {}
+
+        if self._new_holds or self._ended_holds:
+            updates.update({f'holds.{hold_id}': self.holds[hold_id] for hold_id in self._new_holds})
+            update['$unset'] = {f'holds.{hold_id}': '' for hold_id in self._ended_holds}
+
+            # The holds are only all there when the whole event was loaded
+            if self._loaded_sections is None and self.holds:
+                updates['holds_expire_at'] = min(hold['expires_at'] for hold in self.holds.values())
+            elif self._loaded_sections is None:
+                update['$unset']['holds_expire_at'] = ''
+            else:
+                update['$min'] = {
+                    'holds_expire_at': min(self.holds[hold_id]['expires_at'] for hold_id in self._new_holds)
+                }
+
+            if not update['$unset']:
+                del update['$unset']
+
+        if self.seat_counts is not None:
+            increments.update({
+                f'seat_counts.{section_type}.{rank}.{name}': count
+                for (section_type, rank, name), count in counts.items()
+            })
+
+        self._written = (change, counts)
+        update.update({
+            '$set': updates,
+            '$inc': increments,
+            '$push': {'changes': {'$each': [change], '$slice': -settings.EVENT_CHANGE_LOG_SIZE}}
+        })
+
+        return query, update
+
+    def seats_saved(self) -> None:
+        """
+        Brings the event in line with the write built by seat_write, publishing the change to the workers
+            streaming the event
+
+        The write went through already, so failing to publish is only logged. Streams look the change up once
+            they get a newer one and it didn't come within SEAT_STREAM_REORDER_WINDOW seconds (see ChangeStream)
+        """
+        change, counts = self._written
+        self._written = None
+        self._new_holds = set()
+        self._ended_holds = set()
+        self.version += 1
+        stats.observe('seats_written', len(change['seats']), stats.SEAT_BUCKETS)
+
+        if self.seat_counts is not None:
+            for (section_type, rank, name), count in counts.items():
+                section_counts = self.seat_counts.setdefault(section_type, {})
+                rank_counts = section_counts.setdefault(rank, {})
+                rank_counts[name] = rank_counts.get(name, 0) + count
+
+        try:
+            streams.broadcaster.publish(str(self.id), change)
+        except Exception:
+            stats.incr('stream.publish_errors')
+            logger.exception('Failed to publish version %s of event %s', self.version, self.id)
+
+    def save_seats(self) -> None:
+        """
+        Persists the seats taken in the event with a targeted update instead of saving the whole event
+            (see seat_write)
+
+        Raises a ConflictException if the event was changed meanwhile by someone else
+        """
+        write = self.seat_write()
+
+        if write is None:
+            return
+
+        query, update = write
+
+        if not Event.objects(__raw__=query).update_one(__raw__=update):
+            raise ConflictException
+
+        self.seats_saved()
+
+    @classmethod
+    def get_changes(cls, venue_id: str, event_id: str, since: int) -> dict:
+        """
+        The seats taken in an event after version since, oldest first
+
+        Only the last EVENT_CHANGE_LOG_SIZE writes are kept, so when the changes since that version are no longer
+            all in the log (or the client is ahead of the event) a snapshot of the whole event is given instead
+        """
+        try:
+            event = cls.objects(id=event_id, venue_id=venue_id).only('version', 'changes')[0]
+        except (IndexError, ValidationError):
+            raise NotFoundException
+
+        if since == event.version:
+            return {'version': event.version, 'changes': []}
+
+        if since < event.version and event.changes and event.changes[0]['version'] <= since + 1:
+            return {
+                'version': event.version,
+                'changes': [change for change in event.changes if change['version'] > since]
+            }
+
+        event = cls.get(venue_id, event_id)
+
+        return {'version': event.version, 'event': event.to_dict()}
+
+    def count_seats(self) -> dict:
+        """
+        Counts the reserved, blocked and held seats of every rank of every section walking all the rows
+        """
+        counts = {}
+
+        for section_type, section in self.seat_map.items():
+            counts[section_type] = {}
+
+            for rank, rows in section.rows.items():
+                rank_counts = Counter()
+
+                for row in rows:
+                    rank_counts.update(row.count_seats())
+
+                counts[section_type][rank] = {name: rank_counts[name] for name in COUNTED_STATES.values()}
+
+        return counts
+
+    @classmethod
+    def get_summary(cls, venue_id: str, event_id: str) -> dict:
+        """
+        The number of free, reserved, blocked and held seats of every rank of every section of an event
+
+        It is built from the counters kept by the event and the capacity of the venue, without loading any seat.
+            Events stored before the counters existed get them counted and stored on first use
+        """
+        try:
+            event = cls.objects(id=event_id, venue_id=venue_id).only('venue_id', 'version', 'seat_counts')[0]
+        except (IndexError, ValidationError):
+            raise NotFoundException
+
+        if event.seat_counts is None:
+            event = cls.get(venue_id, event_id)
+            event.seat_counts = event.count_seats()
+
+            # Bumping the version makes writers which loaded the event without counters try again with them
+            Event.objects(__raw__={'_id': event.id, 'version': event.version_guard(), 'seat_counts': None}).update_one(
+                __raw__={'$set': {'seat_counts': event.seat_counts}, '$inc': {'version': 1}}
+            )
+
+        summary = {}
+
+        for section_type, ranks in get_capacity(str(event.venue_id)).items():
+            summary[section_type] = {}
+
+            for rank, num_seats in ranks.items():
+                counts = event.seat_counts.get(section_type, {}).get(rank, {})
+                summary[section_type][rank] = {name: counts.get(name, 0) for name in COUNTED_STATES.values()}
+                summary[section_type][rank]['free'] = num_seats - sum(summary[section_type][rank].values())
+
+        return summary
+
+    @staticmethod
+    def operation_sections(method: str, *args) -> list:
+        """
+        The sections an operation works on given its arguments, or None when they aren't known
+        """
+        if method == 'make_reservations':
+            return [section_type for section_type, _ in args[0]]
+
+        if method in ('make_reservation', 'block', 'hold'):
+            return [args[0]]
+
+        return None
+
+    @classmethod
+    def update_event(cls, venue_id: str, event_id: str, method: str, *args, **kwargs):
+        """
+        Loads the event, calls one of its operations (make_reservation, block) and persists the seats taken,
+            loading it again and retrying the operation on fresh data when the event was changed meanwhile
+            by someone else
+
+        Only the sections the operation works on are loaded, which is safe as only the seats taken are written
+
+        Retries wait a random time, up to EVENT_UPDATE_BACKOFF seconds doubled on every retry, and the operation
+            gives up raising a ConflictException after settings.EVENT_UPDATE_RETRIES retries
+        """
+        sections = cls.operation_sections(method, *args)
+
+        for attempt in range(settings.EVENT_UPDATE_RETRIES + 1):
+            with stats.timer(f'{method}.load'):
+                event = cls.get(venue_id, event_id, sections)
+
+            try:
+                with stats.timer(f'{method}.run'):
+                    result = getattr(event, method)(*args, **kwargs)
+
+                with stats.timer(f'{method}.save'):
+                    event.save_seats()
+            except ConflictException:
+                stats.incr(f'{method}.conflicts')
+
+                if attempt == settings.EVENT_UPDATE_RETRIES:
+                    stats.incr(f'{method}.gave_up')
+                    raise
+
+                stats.incr(f'{method}.retries')
+                # Workers which conflicted together don't retry together
+                time.sleep(random.uniform(0, settings.EVENT_UPDATE_BACKOFF * 2 ** attempt))
+                continue
+
+            stats.incr(f'{method}.succeeded')
+
+            return result
 
     def to_dict(self) -> dict:
         """
@@ -352,9 +1178,10 @@ class Event(EmbeddedDocument):
             'event_name': self.event_name,
             'created_at': self.created_at.isoformat(),
             'date': self.date.isoformat(),
+            'version': self.version,
             'sections': {
                 section_type: section.to_dict()
-                for section_type, section in self.sections.items()
+                for section_type, section in self.seat_map.items()
             }
         }
 
@@ -363,9 +1190,52 @@ class Venue(Document):
     venue_name = StringField()
     input_json = DictField()
     base_layout = MapField(EmbeddedDocumentField(Section))
-    events = ListField(EmbeddedDocumentField(Event))
 
-    meta = {'collection': 'venue'}
+    # Venues stored before events got their own collection still have the events embedded until
+    # `python manage.py migrate_events` moves them out
+    meta = {'collection': 'venue', 'strict': False}
+
+    def delete(self, *args, **kwargs) -> None:
+        super().delete(*args, **kwargs)
+        layout_cache.forget(str(self.id))
+
+    @classmethod
+    def get_page(cls, size: int, after: str = None, page: int = None):
+        """
+        The query for a page of venues ordered by id, the ones right after the venue with id after
+
+        Pages are looked up by id instead of skipping the venues of the previous pages, so every page costs
+            the same. page (starting at 1) is still accepted for clients counting pages
+        """
+        venues = cls.objects(id__gt=after) if after else cls.objects
+
+        if page:
+            venues = venues.skip((page - 1) * size)
+
+        return venues.order_by('id').limit(size)
+
+    @classmethod
+    def get_summaries(cls, venues) -> list:
+        """
+        The summary (see to_summary) of the venues of a query, loading only the fields it needs
+
+        Only the first VENUE_SUMMARY_EVENTS events of each venue are listed, read with a query per venue
+            on the (venue_id, date) index
+        """
+        limit = settings.VENUE_SUMMARY_EVENTS
+        summaries = []
+
+        for venue in venues.only('venue_name'):
+            events = list(
+                Event.objects(venue_id=venue.id).only('venue_id', 'event_name', 'date').order_by('date').limit(limit + 1)
+            )
+            summaries.append(venue.to_summary(events[:limit], more_events=len(events) > limit))
+
+        return summaries
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._events = {}
 
     def create_venue(self, sections: dict) -> None:
         """
@@ -386,37 +1256,66 @@ class Venue(Document):
                 ]
             }
         """
-        reset_generator()
+        self.build_layout(sections)
+        self.save(load_bulk=False)
 
-        for section in sections:
-            self.base_layout[section['section_type']] = Section.create_section(section)
+    def build_layout(self, sections: dict) -> None:
+        """
+        Builds the venue seating plan from the JSON defining the seating sections (see create_venue)
+            without saving it
+        """
+        row_ids = RowIdAllocator()
 
-        self.save(load_bulk=False)
+        for section in sections:
+            self.base_layout[section['section_type']] = Section.create_section(section, row_ids)
 
-    def create_event(self, date: datetime, event_name: str ='Test Event') -> Event:
+    def create_event(self, date: datetime, event_name: str ='Test Event', compact: bool = None) -> Event:
         """
         Creates an event in the venue
+
+        Compact events (settings.COMPACT_EVENTS by default) reference the venue layout instead of holding
+            a copy of it, so nothing but the event details is written until seats get reserved or blocked
         """
-        self.events.append(Event(
+        compact = settings.COMPACT_EVENTS if compact is None else compact
+        event = Event(
+            venue_id=self.id,
             event_name=event_name,
             created_at=datetime.now(),
             date=date,
-            sections=deepcopy(self.base_layout)
-        ))
+            compact=compact,
+            seat_counts={}
+        )
+
+        if not compact:
+            # Copying through SON, unlike deepcopy, builds the sections again with their lookup indexes
+            event.sections = {
+                section_type: Section._from_son(section.to_mongo())
+                for section_type, section in get_layout(str(self.id)).items()
+            }
 
-        self.save()
+        event.save()
+        self._events[str(event.id)] = event
 
-        return self.events[-1]
+        return event
 
     def get_event(self, event_id: str) -> Event:
         """
         Get an event occurring in the venue
+
+        Events are loaded by id once and kept by the venue for the next lookups
         """
-        for event in self.events:
-            if str(event.id) == event_id:
-                return event
+        event_id = str(event_id)
 
-        raise NotFoundException
+        if event_id not in self._events:
+            self._events[event_id] = Event.get(self.id, event_id)
+
+        return self._events[event_id]
+
+    def get_events(self) -> list:
+        """
+        All the events occurring in the venue, without their log of changes
+        """
+        return list(Event.objects(venue_id=self.id).exclude('changes').order_by('date'))
 
     def make_reservation(self, event_id: str, *args, **kwargs) -> list:
         """
@@ -425,27 +1324,28 @@ class Venue(Document):
         A list zero'ed will be returned if all people found a seat
             otherwise the number of people without a seat will be returned in the list
         """
-        event = self.get_event(event_id)
-        result = event.make_reservation(*args, **kwargs)
-        self.save()
-
-        return result
+        return self.update_event(event_id, 'make_reservation', *args, **kwargs)
 
     def block(self, event_id: str, *args, **kwargs) -> bool:
         """
         Interface to mark a seat as blocked
         """
-        event = self.get_event(event_id)
-        result = event.block(*args, **kwargs)
+        return self.update_event(event_id, 'block', *args, **kwargs)
 
-        if result:
-            self.save()
+    def update_event(self, event_id: str, method: str, *args, **kwargs):
+        """
+        Runs an event operation on fresh data (see Event.update_event), dropping the event kept by the venue
+            as it no longer holds the latest seats
+        """
+        self._events.pop(str(event_id), None)
 
-        return result
+        return Event.update_event(self.id, event_id, method, *args, **kwargs)
 
-    def to_dict(self) -> dict:
+    def to_dict(self, events: bool = False) -> dict:
         """
         A Venue's dict representation
+
+        The venue events are only loaded when asked for
         """
         return {
             'id': str(self.id),
@@ -455,24 +1355,112 @@ class Venue(Document):
                 section_type: section.to_dict()
                 for section_type, section in self.base_layout.items()
             },
-            'events': [event.to_dict() for event in self.events]
+            'events': [event.to_dict() for event in self.get_events()] if events else []
+        }
+
+    def to_summary(self, events: list, more_events: bool = False) -> dict:
+        """
+        A Venue's dict representation without its layout and seats, listing the given events, more_events
+            telling the venue has others
+        """
+        return {
+            'id': str(self.id),
+            'venue_name': self.venue_name,
+            'events': [
+                {'id': str(event.id), 'event_name': event.event_name, 'date': event.date.isoformat()}
+                for event in events
+            ],
+            'more_events': more_events
         }
 
 
-def row_number_generator():
+class LayoutCache:
     """
-    Generator to get numbers from 1 to 9999
+    LRU cache of the base layouts of the venues and their capacity, kept by the process as layouts never change
+        once the venue is created
+
+    Layouts hold a document per seat, so the cache is bounded by the number of seats of the layouts it keeps
+        (LAYOUT_CACHE_SEATS) rather than by the number of venues. The layout used last is always kept
     """
-    for num_row in range(1, 9999):
-        yield str(num_row)
 
+    def __init__(self, max_seats: int):
+        self.max_seats = max_seats
+        self._layouts = OrderedDict()
+        self._seats = 0
+        self._lock = Lock()
 
-def reset_generator():
+    def get(self, venue_id: str) -> tuple:
+        """
+        The (layout, capacity, number of seats) of a venue, loading the layout when it isn't cached
+        """
+        with self._lock:
+            if venue_id in self._layouts:
+                self._layouts.move_to_end(venue_id)
+                return self._layouts[venue_id]
+
+        layout = Venue.objects(id=venue_id).only('base_layout')[0].base_layout
+        capacity = {
+            section_type: {rank: sum([row.number_seats for row in rows]) for rank, rows in section.rows.items()}
+            for section_type, section in layout.items()
+        }
+        seats = sum(sum(ranks.values()) for ranks in capacity.values())
+
+        with self._lock:
+            # Loaded by another thread meanwhile, the events of the venue keep sharing the same layout
+            if venue_id not in self._layouts:
+                self._layouts[venue_id] = (layout, capacity, seats)
+                self._seats += seats
+
+            self._layouts.move_to_end(venue_id)
+
+            while self._seats > self.max_seats and len(self._layouts) > 1:
+                self._seats -= self._layouts.popitem(last=False)[1][2]
+
+            return self._layouts[venue_id]
+
+    def forget(self, venue_id: str) -> None:
+        with self._lock:
+            if venue_id in self._layouts:
+                self._seats -= self._layouts.pop(venue_id)[2]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._layouts.clear()
+            self._seats = 0
+
+
+layout_cache = LayoutCache(settings.LAYOUT_CACHE_SEATS)
+
+
+def get_layout(venue_id: str) -> dict:
     """
-    Reset the module level generator
+    The base layout of a venue (see LayoutCache)
+
+    It is shared by all the events of the venue, which must never change it
+    """
+    return layout_cache.get(venue_id)[0]
+
+
+def get_capacity(venue_id: str) -> dict:
+    """
+    The number of seats of every rank of every section of a venue
     """
-    global id_generator
-    id_generator = row_number_generator()
+    return layout_cache.get(venue_id)[1]
+
+
+class RowIdAllocator:
+    """
+    Hands out the ids of the rows of a venue, numbering them from 1 in the order the rows are defined
+
+    Every layout being built has its own, so venues can be built at the same time by any number of threads
+        or processes and the same JSON always gets the same ids
+    """
+
+    def __init__(self, start: int = 1):
+        self._next = start
 
+    def next_id(self) -> str:
+        row_id = str(self._next)
+        self._next += 1
 
-id_generator = row_number_generator()
+        return row_id
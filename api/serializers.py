@@ -0,0 +1,146 @@
+import json
+import re
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+from api.models import BLOCKED, FREE, HELD, RESERVED, Event
+
+STATE_CODES = {FREE: 'F', RESERVED: 'R', BLOCKED: 'B', HELD: 'H'}
+STATE_RUN = re.compile(rb'(.)\1*', re.DOTALL)
+
+
+class JsonObject:
+    """
+    A JSON object whose (key, value) members are only produced while it is written
+    """
+
+    def __init__(self, members):
+        self.members = members
+
+
+class JsonArray:
+    """
+    A JSON array whose items are only produced while it is written
+    """
+
+    def __init__(self, items):
+        self.items = items
+
+
+def iter_json(value):
+    """
+    Encodes value as JSON in chunks, walking the JsonObject and JsonArray in it as they are written,
+        so only one of their members needs to be in memory at a time
+
+    Any other value is encoded whole
+    """
+    if isinstance(value, dict):
+        value = JsonObject(value.items())
+
+    if isinstance(value, JsonObject):
+        yield '{'
+
+        for index, (key, member) in enumerate(value.members):
+            yield f'{", " if index else ""}{json.dumps(str(key))}: '
+            yield from iter_json(member)
+
+        yield '}'
+    elif isinstance(value, JsonArray):
+        yield '['
+
+        for index, item in enumerate(value.items):
+            if index:
+                yield ', '
+
+            yield from iter_json(item)
+
+        yield ']'
+    else:
+        yield json.dumps(value, cls=DjangoJSONEncoder)
+
+
+def iter_chunks(value, chunk_size: int = None):
+    """
+    Encodes value as JSON (see iter_json) in chunks of about chunk_size bytes (STREAMING_CHUNK_SIZE by default)
+    """
+    chunk_size = chunk_size or settings.STREAMING_CHUNK_SIZE
+    buffer = []
+    size = 0
+
+    for part in iter_json(value):
+        part = part.encode()
+        buffer.append(part)
+        size += len(part)
+
+        if size >= chunk_size:
+            yield b''.join(buffer)
+            buffer = []
+            size = 0
+
+    if buffer:
+        yield b''.join(buffer)
+
+
+def encode_state(state: bytes) -> str:
+    """
+    Run-length encodes the state of the seats of a row, e.g. R5F3 for 5 reserved seats followed by 3 free
+    """
+    return ''.join([f'{STATE_CODES[run.group()[0]]}{len(run.group())}' for run in STATE_RUN.finditer(state)])
+
+
+def compact_row_json(row) -> dict:
+    """
+    A Row as its seat ids, separated by spaces, and its run-length encoded state (see encode_state)
+    """
+    return {'row_id': row.row_id, 'seats': ' '.join(row.seat_ids), 'state': encode_state(row.state)}
+
+
+def section_json(section, compact: bool = False) -> JsonObject:
+    """
+    A Section written a row at a time, as in Section.to_dict or with compact rows (see compact_row_json)
+    """
+    row_json = compact_row_json if compact else lambda row: row.to_dict()
+
+    return JsonObject([
+        ('type', section.type),
+        ('rows', JsonObject(
+            (rank, JsonArray(row_json(row) for row in rows)) for rank, rows in section.rows.items()
+        ))
+    ])
+
+
+def event_json(event, compact: bool = False) -> JsonObject:
+    """
+    An Event written a row at a time, as in Event.to_dict or with compact rows (see compact_row_json)
+    """
+    members = [
+        ('id', str(event.id)),
+        ('event_name', event.event_name),
+        ('created_at', event.created_at.isoformat()),
+        ('date', event.date.isoformat()),
+        ('version', event.version),
+        ('sections', JsonObject(
+            (section_type, section_json(section, compact)) for section_type, section in event.seat_map.items()
+        ))
+    ]
+
+    return JsonObject(members + [('format', 'compact')] if compact else members)
+
+
+def venue_json(venue, events: bool = False) -> JsonObject:
+    """
+    A Venue written a row at a time, as in Venue.to_dict, loading its events one by one without their log
+        of changes
+    """
+    return JsonObject([
+        ('id', str(venue.id)),
+        ('venue_name', venue.venue_name),
+        ('input_json', venue.input_json),
+        ('base_layout', JsonObject(
+            (section_type, section_json(section)) for section_type, section in venue.base_layout.items()
+        )),
+        ('events', JsonArray(
+            event_json(event) for event in Event.objects(venue_id=venue.id).exclude('changes').order_by('date')
+        ) if events else [])
+    ])
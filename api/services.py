@@ -0,0 +1,79 @@
+import json
+
+from django.conf import settings
+from django.http import HttpResponse
+
+from api import engine
+from api.cache import cache_key, cached_response, caching_chunks, response_cache
+from api.exceptions import NotFoundException
+from api.models import Event, Venue
+from api.serializers import event_json, iter_chunks, venue_json
+
+
+def event_key(venue_id: str, event_id: str, compact: bool = False) -> str:
+    """
+    The cache key of the current version of an event
+    """
+    return cache_key('event', event_id, Event.get_version(venue_id, event_id), compact)
+
+
+def venue_key(venue_id: str, layout: bool = False, events: bool = False) -> str:
+    """
+    The cache key of a venue, with the current version of its events when they are included
+    """
+    # Venues never change once created, only their events do
+    return cache_key('venue', venue_id, layout, sorted(Event.get_versions(venue_id)) if events else None)
+
+
+def event_response(request, venue_id: str, event_id: str, compact: bool = False) -> HttpResponse:
+    """
+    The cached JSON response of an event (see cached_response)
+    """
+    return cached_response(
+        request, event_key(venue_id, event_id, compact),
+        lambda: {'event': event_json(Event.get(venue_id, event_id), compact=compact)}
+    )
+
+
+def venue_response(request, venue_id: str, layout: bool = False, events: bool = False) -> HttpResponse:
+    """
+    The cached JSON response of a venue (see cached_response)
+    """
+    def build():
+        exclude = [] if layout else ['base_layout']
+
+        try:
+            venue = Venue.objects(id=venue_id).exclude(*exclude)[0]
+        except IndexError:
+            raise NotFoundException
+
+        return {'venue': venue_json(venue, events=events)}
+
+    return cached_response(request, venue_key(venue_id, layout, events), build)
+
+
+def update_event(venue_id: str, event_id: str, method: str, *args):
+    """
+    Runs an operation of an event (see Event.update_event), on the engine of the event when EVENT_ENGINE is on
+        (see api.engine)
+
+    The engine must be the only writer of its events, so with EVENT_ENGINE on the events of other partitions
+        are refused with an UnavailableException
+    """
+    if settings.EVENT_ENGINE:
+        return engine.update_event(venue_id, event_id, method, *args)
+
+    return Event.update_event(venue_id, event_id, method, *args)
+
+
+def get_event(venue_id: str, event_id: str) -> dict:
+    """
+    An event as in Event.to_dict, going through the same cache as the event responses
+    """
+    key = event_key(venue_id, event_id)
+    content = response_cache.get(key)
+
+    if content is None:
+        content = b''.join(caching_chunks(key, iter_chunks({'event': event_json(Event.get(venue_id, event_id))})))
+
+    return json.loads(content)['event']
@@ -0,0 +1,168 @@
+from bisect import bisect_left
+from collections import Counter
+import re
+from threading import Lock
+import time
+
+from django.conf import settings
+
+# Upper bounds of the histogram buckets of durations (seconds), sizes (bytes) and numbers of seats
+TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216, 67108864)
+SEAT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+METRIC_PREFIX = 'buy_a_ticket'
+
+_counters = Counter()
+_histograms = {}
+_buckets = {}
+_lock = Lock()
+
+
+def incr(name: str, value: int = 1) -> None:
+    """
+    Increments a process wide counter
+    """
+    with _lock:
+        _counters[name] += value
+
+
+def get(name: str) -> int:
+    """
+    The current value of a counter
+    """
+    return _counters[name]
+
+
+def snapshot() -> dict:
+    """
+    A copy of all the counters of the process
+    """
+    with _lock:
+        return dict(_counters)
+
+
+def reset() -> None:
+    """
+    Sets all counters back to zero and empties the histograms, forgetting their buckets
+    """
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+        _buckets.clear()
+
+
+def observe(metric: str, value: float, buckets: tuple = TIME_BUCKETS, **labels) -> None:
+    """
+    Records a value in the histogram of metric for the given labels, unless METRICS_ENABLED is off
+    """
+    if not settings.METRICS_ENABLED:
+        return
+
+    key = (metric, tuple(sorted(labels.items())))
+
+    with _lock:
+        _buckets.setdefault(metric, buckets)
+
+        if key not in _histograms:
+            # A count per bucket, values over the last bound included, their sum and how many there are
+            _histograms[key] = [[0] * (len(_buckets[metric]) + 1), 0, 0]
+
+        histogram = _histograms[key]
+        histogram[0][bisect_left(_buckets[metric], value)] += 1
+        histogram[1] += value
+        histogram[2] += 1
+
+
+def histogram(metric: str, **labels) -> tuple:
+    """
+    The (sum, count) of the values recorded in the histogram of metric for the given labels
+    """
+    with _lock:
+        _, total, count = _histograms.get((metric, tuple(sorted(labels.items()))), (None, 0, 0))
+
+    return total, count
+
+
+class Timer:
+    """
+    Records the seconds spent in a with block in the stage_seconds histogram, labelled by stage
+    """
+
+    def __init__(self, stage: str):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        observe('stage_seconds', time.perf_counter() - self.start, stage=self.stage)
+
+
+class NoTimer:
+    """
+    Stands in for Timer when metrics are off
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+
+NO_TIMER = NoTimer()
+
+
+def timer(stage: str):
+    """
+    A context manager timing a stage of a request (see Timer), which does nothing when METRICS_ENABLED is off
+    """
+    return Timer(stage) if settings.METRICS_ENABLED else NO_TIMER
+
+
+def metric_name(name: str) -> str:
+    return f'{METRIC_PREFIX}_{re.sub("[^a-zA-Z0-9_]", "_", name)}'
+
+
+def format_labels(labels: tuple, **extra) -> str:
+    labels = list(labels) + list(extra.items())
+
+    return '{' + ','.join([f'{key}="{value}"' for key, value in labels]) + '}' if labels else ''
+
+
+def exposition() -> str:
+    """
+    The counters and histograms of the process in the Prometheus text format
+    """
+    with _lock:
+        counters = sorted(_counters.items())
+        histograms = sorted([
+            (key, (list(buckets), total, count)) for key, (buckets, total, count) in _histograms.items()
+        ])
+        bounds = dict(_buckets)
+
+    lines = []
+
+    for name, value in counters:
+        lines += [f'# TYPE {metric_name(name)}_total counter', f'{metric_name(name)}_total {value}']
+
+    metric = None
+
+    for (current, labels), (buckets, total, count) in histograms:
+        name = metric_name(current)
+
+        if current != metric:
+            metric = current
+            lines.append(f'# TYPE {name} histogram')
+
+        cumulative = 0
+
+        for bound, bucket in zip(list(bounds[current]) + ['+Inf'], buckets):
+            cumulative += bucket
+            lines.append(f'{name}_bucket{format_labels(labels, le=bound)} {cumulative}')
+
+        lines += [f'{name}_sum{format_labels(labels)} {total}', f'{name}_count{format_labels(labels)} {count}']
+
+    return '\n'.join(lines) + '\n'
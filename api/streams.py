@@ -0,0 +1,285 @@
+import asyncio
+from collections import defaultdict
+import json
+from queue import Full, Queue
+from threading import Lock
+import time
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+from api import stats
+
+KEEP_ALIVE = ': keep-alive\n\n'
+
+
+class LocalChannel:
+    """
+    Publish/subscribe channel within the worker, standing in for a shared one when there is a single worker
+        or in tests
+    """
+
+    def __init__(self):
+        self._callbacks = defaultdict(list)
+        self._lock = Lock()
+
+    def publish(self, topic: str, message: dict) -> None:
+        with self._lock:
+            callbacks = list(self._callbacks.get(topic, []))
+
+        for callback in callbacks:
+            callback(topic, message)
+
+    def subscribe(self, topic: str, callback) -> None:
+        with self._lock:
+            self._callbacks[topic].append(callback)
+
+    def unsubscribe(self, topic: str, callback) -> None:
+        with self._lock:
+            if callback in self._callbacks.get(topic, []):
+                self._callbacks[topic].remove(callback)
+
+            if not self._callbacks.get(topic):
+                self._callbacks.pop(topic, None)
+
+
+class RedisChannel:
+    """
+    Publish/subscribe channel shared by all the workers through Redis
+
+    Needs the redis package, which is only imported when the channel is configured
+    """
+
+    def __init__(self, url: str):
+        import redis
+
+        self._client = redis.Redis.from_url(url)
+        self._pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+        self._thread = None
+        self._lock = Lock()
+
+    def publish(self, topic: str, message: dict) -> None:
+        self._client.publish(topic, json.dumps(message, cls=DjangoJSONEncoder))
+
+    def subscribe(self, topic: str, callback) -> None:
+        with self._lock:
+            self._pubsub.subscribe(**{topic: lambda message: callback(topic, json.loads(message['data']))})
+
+            # Messages are read by a single thread per worker, started with the first subscription
+            if self._thread is None:
+                self._thread = self._pubsub.run_in_thread(sleep_time=0.1, daemon=True)
+
+    def unsubscribe(self, topic: str, callback) -> None:
+        with self._lock:
+            self._pubsub.unsubscribe(topic)
+
+
+class Broadcaster:
+    """
+    Fans out the messages of a channel to the subscribers of a worker
+
+    The worker subscribes to the channel once per topic, no matter how many subscribers it has, and every
+        subscriber gets its own bounded queue. Subscribers too slow to keep up get None instead of the
+        messages they missed, telling them to start over
+    """
+
+    def __init__(self, channel, queue_size: int):
+        self.channel = channel
+        self.queue_size = queue_size
+        self._subscribers = {}
+        self._lock = Lock()
+
+    def publish(self, topic: str, message: dict) -> None:
+        self.channel.publish(topic, message)
+
+    def subscribe(self, topic: str, subscriber=None):
+        """
+        Subscribes to a topic, returning the queue the messages are put in, a Queue unless subscriber
+            (e.g. an AsyncSubscriber) is given
+        """
+        subscriber = Queue(self.queue_size) if subscriber is None else subscriber
+
+        with self._lock:
+            if topic not in self._subscribers:
+                self._subscribers[topic] = set()
+                self.channel.subscribe(topic, self.deliver)
+
+            self._subscribers[topic].add(subscriber)
+
+        return subscriber
+
+    def unsubscribe(self, topic: str, subscriber: Queue) -> None:
+        with self._lock:
+            subscribers = self._subscribers.get(topic, set())
+            subscribers.discard(subscriber)
+
+            if not subscribers and topic in self._subscribers:
+                del self._subscribers[topic]
+                self.channel.unsubscribe(topic, self.deliver)
+
+    def number_subscribers(self, topic: str) -> int:
+        with self._lock:
+            return len(self._subscribers.get(topic, ()))
+
+    def deliver(self, topic: str, message: dict) -> None:
+        with self._lock:
+            subscribers = list(self._subscribers.get(topic, ()))
+
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(message)
+            except Full:
+                stats.incr('stream.lagging')
+
+                with subscriber.mutex:
+                    subscriber.queue.clear()
+
+                subscriber.put_nowait(None)
+
+
+class AsyncSubscriber:
+    """
+    Subscriber of a Broadcaster for asyncio, getting the messages on the event loop it was made in
+
+    As the queues of the other subscribers, it gets None instead of the messages it missed when it doesn't keep up
+    """
+
+    def __init__(self, size: int):
+        self.loop = asyncio.get_event_loop()
+        self.queue = asyncio.Queue(size)
+
+    def put_nowait(self, message: dict) -> None:
+        # Messages are delivered from the thread publishing them or reading the channel
+        self.loop.call_soon_threadsafe(self._put, message)
+
+    def _put(self, message: dict) -> None:
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            stats.incr('stream.lagging')
+
+            while not self.queue.empty():
+                self.queue.get_nowait()
+
+            self.queue.put_nowait(None)
+
+    async def get(self, timeout: float) -> dict:
+        """
+        The next message, raising asyncio.TimeoutError when none comes within timeout seconds
+        """
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+
+def get_channel(url: str = None):
+    """
+    The channel seat changes are published on, shared through Redis when url is given
+    """
+    return LocalChannel() if url is None else RedisChannel(url)
+
+
+def server_sent_event(event: str, data: dict, event_id: int = None) -> str:
+    """
+    A message in the text/event-stream format
+    """
+    message = f'event: {event}\ndata: {json.dumps(data, cls=DjangoJSONEncoder)}\n\n'
+
+    return message if event_id is None else f'id: {event_id}\n{message}'
+
+
+class ChangeStream:
+    """
+    The server-sent events of the seat changes of an event, starting with initial, the changes since the version
+        the client had (see Event.get_changes), followed by the changes published while streaming
+
+    Changes published by other workers can arrive out of order, so everything newer than what the client was given
+        is passed on as it comes. A version skipped over is waited for SEAT_STREAM_REORDER_WINDOW seconds, then
+        the changes since the last version the client has whole are looked up (see catch_up), as its change may
+        never be published
+    """
+
+    def __init__(self, initial: dict):
+        self.initial = initial
+        # Every version up to since was given to the client, and the ones in ahead after it
+        self.since = self.version = initial['version']
+        self.ahead = set()
+        self.missing = {}
+
+    def start(self) -> str:
+        return server_sent_event('snapshot' if 'event' in self.initial else 'changes', self.initial, self.version)
+
+    def snapshot(self, message: dict) -> str:
+        """
+        The event of the whole event, sent when the subscriber fell behind
+        """
+        self.since = self.version = message['version']
+        self.ahead = set()
+        self.missing = {}
+
+        return server_sent_event('snapshot', message, self.version)
+
+    def change(self, change: dict) -> str:
+        """
+        The event of a change published, None when the client has it already
+        """
+        if change['version'] <= self.since or change['version'] in self.ahead:
+            return None
+
+        deadline = time.monotonic() + settings.SEAT_STREAM_REORDER_WINDOW
+
+        for version in range(self.version + 1, change['version']):
+            self.missing[version] = deadline
+
+        self.missing.pop(change['version'], None)
+        self._given([change['version']])
+
+        return server_sent_event('changes', {'version': self.version, 'changes': [change]}, self.version)
+
+    def timeout(self, timeout: float) -> float:
+        """
+        Seconds to wait for the next change, at most timeout, so the missing versions are looked up in time
+        """
+        if not self.missing:
+            return timeout
+
+        return max(min(timeout, min(self.missing.values()) - time.monotonic()), 0)
+
+    def overdue(self) -> bool:
+        """
+        Check if a version skipped over wasn't published within SEAT_STREAM_REORDER_WINDOW seconds
+        """
+        return any(deadline <= time.monotonic() for deadline in self.missing.values())
+
+    def catch_up(self, changes: dict) -> str:
+        """
+        The event of the changes the client is missing out of the ones since self.since (see Event.get_changes),
+            None when it has them all
+        """
+        if 'event' in changes:
+            return self.snapshot(changes)
+
+        changes['changes'] = [
+            change for change in changes['changes']
+            if change['version'] > self.since and change['version'] not in self.ahead
+        ]
+        # Still missing when they were published after the event was read, so they are waited for again
+        deadline = time.monotonic() + settings.SEAT_STREAM_REORDER_WINDOW
+        self.missing = {version: deadline for version in self.missing if version > changes['version']}
+        self._given(range(self.since + 1, changes['version'] + 1))
+
+        if not changes['changes']:
+            return None
+
+        stats.incr('stream.caught_up')
+
+        return server_sent_event('changes', {'version': self.version, 'changes': changes['changes']}, self.version)
+
+    def _given(self, versions) -> None:
+        self.ahead.update(versions)
+        self.version = max([self.version] + list(self.ahead))
+
+        while self.since + 1 in self.ahead:
+            self.since += 1
+            self.ahead.remove(self.since)
+
+
+broadcaster = Broadcaster(get_channel(settings.SEAT_STREAM_CHANNEL), settings.SEAT_STREAM_QUEUE_SIZE)
@@ -1,14 +1,35 @@
+import asyncio
+from bson.objectid import ObjectId
+from concurrent.futures import Future, ThreadPoolExecutor
 import copy
 from datetime import datetime
 import django
+from io import StringIO
 import json
+from mongoengine.queryset import QuerySet
+import os
+from pymongo.errors import AutoReconnect, BulkWriteError
+import re
+import shutil
+import tempfile
 import time
 import unittest
+from unittest import mock
 
 from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import CommandError, call_command
 from django.test import Client
 
-from api.models import Venue
+from api import benchmarks, engine, serializers, services, stats
+from api.asgi import AsyncApi
+from api.allocation import MaxRunTree
+from api.exceptions import ConflictException, UnavailableException
+from api.holds import HoldSweeper
+from api.models import (
+    FREE, HELD, RESERVED, Event, LayoutCache, Row, RowIdAllocator, Section, Venue, get_layout, layout_cache
+)
+from api.streams import Broadcaster, ChangeStream, broadcaster
 
 django.setup()
 
@@ -35,6 +56,42 @@ EVENT = {
 }
 
 
+def read_json(res):
+    """
+    The JSON of a response, streamed or not
+    """
+    return json.loads(b''.join(res.streaming_content) if res.streaming else res.content)
+
+
+async def asgi_request(application, method: str, path: str, data: dict = None, query_string: bytes = b'',
+                       headers: list = None) -> tuple:
+    """
+    The (status, headers, body) of a request to an ASGI application
+    """
+    messages = []
+    received = []
+
+    async def receive():
+        if received:
+            # The client stays connected until the response is over
+            await asyncio.Future()
+
+        received.append(True)
+
+        return {'type': 'http.request', 'body': json.dumps(data).encode() if data is not None else b''}
+
+    async def send(message):
+        messages.append(message)
+
+    await application({
+        'type': 'http', 'method': method, 'path': path, 'query_string': query_string, 'headers': headers or []
+    }, receive, send)
+
+    body = b''.join(message.get('body', b'') for message in messages[1:])
+
+    return messages[0]['status'], dict(messages[0]['headers']), body
+
+
 class TestVenueView(unittest.TestCase):
 
     def setUp(self):
@@ -52,7 +109,7 @@ class TestVenueView(unittest.TestCase):
 
         self.assertEqual(res.status_code, 200)
 
-        venue = res.json()['venue']
+        venue = read_json(res)['venue']
 
         self.assertEqual(venue['venue_name'], self.venue['venue_name'])
         self.assertEqual(venue['base_layout'], {})
@@ -62,11 +119,15 @@ class TestVenueView(unittest.TestCase):
 
         self.assertEqual(res.status_code, 200)
 
-        venue = res.json()['venue']
+        venue = read_json(res)['venue']
 
         self.assertEqual(venue['venue_name'], self.venue['venue_name'])
         self.assertTrue(VENUE['sections'][0]['section_type'] in venue['base_layout'])
 
+        res = self.client.get(f'/api/1.0/venue/{self.venue.id}?layout=False')
+
+        self.assertEqual(read_json(res)['venue']['base_layout'], {})
+
     def test_post_venue_malformed_json(self):
         res = self.client.post(f'/api/1.0/venue/', VENUE, content_type="application/json")
         self.assertEquals(res.status_code, 400)
@@ -88,6 +149,122 @@ class TestVenueView(unittest.TestCase):
         self.assertEquals(venue['venue_name'], new_venue['venue_name'])
 
 
+class TestVenuesView(unittest.TestCase):
+
+    def setUp(self):
+        self.client = Client()
+        self.venues = []
+
+        for number in range(3):
+            venue = Venue(venue_name=f'Listed Venue-{time.time()}-{number}', input_json=VENUE)
+            venue.create_venue(VENUE['sections'])
+            self.venues.append(venue)
+
+        self.venues[1].create_event(date=datetime.strptime(EVENT['date'], settings.DATE_FMT), event_name='Listed')
+
+    def test_get_venues_after(self):
+        res = self.client.get('/api/1.0/venues/', {'after': str(self.venues[0].id), 'size': 1})
+        page = read_json(res)
+
+        self.assertEquals(res.status_code, 200)
+        self.assertEquals(page, {
+            'venues': [{
+                'id': str(self.venues[1].id),
+                'venue_name': self.venues[1].venue_name,
+                'events': [{'id': mock.ANY, 'event_name': 'Listed', 'date': '2017-01-01T12:00:00'}],
+                'more_events': False
+            }],
+            'next': str(self.venues[1].id)
+        })
+
+        page = read_json(self.client.get('/api/1.0/venues/', {'after': page['next'], 'size': 2}))
+
+        self.assertEquals([venue['id'] for venue in page['venues']], [str(self.venues[2].id)])
+        self.assertIsNone(page['next'])
+
+    def test_get_venues_full(self):
+        res = self.client.get('/api/1.0/venues/', {'after': str(self.venues[1].id), 'full': True})
+        venue = read_json(res)['venues'][0]
+
+        self.assertEquals(venue['input_json'], VENUE)
+        self.assertTrue(VENUE['sections'][0]['section_type'] in venue['base_layout'])
+
+    def test_get_venues_full_false(self):
+        res = self.client.get('/api/1.0/venues/', {'after': str(self.venues[1].id), 'full': 'False'})
+
+        self.assertNotIn('base_layout', read_json(res)['venues'][0])
+
+    def test_get_venues_events_capped(self):
+        self.venues[1].create_event(date=datetime.strptime(EVENT['date'], settings.DATE_FMT), event_name='Later')
+
+        with mock.patch.object(settings, 'VENUE_SUMMARY_EVENTS', 1):
+            page = read_json(self.client.get('/api/1.0/venues/', {'after': str(self.venues[0].id), 'size': 1}))
+
+        self.assertEquals(len(page['venues'][0]['events']), 1)
+        self.assertTrue(page['venues'][0]['more_events'])
+
+    def test_get_venues_full_without_changes(self):
+        self.venues[1].make_reservation(self.venues[1].get_events()[0].id, 'house', [2])
+
+        with mock.patch.object(serializers, 'event_json', wraps=serializers.event_json) as event_json:
+            read_json(self.client.get('/api/1.0/venues/', {'after': str(self.venues[0].id), 'size': 1, 'full': True}))
+
+        self.assertEquals(event_json.call_args[0][0].version, 1)
+        self.assertEquals(event_json.call_args[0][0].changes, [])
+        self.assertEquals([event.changes for event in self.venues[1].get_events()], [[]])
+
+    def test_get_venues_malformed_arguments(self):
+        self.assertEquals(self.client.get('/api/1.0/venues/', {'after': 'not-an-id'}).status_code, 400)
+        self.assertEquals(self.client.get('/api/1.0/venues/', {'size': 'a'}).status_code, 400)
+
+
+class TestSerializers(unittest.TestCase):
+
+    def setUp(self):
+        self.venue = Venue(venue_name=VENUE['venue_name'], input_json=VENUE)
+        self.venue.create_venue(VENUE['sections'])
+        date = datetime.strptime(EVENT['date'], settings.DATE_FMT)
+
+        for compact in (True, False):
+            event = self.venue.create_event(date=date, compact=compact)
+            self.venue.make_reservation(event.id, 'house', [3])
+            self.venue.block(event.id, 'house', '2', '3')
+
+    def test_same_json_as_to_dict(self):
+        venue = Venue.objects(id=self.venue.id)[0]
+        chunks = list(serializers.iter_chunks(serializers.venue_json(venue, events=True), chunk_size=256))
+
+        self.assertTrue(len(chunks) > 1)
+        self.assertEquals(json.loads(b''.join(chunks)), json.loads(json.dumps(venue.to_dict(events=True))))
+
+    def test_compact_format(self):
+        client = Client()
+
+        for event in Event.objects(venue_id=self.venue.id):
+            url = f'/api/1.0/venue/{self.venue.id}/event/{event.id}/'
+            verbose = read_json(client.get(url))['event']
+            compact = read_json(client.get(url, {'format': 'compact'}))['event']
+
+            self.assertEquals(compact['format'], 'compact')
+
+            for rank, rows in verbose['sections']['house']['rows'].items():
+                for row, compact_row in zip(rows, compact['sections']['house']['rows'][rank]):
+                    states = ''.join([
+                        'B' if seat['is_blocked'] else 'F' if seat['is_free'] else 'R' for seat in row['seats']
+                    ])
+                    decoded = ''.join([
+                        code * int(length) for code, length in re.findall(r'([FRB])(\d+)', compact_row['state'])
+                    ])
+
+                    self.assertEquals(compact_row['seats'].split(' '), [seat['seat_id'] for seat in row['seats']])
+                    self.assertEquals(decoded, states)
+
+            self.assertEquals(
+                compact['sections']['house']['rows']['1st Rank'][0],
+                {'row_id': '1', 'seats': '1 3 5 7 8 6 4 2', 'state': 'R3F5'}
+            )
+
+
 class TestVenueEventView(unittest.TestCase):
 
     def setUp(self):
@@ -101,10 +278,43 @@ class TestVenueEventView(unittest.TestCase):
 
         self.assertEquals(res.status_code, 200)
 
-        event = res.json()['event']
+        event = read_json(res)['event']
 
         self.assertEquals(event['event_name'], self.event.event_name)
 
+    def test_get_venue_event_etag(self):
+        url = f'/api/1.0/venue/{self.venue.id}/event/{self.event.id}/'
+        res = self.client.get(url)
+        etag = res['ETag']
+        read_json(res)
+
+        with mock.patch.object(Event, 'get') as get:
+            res = self.client.get(url)
+
+        self.assertEquals(res.status_code, 200)
+        self.assertFalse(get.called)
+
+        res = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEquals(res.status_code, 304)
+
+        self.venue.make_reservation(self.event.id, 'house', [2])
+        res = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEquals(res.status_code, 200)
+        self.assertNotEquals(res['ETag'], etag)
+        self.assertFalse(read_json(res)['event']['sections']['house']['rows']['1st Rank'][0]['seats'][0]['is_free'])
+
+    def test_get_event_shares_cache(self):
+        event = services.get_event(self.venue.id, self.event.id)
+
+        with mock.patch.object(Event, 'get') as get:
+            res = self.client.get(f'/api/1.0/venue/{self.venue.id}/event/{self.event.id}/')
+            self.assertEquals(services.get_event(self.venue.id, self.event.id), event)
+
+        self.assertFalse(get.called)
+        self.assertEquals(read_json(res)['event'], event)
+
     def test_post_venue_event(self):
         new_event = copy.deepcopy(EVENT)
         new_event['event_name'] = f'New Event-{time.gmtime()}'
@@ -119,3 +329,1165 @@ class TestVenueEventView(unittest.TestCase):
         event = res.json()['event']
 
         self.assertEquals(event['event_name'], new_event['event_name'])
+
+
+class TestVenueEventReservationView(unittest.TestCase):
+
+    def setUp(self):
+        self.client = Client()
+        self.venue = Venue(venue_name=VENUE['venue_name'], input_json=VENUE)
+        self.venue.create_venue(VENUE['sections'])
+        self.event = self.venue.create_event(date=datetime.strptime(EVENT['date'], settings.DATE_FMT))
+
+    def test_post_reservation(self):
+        res = self.client.post(
+            f'/api/1.0/venue/{self.venue.id}/event/{self.event.id}/reserve/',
+            json.dumps({'section': 'house', 'group': [5]}), content_type="application/json"
+        )
+
+        self.assertEquals(res.status_code, 200)
+
+        row = Event.get(self.venue.id, self.event.id).get_section('house').rows['1st Rank'][0]
+
+        self.assertEquals(row.free_seats, 3)
+        self.assertEquals(row.free_runs, [[5, 3]])
+
+    def test_post_reservation_no_space(self):
+        res = self.client.post(
+            f'/api/1.0/venue/{self.venue.id}/event/{self.event.id}/reserve/',
+            json.dumps({'section': 'house', 'group': [25]}), content_type="application/json"
+        )
+
+        self.assertEquals(res.status_code, 403)
+
+
+class TestVenueEventBatchReservationView(unittest.TestCase):
+
+    def setUp(self):
+        self.client = Client()
+        self.venue = Venue(venue_name=VENUE['venue_name'], input_json=VENUE)
+        self.venue.create_venue(VENUE['sections'])
+        self.event = self.venue.create_event(date=datetime.strptime(EVENT['date'], settings.DATE_FMT))
+
+    def test_post_batch_reservation(self):
+        reservations = [
+            {'section': 'house', 'group': [8]},
+            {'section': 'house', 'group': [10]},
+            {'section': 'box', 'group': [2]},
+            {'section': 'house', 'group': [7]}
+        ]
+
+        res = self.client.post(
+            f'/api/1.0/venue/{self.venue.id}/event/{self.event.id}/reserve/batch/',
+            json.dumps({'reservations': reservations}), content_type="application/json"
+        )
+
+        self.assertEquals(res.status_code, 200)
+        self.assertEquals(res.json()['results'], [
+            {'seated': True, 'missing': [0]},
+            {'seated': True, 'missing': [0]},
+            {'seated': False, 'missing': [2]},
+            {'seated': False, 'missing': [1]}
+        ])
+
+        event = Event.get(self.venue.id, self.event.id)
+
+        self.assertEquals(event.version, 1)
+        self.assertEquals(sum(row.free_seats for row in event.get_section('house').rows['1st Rank']), 0)
+
+    def test_post_batch_reservation_malformed_json(self):
+        res = self.client.post(
+            f'/api/1.0/venue/{self.venue.id}/event/{self.event.id}/reserve/batch/',
+            json.dumps({'reservations': [{'section': 'house'}]}), content_type="application/json"
+        )
+
+        self.assertEquals(res.status_code, 400)
+
+
+class TestVenueEventHoldView(unittest.TestCase):
+
+    def setUp(self):
+        self.client = Client()
+        self.venue = Venue(venue_name=VENUE['venue_name'], input_json=VENUE)
+        self.venue.create_venue(VENUE['sections'])
+        self.date = datetime.strptime(EVENT['date'], settings.DATE_FMT)
+        self.hold_settings = mock.patch.object(settings, 'HOLD_SWEEPER', False)
+        self.hold_settings.start()
+
+    def tearDown(self):
+        self.hold_settings.stop()
+
+    def post(self, event, path: str, data: dict = None):
+        return self.client.post(
+            f'/api/1.0/venue/{self.venue.id}/event/{event.id}/{path}', json.dumps(data or {}),
+            content_type="application/json"
+        )
+
+    def summary(self, event) -> dict:
+        return Event.get_summary(self.venue.id, event.id)['house']['1st Rank']
+
+    def test_hold_and_confirm(self):
+        for compact in (True, False):
+            event = self.venue.create_event(date=self.date, compact=compact)
+            res = self.post(event, 'hold/', {'section': 'house', 'group': [20]})
+            hold = res.json()['hold']
+
+            self.assertEquals(res.status_code, 200)
+            self.assertEquals((hold['seated'], len(hold['seats'])), (True, 20))
+            self.assertEquals(self.summary(event), {'free': 4, 'reserved': 0, 'blocked': 0, 'held': 20})
+            # Held seats are taken for everyone else
+            self.assertEquals(self.venue.make_reservation(event.id, 'house', [8]), [4])
+
+            self.assertEquals(self.post(event, f'hold/{hold["id"]}/confirm/').status_code, 200)
+            self.assertEquals(self.post(event, f'hold/{hold["id"]}/confirm/').status_code, 404)
+            self.assertEquals(self.summary(event), {'free': 0, 'reserved': 24, 'blocked': 0, 'held': 0})
+            self.assertEquals(
+                Event.get_changes(self.venue.id, event.id, 2)['changes'][0]['seats'][0]['state'], 'reserved'
+            )
+
+    def test_release(self):
+        for compact in (True, False):
+            event = self.venue.create_event(date=self.date, compact=compact)
+            hold = self.post(event, 'hold/', {'section': 'house', 'group': [5]}).json()['hold']
+
+            self.assertEquals(self.post(event, f'hold/{hold["id"]}/release/').status_code, 200)
+            self.assertEquals(self.post(event, f'hold/{hold["id"]}/release/').status_code, 404)
+            self.assertEquals(self.summary(event), {'free': 24, 'reserved': 0, 'blocked': 0, 'held': 0})
+            self.assertEquals(self.venue.make_reservation(event.id, 'house', [24]), [0])
+            self.assertEquals(Event.objects(id=event.id)[0].holds_expire_at, None)
+
+    def test_expired_holds_swept(self):
+        event = self.venue.create_event(date=self.date)
+        expiring = self.post(event, 'hold/', {'section': 'house', 'group': [5], 'ttl': 60}).json()['hold']
+        lasting = self.post(event, 'hold/', {'section': 'house', 'group': [2], 'ttl': 600}).json()['hold']
+        sweeper = HoldSweeper()
+
+        sweeper.poll(time.time() + 120)
+
+        self.assertEquals(sweeper.sweep(time.time() + 120), 1)
+        self.assertEquals(self.summary(event), {'free': 22, 'reserved': 0, 'blocked': 0, 'held': 2})
+        self.assertEquals(self.post(event, f'hold/{expiring["id"]}/confirm/').status_code, 404)
+        self.assertEquals(self.post(event, f'hold/{lasting["id"]}/confirm/').status_code, 200)
+        self.assertEquals(sweeper.sweep(time.time() + 1200), 0)
+
+    def test_hold_no_space(self):
+        event = self.venue.create_event(date=self.date)
+        self.venue.make_reservation(event.id, 'house', [24])
+
+        self.assertEquals(self.post(event, 'hold/', {'section': 'house', 'group': [2]}).status_code, 403)
+        self.assertEquals(self.post(event, 'hold/', {'section': 'house'}).status_code, 400)
+        self.assertEquals(Event.objects(id=event.id)[0].holds, {})
+
+
+class TestVenueEventSummaryView(unittest.TestCase):
+
+    def setUp(self):
+        self.client = Client()
+        self.venue = Venue(venue_name=VENUE['venue_name'], input_json=VENUE)
+        self.venue.create_venue(VENUE['sections'])
+        self.date = datetime.strptime(EVENT['date'], settings.DATE_FMT)
+
+    def test_get_summary(self):
+        for compact in (True, False):
+            event = self.venue.create_event(date=self.date, compact=compact)
+            self.venue.make_reservation(event.id, 'house', [5])
+            self.venue.block(event.id, 'house', '2', '3')
+
+            res = self.client.get(f'/api/1.0/venue/{self.venue.id}/event/{event.id}/summary/')
+
+            self.assertEquals(res.status_code, 200)
+            self.assertEquals(
+                res.json()['summary']['house']['1st Rank'], {'free': 18, 'reserved': 5, 'blocked': 1, 'held': 0}
+            )
+
+    def test_get_summary_counts_old_events(self):
+        event = self.venue.create_event(date=self.date, compact=False)
+        self.venue.make_reservation(event.id, 'house', [5])
+        Event._get_collection().update_one({'_id': event.id}, {'$unset': {'seat_counts': ''}})
+
+        res = self.client.get(f'/api/1.0/venue/{self.venue.id}/event/{event.id}/summary/')
+
+        self.assertEquals(
+            res.json()['summary']['house']['1st Rank'], {'free': 19, 'reserved': 5, 'blocked': 0, 'held': 0}
+        )
+        seat_counts = Event.get(self.venue.id, event.id).seat_counts
+
+        self.assertEquals(seat_counts['house']['1st Rank'], {'reserved': 5, 'blocked': 0, 'held': 0})
+
+        self.venue.block(event.id, 'house', '2', '3')
+
+        res = self.client.get(f'/api/1.0/venue/{self.venue.id}/event/{event.id}/summary/')
+
+        self.assertEquals(
+            res.json()['summary']['house']['1st Rank'], {'free': 18, 'reserved': 5, 'blocked': 1, 'held': 0}
+        )
+
+    def test_get_summary_not_found(self):
+        res = self.client.get(f'/api/1.0/venue/{self.venue.id}/event/{ObjectId()}/summary/')
+
+        self.assertEquals(res.status_code, 404)
+
+
+class TestVenueEventChangesView(unittest.TestCase):
+
+    def setUp(self):
+        self.client = Client()
+        self.venue = Venue(venue_name=VENUE['venue_name'], input_json=VENUE)
+        self.venue.create_venue(VENUE['sections'])
+        self.event = self.venue.create_event(date=datetime.strptime(EVENT['date'], settings.DATE_FMT))
+        self.url = f'/api/1.0/venue/{self.venue.id}/event/{self.event.id}/changes/'
+
+    def test_get_changes(self):
+        self.venue.make_reservation(self.event.id, 'house', [2])
+        self.venue.block(self.event.id, 'house', '2', '3')
+
+        res = self.client.get(self.url, {'since': 1})
+
+        self.assertEquals(res.status_code, 200)
+        self.assertEquals(res.json(), {'version': 2, 'changes': [
+            {'version': 2, 'seats': [{'section': 'house', 'row_id': '2', 'seat_id': '3', 'state': 'blocked'}]}
+        ]})
+        self.assertEquals(self.client.get(self.url, {'since': 2}).json(), {'version': 2, 'changes': []})
+        self.assertEquals(len(self.client.get(self.url, {'since': 0}).json()['changes'][0]['seats']), 2)
+
+    def test_get_changes_snapshot(self):
+        with mock.patch.object(settings, 'EVENT_CHANGE_LOG_SIZE', 1):
+            self.venue.make_reservation(self.event.id, 'house', [2])
+            self.venue.make_reservation(self.event.id, 'house', [2])
+
+        res = self.client.get(self.url, {'since': 0}).json()
+
+        self.assertEquals(res['version'], 2)
+        self.assertNotIn('changes', res)
+        self.assertEquals(res['event']['version'], 2)
+        self.assertEquals(len(self.client.get(self.url, {'since': 1}).json()['changes']), 1)
+
+    def test_get_changes_malformed_since(self):
+        self.assertEquals(self.client.get(self.url).status_code, 400)
+        self.assertEquals(self.client.get(self.url, {'since': 'a'}).status_code, 400)
+
+
+class TestVenueEventStreamView(unittest.TestCase):
+
+    def setUp(self):
+        self.client = Client()
+        self.venue = Venue(venue_name=VENUE['venue_name'], input_json=VENUE)
+        self.venue.create_venue(VENUE['sections'])
+        self.event = self.venue.create_event(date=datetime.strptime(EVENT['date'], settings.DATE_FMT))
+        self.url = f'/api/1.0/venue/{self.venue.id}/event/{self.event.id}/stream/'
+
+    def test_stream_not_served(self):
+        res = self.client.get(self.url, {'since': 0})
+
+        self.assertEquals(res.status_code, 501)
+        self.assertEquals(broadcaster.number_subscribers(str(self.event.id)), 0)
+
+    def test_fan_out(self):
+        channel = mock.Mock()
+        fan_out = Broadcaster(channel, 1)
+        first = fan_out.subscribe('event')
+        second = fan_out.subscribe('event')
+
+        fan_out.deliver('event', {'version': 1})
+
+        self.assertEquals(channel.subscribe.call_count, 1)
+        self.assertEquals(first.get_nowait(), {'version': 1})
+
+        # The second subscriber didn't keep up
+        fan_out.deliver('event', {'version': 2})
+
+        self.assertEquals(first.get_nowait(), {'version': 2})
+        self.assertIsNone(second.get_nowait())
+
+        fan_out.unsubscribe('event', first)
+        fan_out.unsubscribe('event', second)
+
+        self.assertEquals(channel.unsubscribe.call_count, 1)
+
+
+class TestRowAvailability(unittest.TestCase):
+
+    def setUp(self):
+        self.row = Row.create_row(VENUE['sections'][0]['rows'][0], '1')
+
+    def test_block_splits_run(self):
+        self.assertTrue(self.row.block(self.row.seats[3].seat_id))
+        self.assertEquals(self.row.free_runs, [[0, 3], [4, 4]])
+        self.assertEquals(self.row.free_seats, 7)
+
+    def test_free_runs_built_for_stored_rows(self):
+        self.row.seats[0].is_free = False
+        self.row.runs = None
+
+        self.assertEquals(self.row.free_runs, [[1, 7]])
+
+    def test_split_group(self):
+        self.row.block(self.row.seats[2].seat_id)
+        self.row.block(self.row.seats[5].seat_id)
+
+        self.row.make_reservation(1)
+
+        self.assertEquals(self.row.make_reservation(4), 3)
+        self.assertEquals(self.row.free_runs, [[6, 2]])
+
+    def test_end_hold_merges_runs(self):
+        self.assertEquals(self.row.make_reservation(3, state=HELD), 3)
+        self.row.block(self.row.seats[4].seat_id)
+
+        self.assertEquals(self.row.free_runs, [[3, 1], [5, 3]])
+        self.assertFalse(self.row.end_hold(4, FREE))
+        self.assertTrue(self.row.end_hold(0, RESERVED))
+        self.assertTrue(self.row.end_hold(2, FREE))
+        self.assertTrue(self.row.end_hold(1, FREE))
+        self.assertEquals(self.row.free_runs, [[1, 3], [5, 3]])
+        self.assertEquals(self.row.free_runs, self.row.build_runs())
+
+
+class TestSectionLookups(unittest.TestCase):
+
+    def setUp(self):
+        self.section = Section.create_section(VENUE['sections'][0])
+
+    def test_row_position(self):
+        self.assertEquals(self.section.row_position(3), ('1st Rank', 2))
+        self.assertIsNone(self.section.row_position(4))
+
+    def test_block(self):
+        self.assertTrue(self.section.block('2', '8'))
+        self.assertFalse(self.section.block('2', '8'))
+        self.assertFalse(self.section.block('2', '9'))
+        self.assertFalse(self.section.block('4', '1'))
+        self.assertEquals(self.section.pop_changed_rows(), [('1st Rank', 1)])
+
+
+class TestRowIdAllocator(unittest.TestCase):
+
+    def test_build_layouts_concurrently(self):
+        venue_json = benchmarks.generate_venue(2000, seats_per_row=10)
+
+        def build(_):
+            venue = Venue(venue_name=venue_json['venue_name'], input_json=venue_json)
+            venue.build_layout(venue_json['sections'])
+            return venue.to_dict()['base_layout']
+
+        with ThreadPoolExecutor(8) as pool:
+            layouts = list(pool.map(build, range(16)))
+
+        row_ids = [
+            row['row_id'] for section in layouts[0].values() for rows in section['rows'].values() for row in rows
+        ]
+
+        self.assertEquals(row_ids, [str(row_id) for row_id in range(1, 201)])
+        self.assertTrue(all(layout == layouts[0] for layout in layouts))
+
+    def test_next_id(self):
+        row_ids = RowIdAllocator()
+
+        self.assertEquals([row_ids.next_id() for _ in range(3)], ['1', '2', '3'])
+        self.assertEquals(RowIdAllocator(10).next_id(), '10')
+
+
+class TestRankAllocator(unittest.TestCase):
+
+    def setUp(self):
+        self.section = Section.create_section(VENUE['sections'][0])
+        self.rows = self.section.rows['1st Rank']
+
+    def test_max_run_tree(self):
+        tree = MaxRunTree([3, 0, 5, 1, 2])
+
+        self.assertEquals(tree.find_first(4), 2)
+        self.assertEquals(tree.find_first(1, start=3), 3)
+        self.assertIsNone(tree.find_first(6))
+
+        tree.update(2, 0)
+
+        self.assertIsNone(tree.find_first(4))
+        self.assertEquals(tree.find_first(1, start=2), 3)
+
+    def test_group_seated_together_in_later_row(self):
+        self.section.block('1', self.rows[0].seats[4].seat_id)
+
+        self.assertEquals(self.section.make_reservation([6]), [0])
+        self.assertEquals(self.rows[0].free_seats, 7)
+        self.assertEquals(self.rows[1].free_runs, [[6, 2]])
+
+    def test_group_split_when_no_row_fits(self):
+        for row in self.rows:
+            self.section.block(row.row_id, row.seats[4].seat_id)
+
+        self.assertEquals(self.section.make_reservation([6]), [0])
+        self.assertEquals([row.free_seats for row in self.rows], [1, 7, 7])
+
+
+class TestEventSaveSeats(unittest.TestCase):
+
+    def setUp(self):
+        self.venue = Venue(venue_name=VENUE['venue_name'], input_json=VENUE)
+        self.venue.create_venue(VENUE['sections'])
+        self.event = self.venue.create_event(date=datetime.strptime(EVENT['date'], settings.DATE_FMT))
+
+    def test_block_updates_only_the_seat(self):
+        venue = Venue.objects(id=self.venue.id)[0]
+
+        self.assertTrue(venue.block(str(self.event.id), 'house', '2', '3'))
+
+        row = Event.get(self.venue.id, self.event.id).get_section('house').rows['1st Rank'][1]
+
+        self.assertTrue(row.get_seat(row.seat_position('3')).is_blocked)
+        self.assertEquals(row.free_seats, 7)
+
+    def test_conflicting_reservation(self):
+        first = Event.get(self.venue.id, self.event.id)
+        second = Event.get(self.venue.id, self.event.id)
+
+        first.make_reservation('house', [8])
+        first.save_seats()
+        second.make_reservation('house', [8])
+
+        with self.assertRaises(ConflictException):
+            second.save_seats()
+
+    def test_saved_when_publishing_fails(self):
+        stats.reset()
+
+        with mock.patch.object(broadcaster, 'publish', side_effect=ConnectionError('Channel down')):
+            self.assertEquals(self.venue.make_reservation(self.event.id, 'house', [5]), [0])
+
+        self.assertEquals(stats.get('stream.publish_errors'), 1)
+        self.assertEquals(stats.get('make_reservation.succeeded'), 1)
+        self.assertEquals(Event.get(self.venue.id, self.event.id).version, 1)
+
+    def test_update_event_retries_on_conflict(self):
+        stats.reset()
+        make_reservation = Event.make_reservation
+        concurrent = Event.get(self.venue.id, self.event.id)
+
+        def racing_reservation(event, *args, **kwargs):
+            if not stats.get('make_reservation.conflicts'):
+                make_reservation(concurrent, 'house', [8])
+                concurrent.save_seats()
+
+            return make_reservation(event, *args, **kwargs)
+
+        with mock.patch.object(Event, 'make_reservation', autospec=True, side_effect=racing_reservation):
+            result = Event.update_event(self.venue.id, self.event.id, 'make_reservation', 'house', [8])
+
+        self.assertEquals(result, [0])
+        self.assertEquals(stats.get('make_reservation.retries'), 1)
+
+        event = Event.get(self.venue.id, self.event.id)
+
+        self.assertEquals(event.version, 2)
+        self.assertEquals(sum(row.free_seats for row in event.get_section('house').rows['1st Rank']), 8)
+
+    def test_update_event_backs_off(self):
+        with mock.patch.object(Event, 'save_seats', autospec=True, side_effect=ConflictException):
+            with mock.patch('api.models.time.sleep') as sleep:
+                with self.assertRaises(ConflictException):
+                    Event.update_event(self.venue.id, self.event.id, 'make_reservation', 'house', [8])
+
+        delays = [args[0] for args, _ in sleep.call_args_list]
+
+        self.assertEquals(len(delays), settings.EVENT_UPDATE_RETRIES)
+        self.assertTrue(all(
+            0 <= delay <= settings.EVENT_UPDATE_BACKOFF * 2 ** attempt for attempt, delay in enumerate(delays)
+        ))
+
+
+class TestPartialEventLoad(unittest.TestCase):
+
+    def setUp(self):
+        venue_json = copy.deepcopy(VENUE)
+        venue_json['venue_name'] = f'Two Sections-{time.time()}'
+        venue_json['sections'].append({
+            'section_type': 'box',
+            'rows': [{'row_rank': '1st Rank', 'num_seats': 4, 'num_rows': 1, 'order': 'sequential'}]
+        })
+        self.venue = Venue(venue_name=venue_json['venue_name'], input_json=venue_json)
+        self.venue.create_venue(venue_json['sections'])
+        self.date = datetime.strptime(EVENT['date'], settings.DATE_FMT)
+
+    def test_get_sections(self):
+        for compact in (True, False):
+            event = self.venue.create_event(date=self.date, compact=compact)
+            self.venue.make_reservation(event.id, 'box', [2])
+            partial = Event.get(self.venue.id, event.id, ['house'])
+
+            self.assertEquals(list(partial.seat_map.keys()), ['house'])
+
+            with self.assertRaises((ValueError, KeyError)):
+                partial.get_section('box')
+
+    def test_update_event_loads_only_the_section(self):
+        for compact in (True, False):
+            event = self.venue.create_event(date=self.date, compact=compact)
+            self.venue.make_reservation(event.id, 'box', [2])
+
+            with mock.patch.object(Event, 'get', wraps=Event.get) as get:
+                self.venue.make_reservation(event.id, 'house', [5])
+                self.venue.block(event.id, 'house', '2', '3')
+
+            self.assertEquals([args[2] for args, _ in get.call_args_list], [['house'], ['house']])
+
+            event = Event.get(self.venue.id, event.id)
+
+            self.assertEquals(event.version, 3)
+            self.assertEquals(event.get_section('box').rows['1st Rank'][0].free_seats, 2)
+            self.assertEquals(event.get_section('house').rows['1st Rank'][0].free_seats, 3)
+            self.assertEquals(event.get_section('house').rows['1st Rank'][1].free_seats, 7)
+
+
+class TestCompactEvent(unittest.TestCase):
+
+    def setUp(self):
+        self.client = Client()
+        self.venue = Venue(venue_name=VENUE['venue_name'], input_json=VENUE)
+        self.venue.create_venue(VENUE['sections'])
+        self.date = datetime.strptime(EVENT['date'], settings.DATE_FMT)
+        self.event = self.venue.create_event(date=self.date, compact=True)
+
+    def test_reservation(self):
+        res = self.client.post(
+            f'/api/1.0/venue/{self.venue.id}/event/{self.event.id}/reserve/',
+            json.dumps({'section': 'house', 'group': [5]}), content_type="application/json"
+        )
+
+        self.assertEquals(res.status_code, 200)
+
+        event = Event.get(self.venue.id, self.event.id)
+
+        self.assertEquals(event.sections, {})
+        self.assertEquals(list(event.seat_states['house'].keys()), ['1'])
+        self.assertEquals(event.seat_states['house']['1'], bytes([1, 1, 1, 1, 1, 0, 0, 0]))
+        self.assertEquals(event.get_section('house').rows['1st Rank'][0].free_runs, [[5, 3]])
+
+    def test_create_event_copies_nothing(self):
+        stored = Event._get_collection().find_one({'_id': self.event.id})
+
+        self.assertEquals(stored.get('sections', {}), {})
+        self.assertEquals(stored.get('seat_states', {}), {})
+
+    def test_same_seat_map_as_verbose_event(self):
+        verbose = self.venue.create_event(date=self.date, compact=False)
+
+        for event_id in (self.event.id, verbose.id):
+            self.venue.make_reservation(event_id, 'house', [3])
+            self.venue.make_reservation(event_id, 'house', [6])
+            self.venue.block(event_id, 'house', '3', '8')
+
+        compact = Event.get(self.venue.id, self.event.id).to_dict()
+        verbose = Event.get(self.venue.id, verbose.id).to_dict()
+
+        self.assertEquals(compact['sections'], verbose['sections'])
+
+    def test_layout_cache(self):
+        other = Venue(venue_name=VENUE['venue_name'], input_json=VENUE)
+        other.create_venue(VENUE['sections'])
+        cache = LayoutCache(layout_cache.get(str(self.venue.id))[2])
+        layout = cache.get(str(self.venue.id))[0]
+
+        self.assertIs(cache.get(str(self.venue.id))[0], layout)
+
+        # Both don't fit, so the layout used least recently is dropped
+        cache.get(str(other.id))
+
+        self.assertEquals(list(cache._layouts), [str(other.id)])
+
+        get_layout(str(other.id))
+        other.delete()
+
+        self.assertNotIn(str(other.id), layout_cache._layouts)
+
+
+class TestEventEngine(unittest.TestCase):
+
+    def setUp(self):
+        self.venue = Venue(venue_name=VENUE['venue_name'], input_json=VENUE)
+        self.venue.create_venue(VENUE['sections'])
+        self.event = self.venue.create_event(date=datetime.strptime(EVENT['date'], settings.DATE_FMT))
+        self.journal_dir = tempfile.mkdtemp()
+        self.engine_settings = mock.patch.multiple(
+            settings, EVENT_ENGINE=True, EVENT_ENGINE_JOURNAL_DIR=self.journal_dir, EVENT_ENGINE_FLUSH_INTERVAL=60
+        )
+        self.engine_settings.start()
+        stats.reset()
+
+    def tearDown(self):
+        engine.stop_engines()
+        self.engine_settings.stop()
+        shutil.rmtree(self.journal_dir)
+
+    def test_reservations_written_in_one_batch(self):
+        groups = [[2], [3], [1], [2]]
+
+        with ThreadPoolExecutor(4) as pool:
+            results = list(pool.map(
+                lambda group: services.update_event(self.venue.id, self.event.id, 'make_reservation', 'house', group),
+                groups
+            ))
+
+        self.assertEquals(results, [[0]] * 4)
+        self.assertEquals(Event.get(self.venue.id, self.event.id).version, 0)
+
+        engine.stop_engines()
+        event = Event.get(self.venue.id, self.event.id)
+
+        self.assertEquals(event.version, 1)
+        self.assertEquals(sum(row.free_seats for row in event.get_section('house').rows['1st Rank']), 16)
+
+    def test_recover_from_journal(self):
+        with open(os.path.join(self.journal_dir, f'{self.event.id}.journal'), 'w') as journal:
+            journal.write(json.dumps({'version': 0}) + '\n')
+            journal.write(json.dumps({'method': 'make_reservation', 'args': ['house', [5]], 'result': [0]}) + '\n')
+            # Never made it to disk whole
+            journal.write('{"method": "make_reservation", "args": ["house", [')
+
+        self.assertEquals(services.update_event(self.venue.id, self.event.id, 'block', 'house', '2', '3'), True)
+
+        engine.stop_engines()
+        event = Event.get(self.venue.id, self.event.id)
+        rows = event.get_section('house').rows['1st Rank']
+
+        self.assertEquals(stats.get('engine.replayed'), 1)
+        self.assertEquals(event.version, 2)
+        self.assertEquals([row.free_seats for row in rows], [3, 7, 8])
+
+    def test_journal_already_written(self):
+        self.venue.make_reservation(self.event.id, 'house', [5])
+
+        with open(os.path.join(self.journal_dir, f'{self.event.id}.journal'), 'w') as journal:
+            journal.write(json.dumps({'version': 0}) + '\n')
+            journal.write(json.dumps({'method': 'make_reservation', 'args': ['house', [5]], 'result': [0]}) + '\n')
+
+        engine.get_engine(self.venue.id, self.event.id)
+        engine.stop_engines()
+
+        self.assertEquals(Event.get(self.venue.id, self.event.id).version, 1)
+
+    def test_idle_engine_stopped(self):
+        with mock.patch.multiple(settings, EVENT_ENGINE_FLUSH_INTERVAL=0.01, EVENT_ENGINE_IDLE_TIMEOUT=0.5):
+            self.assertEquals(
+                services.update_event(self.venue.id, self.event.id, 'make_reservation', 'house', [5]), [0]
+            )
+            event_engine = engine.get_engine(self.venue.id, self.event.id)
+            event_engine._thread.join(5)
+
+        self.assertFalse(event_engine._thread.is_alive())
+        self.assertNotIn(str(self.event.id), engine._engines)
+        self.assertEquals(Event.get(self.venue.id, self.event.id).version, 1)
+
+    def test_timeout(self):
+        # Never started, so nothing is ever answered
+        engine._engines[str(self.event.id)] = engine.EventEngine(str(self.venue.id), str(self.event.id))
+
+        try:
+            with mock.patch.object(settings, 'EVENT_ENGINE_TIMEOUT', 0.01):
+                with self.assertRaises(ConflictException):
+                    services.update_event(self.venue.id, self.event.id, 'make_reservation', 'house', [5])
+        finally:
+            engine._engines.clear()
+
+        self.assertEquals(stats.get('engine.timeouts'), 1)
+
+    def run_operation(self, event_engine: engine.EventEngine, method: str, *args):
+        """
+        Runs an operation on the engine in the test thread, without starting the engine thread
+        """
+        future = Future()
+        event_engine._run_commands([(method, args, future)])
+
+        return future.result()
+
+    def assert_reserved_once(self, event_engine: engine.EventEngine):
+        self.assertEquals(self.run_operation(event_engine, 'make_reservation', 'house', [3]), [0])
+        event_engine.flush()
+        event_engine.journal.close()
+
+        event = Event.get(self.venue.id, self.event.id)
+
+        self.assertEquals(event.version, 2)
+        self.assertEquals(sum(row.free_seats for row in event.get_section('house').rows['1st Rank']), 16)
+        self.assertEquals(event_engine.journal.read(), (2, []))
+
+    def test_flush_after_seats_saved_failed(self):
+        event_engine = engine.EventEngine(str(self.venue.id), str(self.event.id))
+        event_engine.recover()
+        seats_saved = Event.seats_saved
+
+        def failing_seats_saved(event):
+            if not stats.get('engine.saved_errors'):
+                raise ConnectionError('Channel down')
+
+            seats_saved(event)
+
+        with mock.patch.object(Event, 'seats_saved', autospec=True, side_effect=failing_seats_saved):
+            self.assertEquals(self.run_operation(event_engine, 'make_reservation', 'house', [5]), [0])
+            event_engine.flush()
+
+            self.assertEquals(stats.get('engine.saved_errors'), 1)
+            self.assert_reserved_once(event_engine)
+
+    def test_flush_after_write_outcome_lost(self):
+        event_engine = engine.EventEngine(str(self.venue.id), str(self.event.id))
+        event_engine.recover()
+        update_one = QuerySet.update_one
+
+        def lost_update_one(queryset, *args, **kwargs):
+            result = update_one(queryset, *args, **kwargs)
+
+            if not stats.get('engine.flush_errors'):
+                raise AutoReconnect('Connection lost')
+
+            return result
+
+        with mock.patch.object(QuerySet, 'update_one', autospec=True, side_effect=lost_update_one):
+            self.assertEquals(self.run_operation(event_engine, 'make_reservation', 'house', [5]), [0])
+            event_engine.flush()
+
+            self.assertEquals(stats.get('engine.flush_errors'), 1)
+            self.assert_reserved_once(event_engine)
+            self.assertEquals(stats.get('engine.flushed_unsure'), 1)
+
+
+    def test_replay_mismatch(self):
+        event_engine = engine.EventEngine(str(self.venue.id), str(self.event.id))
+        event_engine.recover()
+
+        self.assertEquals(self.run_operation(event_engine, 'make_reservation', 'house', [5]), [0])
+        # Someone else takes the same seats, so running the operation again seats the group elsewhere
+        self.venue.make_reservation(self.event.id, 'house', [5])
+        event_engine.flush()
+        event_engine.journal.close()
+
+        self.assertEquals(stats.get('engine.replay_mismatches'), 1)
+        self.assertEquals(len(event_engine.journal.read()[1]), 1)
+
+        with self.assertRaises(UnavailableException):
+            self.run_operation(event_engine, 'block', 'house', '2', '3')
+
+    def test_event_of_other_partition(self):
+        other = 1 - engine.partition(self.event.id)
+
+        with mock.patch.multiple(settings, EVENT_ENGINE_PARTITIONS=2, EVENT_ENGINE_PARTITION=other):
+            with self.assertRaises(UnavailableException):
+                services.update_event(self.venue.id, self.event.id, 'make_reservation', 'house', [5])
+
+            response = Client().post(
+                f'/api/1.0/venue/{self.venue.id}/event/{self.event.id}/reserve/',
+                json.dumps({'section': 'house', 'group': [5]}), content_type='application/json'
+            )
+
+        self.assertEquals(response.status_code, 503)
+        self.assertEquals(engine._engines, {})
+        self.assertEquals(Event.get(self.venue.id, self.event.id).version, 0)
+
+    def test_check_partitions(self):
+        with mock.patch.dict(os.environ, {'WEB_CONCURRENCY': '1'}):
+            engine.check_partitions()
+
+            with mock.patch.object(settings, 'EVENT_ENGINE_PARTITION', 1):
+                with self.assertRaises(ImproperlyConfigured):
+                    engine.check_partitions()
+
+        with mock.patch.dict(os.environ, {'WEB_CONCURRENCY': '3'}):
+            with self.assertRaises(ImproperlyConfigured):
+                engine.check_partitions()
+
+
+class TestAsyncApi(unittest.TestCase):
+
+    def setUp(self):
+        self.client = Client()
+        self.venue = Venue(venue_name=VENUE['venue_name'], input_json=VENUE)
+        self.venue.create_venue(VENUE['sections'])
+        self.event = self.venue.create_event(date=datetime.strptime(EVENT['date'], settings.DATE_FMT))
+        self.path = f'/api/1.0/venue/{self.venue.id}/event/{self.event.id}/'
+        self.application = AsyncApi()
+        self.loop = asyncio.new_event_loop()
+        stats.reset()
+
+    def tearDown(self):
+        self.loop.run_until_complete(self.application.drain())
+        self.loop.close()
+
+    def request(self, *args, **kwargs) -> tuple:
+        return self.loop.run_until_complete(asgi_request(self.application, *args, **kwargs))
+
+    def test_reservations_coalesced(self):
+        async def reserve_all():
+            responses = await asyncio.gather(*[
+                asgi_request(self.application, 'POST', self.path + 'reserve/', {'section': 'house', 'group': [group]})
+                for group in [2, 3, 1, 2, 20]
+            ])
+            # Answered before the coalescer is done
+            await self.application.drain()
+
+            return responses
+
+        responses = self.loop.run_until_complete(reserve_all())
+        event = Event.get(self.venue.id, self.event.id)
+
+        self.assertEquals([status for status, _, _ in responses], [200, 200, 200, 200, 403])
+        self.assertEquals(json.loads(responses[-1][2]), {'error': 'Couldn\'t seat all people. Missing space for [4]'})
+        self.assertEquals(event.version, 1)
+        self.assertEquals(sum(row.free_seats for row in event.get_section('house').rows['1st Rank']), 0)
+        self.assertEquals(stats.get('coalesced.writes'), 1)
+        self.assertEquals(self.application.coalescers, {})
+
+    def reserve(self, groups: list, cancel: int = None) -> list:
+        async def reserve_all():
+            requests = [
+                asyncio.ensure_future(self.application.update_event(
+                    str(self.venue.id), str(self.event.id), 'make_reservation', 'house', [group]
+                ))
+                for group in groups
+            ]
+
+            if cancel is not None:
+                await asyncio.sleep(0)
+                requests[cancel].cancel()
+
+            results = await asyncio.gather(*requests, return_exceptions=True)
+            await self.application.drain()
+
+            return results
+
+        return self.loop.run_until_complete(reserve_all())
+
+    def test_client_gone(self):
+        results = self.reserve([2, 3, 1], cancel=1)
+
+        self.assertIsInstance(results[1], asyncio.CancelledError)
+        self.assertEquals([results[0], results[2]], [[0], [0]])
+
+        rows = Event.get(self.venue.id, self.event.id).get_section('house').rows['1st Rank']
+
+        self.assertEquals(sum(row.free_seats for row in rows), 21)
+
+    def test_answered_when_seats_saved_fails(self):
+        with mock.patch.object(Event, 'seats_saved', side_effect=ConnectionError('Channel down')):
+            self.assertEquals(self.reserve([2, 3]), [[0], [0]])
+
+        self.assertEquals(stats.get('coalesced.saved_errors'), 1)
+        self.assertEquals(Event.get(self.venue.id, self.event.id).version, 1)
+
+    def test_block(self):
+        seat = {'section': 'house', 'row_id': '2', 'seat_id': '3'}
+        status, _, _ = self.request('POST', self.path + 'block/', seat)
+        self.assertEquals(status, 200)
+
+        status, _, body = self.request('POST', self.path + 'block/', seat)
+        self.assertEquals(status, 403)
+        self.assertEquals(json.loads(body), {'error': 'Couldn\'t block the seat because it is not free.'})
+
+    def test_get_event(self):
+        self.venue.make_reservation(self.event.id, 'house', [5])
+
+        status, headers, body = self.request('GET', self.path)
+
+        self.assertEquals(status, 200)
+        self.assertEquals(json.loads(body), read_json(self.client.get(self.path)))
+
+        status, _, body = self.request('GET', self.path, query_string=b'format=compact')
+
+        self.assertEquals(json.loads(body)['event']['format'], 'compact')
+
+        status, _, _ = self.request('GET', self.path, headers=[(b'if-none-match', headers[b'etag'])])
+
+        self.assertEquals(status, 304)
+
+    def test_stream(self):
+        self.venue.make_reservation(self.event.id, 'house', [2])
+
+        async def stream_and_block():
+            stream = asyncio.ensure_future(
+                asgi_request(self.application, 'GET', self.path + 'stream/', query_string=b'since=0')
+            )
+            await asyncio.sleep(0.1)
+
+            self.assertEquals(broadcaster.number_subscribers(str(self.event.id)), 1)
+
+            await asgi_request(
+                self.application, 'POST', self.path + 'block/', {'section': 'house', 'row_id': '2', 'seat_id': '3'}
+            )
+
+            return await stream
+
+        with mock.patch.multiple(settings, SEAT_STREAM_TIMEOUT=0.5, SEAT_STREAM_HEARTBEAT=0.1):
+            status, headers, body = self.loop.run_until_complete(stream_and_block())
+
+        messages = [message for message in body.decode().split('\n\n') if message.startswith('id: ')]
+
+        self.assertEquals(status, 200)
+        self.assertEquals(headers[b'content-type'], b'text/event-stream')
+        self.assertTrue(messages[0].startswith('id: 1\nevent: changes\n'))
+        self.assertTrue(messages[1].startswith('id: 2\nevent: changes\n'))
+        self.assertEquals(json.loads(messages[1].split('data: ')[1])['changes'][0]['seats'][0]['state'], 'blocked')
+        self.assertEquals(broadcaster.number_subscribers(str(self.event.id)), 0)
+
+    def test_stream_not_found(self):
+        status, _, _ = self.request(
+            'GET', f'/api/1.0/venue/{self.venue.id}/event/{ObjectId()}/stream/', query_string=b'since=0'
+        )
+
+        self.assertEquals(status, 404)
+        self.assertEquals(broadcaster.number_subscribers(str(self.event.id)), 0)
+
+    def test_stream_missing_change(self):
+        async def stream_and_block():
+            stream = asyncio.ensure_future(
+                asgi_request(self.application, 'GET', self.path + 'stream/', query_string=b'since=0')
+            )
+            await asyncio.sleep(0.1)
+
+            with mock.patch.object(broadcaster, 'publish', side_effect=ConnectionError('Channel down')):
+                self.venue.block(self.event.id, 'house', '2', '3')
+
+            self.venue.block(self.event.id, 'house', '2', '4')
+
+            return await stream
+
+        with mock.patch.multiple(
+            settings, SEAT_STREAM_TIMEOUT=0.5, SEAT_STREAM_HEARTBEAT=0.1, SEAT_STREAM_REORDER_WINDOW=0.1
+        ):
+            _, _, body = self.loop.run_until_complete(stream_and_block())
+
+        messages = [
+            json.loads(message.split('data: ')[1]) for message in body.decode().split('\n\n')
+            if message.startswith('id: ')
+        ]
+
+        self.assertEquals([[change['version'] for change in message['changes']] for message in messages], [
+            [], [2], [1]
+        ])
+        self.assertEquals(stats.get('stream.caught_up'), 1)
+
+    def test_stream_reordered(self):
+        changes = ChangeStream({'version': 0, 'changes': []})
+
+        self.assertIsNotNone(changes.change({'version': 2, 'seats': []}))
+        self.assertEquals(list(changes.missing), [1])
+        self.assertIsNotNone(changes.change({'version': 1, 'seats': []}))
+        self.assertIsNone(changes.change({'version': 2, 'seats': []}))
+        self.assertEquals((changes.since, changes.missing, changes.overdue()), (2, {}, False))
+
+    def test_metrics(self):
+        self.request('POST', self.path + 'reserve/', {'section': 'house', 'group': [2]})
+
+        self.assertEquals(stats.histogram('request_seconds', view='AsyncApi.reserve', method='POST', status=200)[1], 1)
+
+    def test_event_engine(self):
+        journal_dir = tempfile.mkdtemp()
+
+        try:
+            with mock.patch.multiple(
+                settings, EVENT_ENGINE=True, EVENT_ENGINE_JOURNAL_DIR=journal_dir, EVENT_ENGINE_FLUSH_INTERVAL=60
+            ):
+                status, _, _ = self.request('POST', self.path + 'reserve/', {'section': 'house', 'group': [5]})
+                engine.stop_engines()
+        finally:
+            shutil.rmtree(journal_dir)
+
+        event = Event.get(self.venue.id, self.event.id)
+
+        self.assertEquals(status, 200)
+        self.assertEquals(stats.get('coalesced.writes'), 0)
+        self.assertEquals(event.version, 1)
+        self.assertEquals(sum(row.free_seats for row in event.get_section('house').rows['1st Rank']), 19)
+
+    def test_lifespan(self):
+        messages = [{'type': 'lifespan.startup'}, {'type': 'lifespan.shutdown'}]
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        with mock.patch('api.asgi.sweeper') as sweeper:
+            self.loop.run_until_complete(self.application({'type': 'lifespan'}, receive, send))
+
+        sweeper.start.assert_called_once_with()
+        self.assertEquals(
+            [message['type'] for message in sent], ['lifespan.startup.complete', 'lifespan.shutdown.complete']
+        )
+
+    def test_errors(self):
+        path = f'/api/1.0/venue/{self.venue.id}/event/{ObjectId()}/'
+
+        self.assertEquals(self.request('GET', path)[0], 404)
+        self.assertEquals(self.request('POST', path + 'reserve/', {'section': 'house', 'group': [2]})[0], 404)
+        self.assertEquals(self.request('POST', self.path + 'reserve/', {'section': 'house'})[0], 400)
+        self.assertEquals(self.request('GET', path + 'stream/', query_string=b'since=0')[0], 404)
+        self.assertEquals(self.request('GET', self.path + 'stream/')[0], 400)
+        self.assertEquals(self.request('GET', '/api/1.0/stats/')[0], 404)
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.client = Client()
+        self.venue = Venue(venue_name=VENUE['venue_name'], input_json=VENUE)
+        self.venue.create_venue(VENUE['sections'])
+        self.event = self.venue.create_event(date=datetime.strptime(EVENT['date'], settings.DATE_FMT))
+        stats.reset()
+
+    def test_metrics(self):
+        self.client.post(
+            f'/api/1.0/venue/{self.venue.id}/event/{self.event.id}/reserve/',
+            json.dumps({'section': 'house', 'group': [5]}), content_type="application/json"
+        )
+        read_json(self.client.get(f'/api/1.0/venue/{self.venue.id}/event/{self.event.id}/'))
+
+        self.assertEquals(stats.histogram('stage_seconds', stage='make_reservation.save')[1], 1)
+        self.assertEquals(stats.histogram('seats_written'), (5, 1))
+
+        res = self.client.get('/api/1.0/metrics/')
+        metrics = res.content.decode().split('\n')
+
+        self.assertEquals(res.status_code, 200)
+        self.assertIn('buy_a_ticket_make_reservation_succeeded_total 1', metrics)
+        self.assertIn('buy_a_ticket_seats_written_bucket{le="5"} 1', metrics)
+        self.assertIn('buy_a_ticket_seats_written_bucket{le="2"} 0', metrics)
+        self.assertIn('buy_a_ticket_stage_seconds_count{stage="serialize"} 1', metrics)
+        self.assertIn(
+            'buy_a_ticket_request_seconds_count{method="POST",status="200",view="VenueEventReservationView"} 1', metrics
+        )
+
+    def test_reset(self):
+        stats.observe('seats', 3, stats.SEAT_BUCKETS)
+        stats.reset()
+        stats.observe('seats', 3, (5,))
+
+        self.assertEquals(stats.histogram('seats'), (3, 1))
+        self.assertIn('buy_a_ticket_seats_bucket{le="5"} 1', stats.exposition().split('\n'))
+
+    def test_metrics_disabled(self):
+        with mock.patch.object(settings, 'METRICS_ENABLED', False):
+            self.venue.make_reservation(self.event.id, 'house', [5])
+
+            self.assertIs(stats.timer('stage'), stats.NO_TIMER)
+
+        self.assertEquals(stats.histogram('seats_written'), (0, 0))
+        self.assertEquals(stats.get('make_reservation.succeeded'), 1)
+
+
+class TestBenchmarks(unittest.TestCase):
+
+    def test_generate_venue(self):
+        venue_json = benchmarks.generate_venue(1000, seats_per_row=30)
+        num_seats = sum(
+            row['num_seats'] * row['num_rows'] for section in venue_json['sections'] for row in section['rows']
+        )
+
+        self.assertEquals(num_seats, 1020)
+        self.assertEquals(len(venue_json['sections']), 2)
+
+    def test_no_seats(self):
+        with self.assertRaises(ValueError):
+            benchmarks.generate_venue(0)
+
+        with self.assertRaises(CommandError):
+            call_command('benchmark', '--seats', '0', stdout=StringIO())
+
+    def test_run(self):
+        summaries = benchmarks.run(200, iterations=3)
+
+        self.assertEquals(summaries[0]['runs'], 1)
+        self.assertTrue(all(summary['runs'] == 3 for summary in summaries[1:]))
+        self.assertTrue(all(summary['p99'] >= summary['p50'] for summary in summaries))
+
+
+class TestMigrateEvents(unittest.TestCase):
+
+    def setUp(self):
+        self.venue = Venue(venue_name=VENUE['venue_name'], input_json=VENUE)
+        self.venue.create_venue(VENUE['sections'])
+        self.event_id = ObjectId()
+
+        Venue.objects(id=self.venue.id).update_one(__raw__={'$set': {'events': [{
+            'id': self.event_id,
+            'event_name': EVENT['event_name'],
+            'created_at': datetime.now(),
+            'date': datetime.strptime(EVENT['date'], settings.DATE_FMT),
+            'sections': self.venue.to_mongo()['base_layout']
+        }]}})
+
+    def test_migrate_events(self):
+        call_command('migrate_events', stdout=StringIO())
+
+        event = Event.get(self.venue.id, self.event_id)
+
+        self.assertEquals(event.event_name, EVENT['event_name'])
+        self.assertTrue('events' not in Venue._get_collection().find_one({'_id': self.venue.id}))
+
+
+class TestImportVenues(unittest.TestCase):
+
+    def setUp(self):
+        self.existing = Venue(venue_name=VENUE['venue_name'], input_json=VENUE)
+        self.existing.create_venue(VENUE['sections'])
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'venues.ndjson')
+        self.names = [f'Imported {ObjectId()}' for _ in range(3)]
+
+        with open(self.path, 'w') as venues:
+            venues.write('\n'.join([
+                json.dumps(dict(VENUE, venue_name=self.names[0])),
+                json.dumps(VENUE),
+                '{"venue_name": "Broken"',
+                '',
+                json.dumps(dict(VENUE, venue_name=self.names[1])),
+                json.dumps(dict(VENUE, venue_name=self.names[0]))
+            ]) + '\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_import_venues(self):
+        out = StringIO()
+        err = StringIO()
+        call_command('import_venues', self.path, '--batch-size', '2', '--workers', '2', stdout=out, stderr=err)
+
+        venue = Venue.objects(venue_name=self.names[0])[0]
+
+        self.assertEquals(Venue.objects(venue_name__in=self.names).count(), 2)
+        self.assertEquals(venue.to_dict()['base_layout'], self.existing.to_dict()['base_layout'])
+        self.assertIn('Imported 2 venues (48 seats)', out.getvalue())
+        self.assertIn('Skipped 2 existing and 1 invalid', out.getvalue())
+        self.assertIn('Line 3 skipped', err.getvalue())
+
+    def test_resume_import(self):
+        insert_many = Venue._get_collection().insert_many
+        calls = []
+
+        def failing_insert_many(documents, **kwargs):
+            calls.append(documents)
+
+            # The second batch is written but the answer is lost
+            if len(calls) == 2:
+                insert_many(documents, **kwargs)
+                raise BulkWriteError({'nInserted': 1, 'writeErrors': [{'errmsg': 'Lost the connection'}]})
+
+            return insert_many(documents, **kwargs)
+
+        with mock.patch.object(Venue._get_collection(), 'insert_many', side_effect=failing_insert_many):
+            with self.assertRaises(CommandError):
+                call_command(
+                    'import_venues', self.path, '--batch-size', '2', '--workers', '0', stdout=StringIO(),
+                    stderr=StringIO()
+                )
+
+        with open(f'{self.path}.checkpoint') as checkpoint:
+            self.assertEquals(checkpoint.read(), '2')
+
+        with open(self.path, 'a') as venues:
+            venues.write(json.dumps(dict(VENUE, venue_name=self.names[2])) + '\n')
+
+        out = StringIO()
+        call_command('import_venues', self.path, '--workers', '0', stdout=out, stderr=StringIO())
+
+        self.assertEquals(Venue.objects(venue_name__in=self.names).count(), 3)
+        self.assertIn('Imported 1 venues', out.getvalue())
@@ -16,7 +16,24 @@ urlpatterns = [
         csrf_exempt(views.VenueEventView.as_view())),
     url(r'^1.0/venue/(?P<venue_id>[a-zA-Z0-9]+)/event/(?P<event_id>[a-zA-Z0-9]+)/reserve/?$',
         csrf_exempt(views.VenueEventReservationView.as_view())),
+    url(r'^1.0/venue/(?P<venue_id>[a-zA-Z0-9]+)/event/(?P<event_id>[a-zA-Z0-9]+)/reserve/batch/?$',
+        csrf_exempt(views.VenueEventBatchReservationView.as_view())),
     url(r'^1.0/venue/(?P<venue_id>[a-zA-Z0-9]+)/event/(?P<event_id>[a-zA-Z0-9]+)/block/?$',
         csrf_exempt(views.VenueEventBlockView.as_view())),
+    url(r'^1.0/venue/(?P<venue_id>[a-zA-Z0-9]+)/event/(?P<event_id>[a-zA-Z0-9]+)/hold/?$',
+        csrf_exempt(views.VenueEventHoldView.as_view())),
+    url(r'^1.0/venue/(?P<venue_id>[a-zA-Z0-9]+)/event/(?P<event_id>[a-zA-Z0-9]+)/hold/(?P<hold_id>[a-f0-9]+)/'
+        r'(?P<action>confirm|release)/?$',
+        csrf_exempt(views.VenueEventHoldActionView.as_view())),
+    url(r'^1.0/venue/(?P<venue_id>[a-zA-Z0-9]+)/event/(?P<event_id>[a-zA-Z0-9]+)/summary/?$',
+        csrf_exempt(views.VenueEventSummaryView.as_view())),
+    url(r'^1.0/venue/(?P<venue_id>[a-zA-Z0-9]+)/event/(?P<event_id>[a-zA-Z0-9]+)/changes/?$',
+        csrf_exempt(views.VenueEventChangesView.as_view())),
+    url(r'^1.0/venue/(?P<venue_id>[a-zA-Z0-9]+)/event/(?P<event_id>[a-zA-Z0-9]+)/stream/?$',
+        csrf_exempt(views.VenueEventStreamView.as_view())),
+    url(r'^1.0/stats/?$',
+        csrf_exempt(views.StatsView.as_view())),
+    url(r'^1.0/metrics/?$',
+        csrf_exempt(views.MetricsView.as_view())),
 
 ]
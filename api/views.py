@@ -1,41 +1,68 @@
+from bson import ObjectId
 from datetime import datetime
 import json
 from json.decoder import JSONDecodeError
 from mongoengine.errors import OperationError
+import time
+from uuid import uuid4
 
 from django.conf import settings
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.views.generic import View
 
-from api.models import Venue
-from api.exceptions import NotFoundException
+from api import services, stats
+from api.models import Event, Venue
+from api.exceptions import ConflictException, NotFoundException, UnavailableException
+from api.holds import sweeper
+from api.serializers import JsonArray, iter_chunks, venue_json
+
+
+def flag(request, name: str) -> bool:
+    """
+    A boolean query parameter, on when it is true, 1 or yes (in any case)
+    """
+    return request.GET.get(name, '').lower() in ('true', '1', 'yes')
 
 
 class VenuesView(View):
-    def get(self, request, page):
-        items_per_page = 10
-        venues = Venue.objects.skip((int(page) - 1) * items_per_page).limit(items_per_page)
+    def get(self, request, page=None):
+        after = request.GET.get('after')
+        full = flag(request, 'full')
 
-        return JsonResponse({'venues': [venue.to_dict() for venue in venues]})
+        try:
+            size = min(max(int(request.GET.get('size', settings.VENUES_PAGE_SIZE)), 1), settings.VENUES_MAX_PAGE_SIZE)
+        except ValueError:
+            return JsonResponse({'error': 'The page size must be a number'}, status=400)
 
+        if after is not None and not ObjectId.is_valid(after):
+            return JsonResponse({'error': f'Venue id {after} is not valid'}, status=400)
 
-class VenueView(View):
-    def get(self, request, venue_id):
-        exclude = []
+        venues = Venue.get_page(size, after=after, page=int(page) if page else None)
 
-        if not request.GET.get('events', False):
-            exclude.append('events')
+        if full:
+            ids = [venue.id for venue in venues.only('id')]
+            venues = JsonArray(venue_json(venue, events=True) for venue in Venue.objects(id__in=ids).order_by('id'))
+        else:
+            venues = Venue.get_summaries(venues)
+            ids = [venue['id'] for venue in venues]
 
-        if not request.GET.get('layout', False):
-            exclude.append('base_layout')
+        return StreamingHttpResponse(iter_chunks({
+            'venues': venues,
+            # The venue to continue after, until a page comes short
+            'next': str(ids[-1]) if len(ids) == size else None
+        }), content_type='application/json')
+
+
+class VenueView(View):
+    def get(self, request, venue_id):
+        layout = flag(request, 'layout')
+        events = flag(request, 'events')
 
         try:
-            venue = Venue.objects(id=venue_id).exclude(*exclude)[0]
-        except IndexError:
+            return services.venue_response(request, venue_id, layout, events)
+        except NotFoundException:
             return JsonResponse({'error': f'Venue with id {venue_id} not found'}, status=404)
 
-        return JsonResponse({'venue': venue.to_dict()})
-
     def post(self, request):
         try:
             data = json.loads(request.body)
@@ -58,14 +85,10 @@ class VenueView(View):
 class VenueEventView(View):
     def get(self, request, venue_id, event_id):
         try:
-            event = Venue.objects(id=venue_id)[0].get_event(event_id=event_id)
-        except IndexError:
-            return JsonResponse({'error': f'Venue with id {venue_id} not found'}, status=404)
+            return services.event_response(request, venue_id, event_id, request.GET.get('format') == 'compact')
         except NotFoundException:
             return JsonResponse({'error': f'Event with id {event_id} not found'}, status=404)
 
-        return JsonResponse({'event': event.to_dict()})
-
     def post(self, request, venue_id):
         try:
             data = json.loads(request.body)
@@ -75,7 +98,7 @@ class VenueEventView(View):
             return JsonResponse({'error': 'Malformed JSON'}, status=400)
 
         try:
-            venue = Venue.objects(id=venue_id)[0]
+            venue = Venue.objects(id=venue_id).exclude('input_json', 'base_layout')[0]
         except IndexError:
             return JsonResponse({'error': f'Venue with id {venue_id} not found'}, status=404)
 
@@ -97,11 +120,13 @@ class VenueEventReservationView(View):
             return JsonResponse({'error': 'Malformed JSON'}, status=400)
 
         try:
-            result = Venue.objects(id=venue_id)[0].make_reservation(event_id, section, group)
-        except IndexError:
-            return JsonResponse({'error': f'Venue with id {venue_id} not found'}, status=404)
+            result = services.update_event(venue_id, event_id, 'make_reservation', section, group)
         except NotFoundException:
             return JsonResponse({'error': f'Event with id {event_id} not found'}, status=404)
+        except ConflictException:
+            return JsonResponse({'error': 'The event is too busy right now, please try again'}, status=409)
+        except UnavailableException as error:
+            return JsonResponse({'error': str(error)}, status=503)
 
         if all([True if num_people == 0 else False for num_people in result]):
             return JsonResponse({})
@@ -109,6 +134,117 @@ class VenueEventReservationView(View):
         return JsonResponse({'error': f'Couldn\'t seat all people. Missing space for {result}'}, status=403)
 
 
+class VenueEventBatchReservationView(View):
+    def post(self, request, venue_id, event_id):
+        try:
+            data = json.loads(request.body)
+            reservations = [
+                (reservation['section'], [int(element) for element in list(reservation['group'])])
+                for reservation in data['reservations']
+            ]
+        except (JSONDecodeError, KeyError, TypeError, ValueError):
+            return JsonResponse({'error': 'Malformed JSON'}, status=400)
+
+        try:
+            results = services.update_event(venue_id, event_id, 'make_reservations', reservations)
+        except NotFoundException:
+            return JsonResponse({'error': f'Event with id {event_id} not found'}, status=404)
+        except ConflictException:
+            return JsonResponse({'error': 'The event is too busy right now, please try again'}, status=409)
+        except UnavailableException as error:
+            return JsonResponse({'error': str(error)}, status=503)
+
+        return JsonResponse({'results': [
+            {'seated': all([num_people == 0 for num_people in result]), 'missing': result} for result in results
+        ]})
+
+
+class VenueEventHoldView(View):
+    def post(self, request, venue_id, event_id):
+        try:
+            data = json.loads(request.body)
+            group = [int(element) for element in list(data['group'])]
+            section = data['section']
+            ttl = min(max(int(data.get('ttl', settings.HOLD_TTL)), 1), settings.HOLD_MAX_TTL)
+        except (JSONDecodeError, KeyError, TypeError, ValueError):
+            return JsonResponse({'error': 'Malformed JSON'}, status=400)
+
+        # Made here rather than in the operation so it is the same when the operation is run again
+        hold_id = uuid4().hex
+        expires_at = time.time() + ttl
+
+        try:
+            result = services.update_event(venue_id, event_id, 'hold', section, group, hold_id, expires_at)
+        except NotFoundException:
+            return JsonResponse({'error': f'Event with id {event_id} not found'}, status=404)
+        except ConflictException:
+            return JsonResponse({'error': 'The event is too busy right now, please try again'}, status=409)
+        except UnavailableException as error:
+            return JsonResponse({'error': str(error)}, status=503)
+
+        if not result['seats']:
+            return JsonResponse(
+                {'error': f'Couldn\'t hold any seat. Missing space for {result["missing"]}'}, status=403
+            )
+
+        if settings.HOLD_SWEEPER:
+            sweeper.schedule(venue_id, event_id, expires_at)
+
+        return JsonResponse({'hold': {
+            'id': hold_id,
+            'expires_at': datetime.utcfromtimestamp(expires_at).isoformat(),
+            'seated': all([num_people == 0 for num_people in result['missing']]),
+            'missing': result['missing'],
+            'seats': result['seats']
+        }})
+
+
+class VenueEventHoldActionView(View):
+    def post(self, request, venue_id, event_id, hold_id, action):
+        args = (hold_id, time.time()) if action == 'confirm' else (hold_id,)
+
+        try:
+            result = services.update_event(venue_id, event_id, action, *args)
+        except NotFoundException:
+            return JsonResponse({'error': f'Event with id {event_id} not found'}, status=404)
+        except ConflictException:
+            return JsonResponse({'error': 'The event is too busy right now, please try again'}, status=409)
+        except UnavailableException as error:
+            return JsonResponse({'error': str(error)}, status=503)
+
+        if not result:
+            return JsonResponse({'error': f'Hold with id {hold_id} not found or expired'}, status=404)
+
+        return JsonResponse({})
+
+
+class VenueEventSummaryView(View):
+    def get(self, request, venue_id, event_id):
+        try:
+            return JsonResponse({'summary': Event.get_summary(venue_id, event_id)})
+        except NotFoundException:
+            return JsonResponse({'error': f'Event with id {event_id} not found'}, status=404)
+
+
+class VenueEventChangesView(View):
+    def get(self, request, venue_id, event_id):
+        try:
+            since = int(request.GET['since'])
+        except (KeyError, ValueError):
+            return JsonResponse({'error': 'A version is expected in since'}, status=400)
+
+        try:
+            return JsonResponse(Event.get_changes(venue_id, event_id, since))
+        except NotFoundException:
+            return JsonResponse({'error': f'Event with id {event_id} not found'}, status=404)
+
+
+class VenueEventStreamView(View):
+    def get(self, request, venue_id, event_id):
+        # Streams would hold a worker each for minutes, they are only served by the ASGI application (see api.asgi)
+        return JsonResponse({'error': 'Streams are only served by the ASGI application'}, status=501)
+
+
 class VenueEventBlockView(View):
     def post(self, request, venue_id, event_id):
         try:
@@ -120,13 +256,25 @@ class VenueEventBlockView(View):
             return JsonResponse({'error': 'Malformed JSON'}, status=400)
 
         try:
-            result = Venue.objects(id=venue_id)[0].block(event_id, section, row_id, seat_id)
-        except IndexError:
-            return JsonResponse({'error': f'Venue with id {venue_id} not found'}, status=404)
+            result = services.update_event(venue_id, event_id, 'block', section, row_id, seat_id)
         except NotFoundException:
             return JsonResponse({'error': f'Event with id {event_id} not found'}, status=404)
+        except ConflictException:
+            return JsonResponse({'error': 'The event is too busy right now, please try again'}, status=409)
+        except UnavailableException as error:
+            return JsonResponse({'error': str(error)}, status=503)
 
         response, status = ({}, 200) if result \
             else ({'error': f'Couldn\'t block the seat because it is not free.'}, 403)
 
         return JsonResponse(response, status=status)
+
+
+class StatsView(View):
+    def get(self, request):
+        return JsonResponse({'stats': stats.snapshot()})
+
+
+class MetricsView(View):
+    def get(self, request):
+        return HttpResponse(stats.exposition(), content_type='text/plain; version=0.0.4')
@@ -0,0 +1,20 @@
+"""
+ASGI config for buy_a_ticket project.
+
+It exposes the ASGI callable as a module-level variable named ``application``. The event reads, reservations,
+blocks and streams of seat changes are served with asyncio (see api/asgi.py), everything else by the Django
+application.
+"""
+
+import os
+
+from asgiref.wsgi import WsgiToAsgi
+from django.core.wsgi import get_wsgi_application
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "buy_a_ticket.settings")
+
+django_application = get_wsgi_application()
+
+from api.asgi import AsyncApi  # noqa: E402 (needs the settings loaded)
+
+application = AsyncApi(fallback=WsgiToAsgi(django_application))
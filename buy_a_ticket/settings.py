@@ -40,11 +40,12 @@ INSTALLED_APPS = [
     'django.contrib.messages',
     'django.contrib.staticfiles',
     'mongoengine',
-    'api',
+    'api.apps.ApiConfig',
     'web'
 ]
 
 MIDDLEWARE = [
+    'api.middleware.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -124,6 +125,81 @@ mongoengine.connect(**MONGODB_DATABASES[os.environ.get('ENV', 'default')])
 
 DATE_FMT = '%d-%m-%YT%H:%M:%S'
 API_VERSION = '1.0'
-API_URL = f'http://localhost:8000/api/{API_VERSION}'
+
+# Number of times a reservation or block is retried on fresh data when the event was changed by another worker, and
+# seconds waited at most before the first retry, doubled on every other one (each wait is picked at random)
+EVENT_UPDATE_RETRIES = 5
+EVENT_UPDATE_BACKOFF = 0.005
+
+# New events reference the venue layout and only store the rows with seats reserved or blocked, one byte per seat,
+# instead of a full copy of the layout
+COMPACT_EVENTS = True
+
+# Number of seats of the venue layouts each worker keeps in memory, shared by the compact events of the venues
+# (a seat takes about 1 KB)
+LAYOUT_CACHE_SEATS = 100000
+
+# Number of serialized event and venue responses each worker keeps, and the Django cache (see CACHES) backing them
+# to share them between the workers of a node (None to keep them per worker only)
+RESPONSE_CACHE_SIZE = 128
+RESPONSE_CACHE_SHARED = None
+
+# Biggest response, in bytes, kept by the cache above, as responses are streamed but cached whole, and size of the
+# chunks responses are streamed in
+RESPONSE_CACHE_MAX_BYTES = 1024 * 1024
+STREAMING_CHUNK_SIZE = 64 * 1024
+
+# Number of writes each event keeps in its log of seat changes, for clients asking for the changes since a version
+EVENT_CHANGE_LOG_SIZE = 500
+
+# Redis URL seat changes are published on to reach the streams of every worker (None to publish them within the
+# worker only, which only works with a single worker), seconds between keep-alive messages and before a stream is
+# closed for the client to reconnect, number of changes queued for a client before it is told to start over, and
+# seconds a change skipped over by a newer one is waited for before it is looked up in the event
+SEAT_STREAM_CHANNELS = {
+    "default": 'redis://localhost:6379/0',
+    "test": None
+}
+SEAT_STREAM_CHANNEL = SEAT_STREAM_CHANNELS[os.environ.get('ENV', 'default')]
+SEAT_STREAM_HEARTBEAT = 15
+SEAT_STREAM_TIMEOUT = 300
+SEAT_STREAM_QUEUE_SIZE = 100
+SEAT_STREAM_REORDER_WINDOW = 1
+
+# Records the time taken by requests and their stages, the size of responses and the seats written in histograms
+# (see /api/1.0/metrics/)
+METRICS_ENABLED = True
+
+# Runs the reservations and blocks of each event in memory, in a single thread of the process owning the event,
+# journaling them to EVENT_ENGINE_JOURNAL_DIR and writing the seats taken to the database every
+# EVENT_ENGINE_FLUSH_INTERVAL seconds. Events are split between EVENT_ENGINE_PARTITIONS processes by id and each
+# process owns the EVENT_ENGINE_PARTITION one (see api/engine.py), refusing the others with 503. Every process must
+# run a single worker (WEB_CONCURRENCY=1) so the engine is the only writer of its events. Operations not answered within
+# EVENT_ENGINE_TIMEOUT seconds are answered 409, and engines idle for EVENT_ENGINE_IDLE_TIMEOUT seconds are stopped
+EVENT_ENGINE = False
+EVENT_ENGINE_JOURNAL_DIR = os.path.join(BASE_DIR, 'journal')
+EVENT_ENGINE_FLUSH_INTERVAL = 0.05
+EVENT_ENGINE_TIMEOUT = 10
+EVENT_ENGINE_IDLE_TIMEOUT = 60
+EVENT_ENGINE_PARTITIONS = int(os.environ.get('EVENT_ENGINE_PARTITIONS', 1))
+EVENT_ENGINE_PARTITION = int(os.environ.get('EVENT_ENGINE_PARTITION', 0))
+
+# Seconds the reservations and blocks of an event are gathered for by the ASGI application before running them
+# as a single batch, and the threads running the database calls when motor isn't installed (see api/asgi.py)
+ASYNC_COALESCE_WINDOW = 0.005
+ASYNC_DB_THREADS = 16
+
+# Seconds seats are held for by default and at most, and seconds between the looks for holds expired which were
+# made by other processes (see api/holds.py). HOLD_SWEEPER starts the thread releasing expired holds with the
+# application (see buy_a_ticket/wsgi.py and AsyncApi.lifespan)
+HOLD_TTL = 600
+HOLD_MAX_TTL = 1800
+HOLD_SWEEPER = True
+HOLD_SWEEP_INTERVAL = 5
+
+# Number of venues listed per page by default and at most, and number of events listed with each of them
+VENUES_PAGE_SIZE = 10
+VENUES_MAX_PAGE_SIZE = 100
+VENUE_SUMMARY_EVENTS = 20
 
 STATIC_URL = '/static/'
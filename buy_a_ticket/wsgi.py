@@ -14,3 +14,10 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "buy_a_ticket.settings")
 
 application = get_wsgi_application()
+
+from django.conf import settings  # noqa: E402 (needs the settings loaded)
+from api.holds import sweeper  # noqa: E402
+
+if settings.HOLD_SWEEPER:
+    # Releases the holds left expired by a restart or by other processes too
+    sweeper.start()
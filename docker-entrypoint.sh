@@ -4,12 +4,23 @@ touch /opt/buy_a_ticket/logs/gunicorn.log
 touch /opt/buy_a_ticket/logs/access.log
 tail -n 0 -f /opt/buy_a_ticket/logs/*.log &
 
-echo Starting Gunicorn.
+echo Starting Redis, seat changes reach the streams of every worker through it.
 
-exec gunicorn buy_a_ticket.wsgi:application \
+service redis-server start
+
+echo Moving embedded events to their own collection.
+
+python manage.py migrate_events
+
+echo Starting Gunicorn with the ASGI application.
+
+# Read by gunicorn for the number of workers, and by the event engine which needs a single one
+export WEB_CONCURRENCY=${WEB_CONCURRENCY:-3}
+
+exec gunicorn buy_a_ticket.asgi:application \
     --name buy_a_ticket \
     --bind=0.0.0.0:8000 \
-    --workers 3 \
+    --worker-class uvicorn.workers.UvicornWorker \
     --log-level=info \
     --log-file=/opt/buy_a_ticket/logs/gunicorn.log \
     --access-logfile=/opt/buy_a_ticket/logs/access.log \
@@ -1,8 +1,9 @@
-import requests
-
-from django.conf import settings
+from django.http import Http404
 from django.views import generic
 
+from api import services
+from api.exceptions import NotFoundException
+
 
 class TemplateView(generic.TemplateView):
     def __init__(self, *args, **kwargs):
@@ -14,8 +15,11 @@ class VenueEventView(TemplateView):
     template_name = "event.html"
 
     def get(self, request, venue_id, event_id, *args, **kwargs):
-        response = requests.get(f'{settings.API_URL}/venue/{venue_id}/event/{event_id}/').json()
-        self.context.update(response)
+        try:
+            self.context.update({'event': services.get_event(venue_id, event_id)})
+        except NotFoundException:
+            raise Http404(f'Event with id {event_id} not found')
+
         return super(VenueEventView, self).get(request, *args, **kwargs)
 
     def get_context_data(self, **kwargs):